@@ -223,10 +223,12 @@ from flask_pymongo import PyMongo
 from flask_login import LoginManager
 from flask_wtf.csrf import CSRFProtect
 from bson import ObjectId
-from pymongo import ASCENDING
 import logging
-from dateutil import parser # Ensure dateutil is installed (pip install python-dateutil)
 from extensions import mongo, login_manager, csrf, mail
+from services.mail_dispatcher import mail_dispatcher
+from services.user_cache import user_cache
+from commands import register_commands
+from utils.upload_stream import StreamingUploadRequest
 from models import User
 # Import Config from config.py
 from config import Config
@@ -235,6 +237,7 @@ from config import Config
 from routes.auth import auth_bp
 from routes.main import main_bp
 from routes.admin import admin_bp # <<< Ensure this import is correct
+from routes.api import api_bp
 
 
 # Set project root and Python path (Keep these if you were using them)
@@ -250,15 +253,23 @@ sys.path.append(str(PROJECT_ROOT))
 # mail = Mail()
 
 
+logger = logging.getLogger(__name__)
+
+
 def create_app(test_config=None):
     """Application factory function"""
     app = Flask(__name__, static_folder='static', static_url_path='/static')
+    # Stream uploaded files straight into the upload folder (hashing as they arrive)
+    app.request_class = StreamingUploadRequest
 
     # Load configuration with environment check
     app.config.from_object(Config)
     if test_config:
         app.config.update(test_config)
 
+    # Flask's send_file emits X-Sendfile headers itself when this is on
+    app.config['USE_X_SENDFILE'] = app.config.get('FILE_SERVING_MODE') == 'x-sendfile'
+
     # Verify MONGO_URI is set before initialization
     if not app.config.get('MONGO_URI'):
         raise ValueError("MONGO_URI not configured in environment or Config")
@@ -269,6 +280,8 @@ def create_app(test_config=None):
     login_manager.init_app(app)
     csrf.init_app(app)
     mail.init_app(app)
+    mail_dispatcher.init_app(app) # Worker threads start lazily on first queued email
+    user_cache.init_app(app)
 
 
     # Configure template filter (keep as is)
@@ -276,6 +289,8 @@ def create_app(test_config=None):
     def datetimeformat(value, fmt='%Y-%m-%d %H:%M:%S'):
         if isinstance(value, datetime):
             return value.strftime(fmt)
+        # dateutil is only needed for legacy string dates, so it is not imported at startup
+        from dateutil import parser
         try:
             if isinstance(value, str): # Only attempt to parse strings
                 # Handle potential timezone info if present
@@ -295,69 +310,19 @@ def create_app(test_config=None):
              return ''
 
 
-    # Database initialization with explicit connection (keep this)
-    with app.app_context():
-        try:
-            # Force connection establishment (optional, but good for testing)
-            mongo.cx.server_info()
-            print("✅ MongoDB connection successful")
+    # Collections and indexes are created by `flask --app app nemsa bootstrap`
+    # (run once per deploy), not here: importing the app must not touch MongoDB.
 
-            # Index creation with improved checks (keep as is)
-            def safe_create_index(collection, keys, **kwargs):
-                """Create index only if it doesn't exist with same key pattern"""
-                existing_indexes = collection.index_information()
 
-                for index in existing_indexes.values():
-                    if index.get('key') == keys:
-                        print(f"⚠️ Index for {keys} already exists.")
-                        return list(index.keys())
-
-                try:
-                     index_name = collection.create_index(keys, **kwargs)
-                     print(f"🆕 Created index: {index_name} for {keys}")
-                     return index_name
-                except Exception as e:
-                     print(f"❌ Failed to create index for {keys}: {e}")
-                     return None
-
-
-            # Initialize collections if needed (keep as is)
-            required_collections = {'users', 'documents'}
-            existing_collections = set(mongo.db.list_collection_names())
-
-            for coll in required_collections - existing_collections:
-                mongo.db.create_collection(coll)
-                print(f"🆕 Created collection: {coll}")
-
-            # Create indexes with proper order constants (keep as is)
-            documents_index = safe_create_index(
-                mongo.db.documents,
-                [('user_id', ASCENDING), ('status', ASCENDING)],
-                name='user_status_idx',
-                background=True
-            )
-
-            users_index = safe_create_index(
-                mongo.db.users,
-                [('email', ASCENDING)],
-                name='unique_email_idx',
-                unique=True,
-                partialFilterExpression={'email': {'$exists': True}},
-                background=True
-            )
-
-
-        except Exception as e:
-            error_msg = f"Database initialization failed: {str(e)}"
-            app.logger.error(error_msg, exc_info=True)
-            print(f"❌ {error_msg}")
-            pass
-
-
-    # Configure user loader with connection safety (keep as is)
+    # Configure user loader with connection safety.
+    # Users are served from the per-process user_cache so steady-state requests skip the users lookup.
     @login_manager.user_loader
     def load_user(user_id):
         try:
+             cached_user = user_cache.get(user_id)
+             if cached_user is not None:
+                 return cached_user
+
              if not ObjectId.is_valid(user_id):
                  app.logger.warning(f"Invalid user_id format: {user_id}")
                  return None
@@ -367,7 +332,9 @@ def create_app(test_config=None):
                  return None
 
              user_data = mongo.db.users.find_one({'_id': ObjectId(user_id)})
-             return User(user_data) if user_data else None
+             user = User(user_data) if user_data else None
+             user_cache.set(user_id, user)
+             return user
         except Exception as e:
             app.logger.error(f"User load error for ID {user_id}: {str(e)}", exc_info=True)
             return None
@@ -375,6 +342,7 @@ def create_app(test_config=None):
 
     # Register blueprints (Call the function)
     register_blueprints(app)
+    register_commands(app)
 
     # Exempt the upload route from CSRF (Keep this, it fixed the 400)
     # This import must happen AFTER main_bp is registered with the app
@@ -384,13 +352,13 @@ def create_app(test_config=None):
     # This import can stay here or be moved if preferred, but it works here.
     from routes.main import upload # Import the specific view function
     csrf.exempt(upload) # Call the exempt method on the csrf instance
-    print("✅ Upload route exempted from CSRF using csrf.exempt().")
+    logger.debug("Upload route exempted from CSRF using csrf.exempt().")
 
     # --- Add TEMPORARY exemption for admin notify route for testing ---
     # This import must happen AFTER admin_bp is registered with the app
     from routes.admin import notify_user # Import the notify_user function
     csrf.exempt(notify_user) # Call the exempt method on the csrf instance
-    print("✅ Admin notify route TEMPORARILY exempted from CSRF for debugging.")
+    logger.debug("Admin notify route TEMPORARILY exempted from CSRF for debugging.")
     # >>> REMEMBER TO REMOVE THIS LINE AFTER TESTING! <<<
     # --- End Temporary Exemption ---
 
@@ -432,35 +400,20 @@ def register_blueprints(app):
     # from routes.main import main_bp
     # from routes.admin import admin_bp
 
-    print("--- Blueprint Registration Start ---")
-    # Print blueprint objects to confirm they are imported
-    print(f"Auth blueprint object: {auth_bp}")
-    print(f"Main blueprint object: {main_bp}")
-    print(f"Admin blueprint object: {admin_bp}")
-
-
-    print("Attempting to register auth blueprint...")
     # Use the blueprint objects imported at the top
     app.register_blueprint(auth_bp, url_prefix='/auth')
-    print("Auth blueprint registered.")
-
-    print("Attempting to register main blueprint...")
-    # Use the blueprint objects imported at the top
     app.register_blueprint(main_bp)
-    print("Main blueprint registered.")
-
-    print("Attempting to register admin blueprint...")
-    # Use the blueprint objects imported at the top
     # This is the crucial line for admin routes
     app.register_blueprint(admin_bp, url_prefix='/admin')
-    print("Admin blueprint registered.")
-    print("--- Blueprint Registration End ---")
+    # Versioned JSON API for integrations
+    app.register_blueprint(api_bp, url_prefix='/api/v1')
+    logger.debug(f"Registered blueprints: {', '.join(app.blueprints)}")
 
 app = create_app()
 # __main__ block (Keep as is)
 if __name__ == "__main__":
     # Configure logging. Only the first basicConfig call takes effect.
-    # Set level to DEBUG to see the blueprint registration prints and other debug messages.
+    # Set level to DEBUG to see the blueprint registration and other debug messages.
     logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
     
@@ -0,0 +1,64 @@
+"""
+Microbenchmark for upload content-type validation (utils/mime_sniff.py).
+
+    python benchmarks/bench_mime_sniff.py [--iterations N]
+
+Times, per file head: the pure-Python signature check, detect_mime() with the
+per-thread libmagic fallback, and (if python-magic is installed) the old
+approach of building a new magic.Magic for every file.
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.mime_sniff import SNIFF_BYTES, sniff_mime, detect_mime  # noqa: E402
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+SAMPLE_FOLDERS = ('uploads', 'templates_for_download', os.path.join('static', 'images'))
+
+
+def sample_heads():
+    """First SNIFF_BYTES of every sample file shipped in the repo, plus synthetic heads."""
+    heads = {}
+    for folder in SAMPLE_FOLDERS:
+        path = os.path.join(PROJECT_ROOT, folder)
+        if not os.path.isdir(path):
+            continue
+        for name in sorted(os.listdir(path)):
+            full = os.path.join(path, name)
+            if os.path.isfile(full):
+                with open(full, 'rb') as f:
+                    heads[f"{folder}/{name}"] = f.read(SNIFF_BYTES)
+    heads['synthetic.gif'] = b'GIF89a' + bytes(SNIFF_BYTES - 6)
+    heads['synthetic.exe'] = b'MZ' + bytes(SNIFF_BYTES - 2)
+    return heads
+
+
+def per_call_us(func, head, iterations):
+    return timeit.timeit(lambda: func(head), number=iterations) / iterations * 1e6
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--iterations', type=int, default=2000)
+    args = arg_parser.parse_args()
+
+    try:
+        import magic
+        fresh_magic = lambda head: magic.Magic(mime=True).from_buffer(head)  # noqa: E731
+    except ImportError:
+        fresh_magic = None
+
+    print(f"{'file':55} {'type':22} {'fast µs':>9} {'detect µs':>10} {'new Magic µs':>13}")
+    for name, head in sample_heads().items():
+        fast = per_call_us(sniff_mime, head, args.iterations)
+        detect = per_call_us(detect_mime, head, args.iterations)
+        fresh = f"{per_call_us(fresh_magic, head, max(1, args.iterations // 20)):13.1f}" if fresh_magic else f"{'n/a':>13}"
+        print(f"{name[:55]:55} {str(detect_mime(head))[:22]:22} {fast:9.2f} {detect:10.2f} {fresh}")
+
+
+if __name__ == '__main__':
+    main()
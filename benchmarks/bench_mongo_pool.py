@@ -0,0 +1,96 @@
+"""
+Concurrency benchmark for the per-process MongoClient pool (extensions.ForkSafePyMongo).
+
+    MONGO_URI=mongodb://localhost:27017/nemsa python benchmarks/bench_mongo_pool.py \
+        [--concurrency 8,32,128] [--pool-sizes 10,50] [--requests 2000] [--gevent]
+
+Runs the admin listing's first-page query (and a user lookup) from N concurrent
+threads, or gevent greenlets with --gevent, mirroring gthread and gevent gunicorn
+workers. Reports throughput, p50/p99 latency and how many operations gave up
+waiting for a pooled connection (after MONGO_TIMEOUT_MS, which bounds pool waits). Needs a reachable
+MongoDB; it only reads.
+"""
+import argparse
+import os
+import sys
+
+if '--gevent' in sys.argv:
+    # Must patch before pymongo (imported via the app) touches socket/threading
+    from gevent import monkey
+    monkey.patch_all()
+
+import statistics  # noqa: E402
+import threading  # noqa: E402
+import time  # noqa: E402
+from concurrent.futures import ThreadPoolExecutor  # noqa: E402
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+
+def run_load(app, mongo, concurrency, total, use_gevent):
+    from pymongo.errors import WaitQueueTimeoutError, ExecutionTimeout, NetworkTimeout
+    from utils.pagination import KEYSET_SORT
+
+    latencies, errors = [], {'wait_queue': 0, 'timeout': 0, 'other': 0}
+    lock = threading.Lock()
+
+    def one_request(i):
+        with app.app_context():
+            started = time.perf_counter()
+            try:
+                list(mongo.db.documents.find({}, {'original_name': 1}).sort(KEYSET_SORT).limit(51))
+                mongo.db.users.find_one({'username_lower': f'bench-user-{i % 50}'})
+            except WaitQueueTimeoutError:
+                key = 'wait_queue'
+            except (ExecutionTimeout, NetworkTimeout):
+                key = 'timeout'
+            except Exception:
+                key = 'other'
+            else:
+                with lock:
+                    latencies.append((time.perf_counter() - started) * 1000)
+                return
+            with lock:
+                errors[key] += 1
+
+    started = time.perf_counter()
+    if use_gevent:
+        from gevent.pool import Pool
+        Pool(concurrency).map(one_request, range(total))
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(one_request, range(total)))
+    elapsed = time.perf_counter() - started
+    return latencies, errors, elapsed
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--concurrency', default='8,32,128')
+    arg_parser.add_argument('--pool-sizes', default='10,50')
+    arg_parser.add_argument('--requests', type=int, default=2000)
+    arg_parser.add_argument('--gevent', action='store_true', help="Use gevent greenlets instead of threads.")
+    args = arg_parser.parse_args()
+
+    if not os.getenv('MONGO_URI'):
+        sys.exit("Set MONGO_URI to a MongoDB you can read from.")
+
+    from app import app
+    from extensions import mongo
+
+    mode = 'gevent' if args.gevent else 'threads'
+    print(f"{'mode':8} {'pool':>5} {'conc':>5} {'ops/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'waitq':>6} {'tmo':>5} {'err':>5}")
+    for pool_size in [int(x) for x in args.pool_sizes.split(',')]:
+        app.config['MONGO_MAX_POOL_SIZE'] = pool_size
+        mongo.close()
+        mongo.init_app(app)
+        for concurrency in [int(x) for x in args.concurrency.split(',')]:
+            latencies, errors, elapsed = run_load(app, mongo, concurrency, args.requests, args.gevent)
+            p50 = statistics.median(latencies) if latencies else 0
+            p99 = statistics.quantiles(latencies, n=100)[98] if len(latencies) >= 100 else max(latencies, default=0)
+            print(f"{mode:8} {pool_size:5} {concurrency:5} {len(latencies) / elapsed:9.0f} {p50:8.1f} {p99:8.1f} "
+                  f"{errors['wait_queue']:6} {errors['timeout']:5} {errors['other']:5}")
+
+
+if __name__ == '__main__':
+    main()
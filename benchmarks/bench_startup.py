@@ -0,0 +1,71 @@
+"""
+Startup-time benchmark: how long a fresh process takes to `import app`.
+
+    python benchmarks/bench_startup.py [--runs N] [--target-ms MS] [--importtime]
+
+This is the cost every gunicorn worker pays on boot. Each run imports the app in a
+new interpreter and the median is compared against the target; the script exits
+non-zero when it is over, so it can guard CI or a deploy. Importing must not touch
+MongoDB (bootstrap is `flask --app app nemsa bootstrap`), so MONGO_URI defaults to
+an address where nothing is listening: a startup that blocks on the database shows
+up as a blown target instead of passing silently. --importtime lists the slowest modules.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+def time_import(env):
+    started = time.perf_counter()
+    subprocess.run([sys.executable, '-c', 'import app'], cwd=PROJECT_ROOT, env=env, check=True,
+                   stdout=subprocess.DEVNULL)
+    return (time.perf_counter() - started) * 1000
+
+
+def slowest_imports(env, limit=15):
+    """Parse `python -X importtime` output into (cumulative µs, module), slowest first."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'], cwd=PROJECT_ROOT, env=env,
+                            check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, module = [part.strip() for part in line[len('import time:'):].split('|')]
+        rows.append((int(cumulative), module.strip()))
+    return sorted(rows, reverse=True)[:limit]
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--runs', type=int, default=7)
+    arg_parser.add_argument('--target-ms', type=float, default=float(os.getenv('STARTUP_TARGET_MS', 1500)))
+    arg_parser.add_argument('--importtime', action='store_true', help="Also show the slowest imported modules.")
+    args = arg_parser.parse_args()
+
+    env = dict(os.environ)
+    env.setdefault('MONGO_URI', 'mongodb://127.0.0.1:1/nemsa?serverSelectionTimeoutMS=2000')
+
+    time_import(env) # Warm-up: fills __pycache__ and the OS file cache
+    timings = [time_import(env) for _ in range(args.runs)]
+    median = statistics.median(timings)
+    print(f"import app: median {median:.0f} ms, min {min(timings):.0f} ms, max {max(timings):.0f} ms "
+          f"over {args.runs} runs (target {args.target_ms:.0f} ms)")
+
+    if args.importtime:
+        print(f"\n{'cumulative ms':>13}  module")
+        for cumulative, module in slowest_imports(env):
+            print(f"{cumulative / 1000:13.1f}  {module}")
+
+    if median > args.target_ms:
+        print(f"❌ Startup over target by {median - args.target_ms:.0f} ms")
+        sys.exit(1)
+    print("✅ Startup within target")
+
+
+if __name__ == '__main__':
+    main()
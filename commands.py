@@ -0,0 +1,473 @@
+# commands.py
+"""
+Maintenance commands, available as `flask --app app nemsa <command>`.
+"""
+import hashlib
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
+import click
+from flask import current_app
+from flask.cli import AppGroup, with_appcontext
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from extensions import mongo
+from services.blob_store import blob_filename
+from services.document_stats import reconcile_counters, record_change, recording_change
+from services.analytics import refresh_dashboard_stats
+from services.document_search import search_tokens
+from services.upload_sessions import cleanup_sessions
+from services.storage import get_storage, BACKEND_LOCAL, BACKEND_GRIDFS
+from services.exports import (stream_csv, stream_ndjson, iter_documents_with_owners, upload_date_filter,
+                              METADATA_PROJECTION)
+from utils.pagination import KEYSET_SORT
+from utils.upload_stream import publish_exclusive
+
+@click.group('nemsa', cls=AppGroup)
+@with_appcontext
+def nemsa_cli():
+    """NEMSA Forms maintenance commands."""
+    # The per-operation timeout is meant for web requests; batch jobs here may legitimately run longer.
+    # Safe because the MongoClient is only created on first use, after this runs.
+    current_app.config['MONGO_TIMEOUT_MS'] = 0
+    mongo.init_app(current_app._get_current_object())
+
+
+def register_commands(app):
+    """Attach the `nemsa` command group to the app's CLI."""
+    app.cli.add_command(nemsa_cli)
+
+
+# Collections the app expects to exist before serving requests
+REQUIRED_COLLECTIONS = {'users', 'documents', 'outbox', 'blobs', 'document_stats', 'analytics', 'upload_sessions'}
+
+
+def safe_create_index(collection, keys, **kwargs):
+    """Create index only if it doesn't exist with same key pattern"""
+    for index in collection.index_information().values():
+        if list(index.get('key', [])) == list(keys):
+            click.echo(f"⚠️ Index for {keys} already exists.")
+            return None
+
+    try:
+        index_name = collection.create_index(keys, **kwargs)
+        click.echo(f"🆕 Created index: {index_name} for {keys}")
+        return index_name
+    except Exception as e:
+        click.echo(f"❌ Failed to create index for {keys}: {e}")
+        return None
+
+
+def bootstrap_database():
+    """Create missing collections and indexes. Idempotent; safe to run on every deploy."""
+    db = mongo.db
+    existing_collections = set(db.list_collection_names())
+    for coll in sorted(REQUIRED_COLLECTIONS - existing_collections):
+        db.create_collection(coll)
+        click.echo(f"🆕 Created collection: {coll}")
+
+    safe_create_index(
+        db.documents,
+        [('user_id', ASCENDING), ('status', ASCENDING)],
+        name='user_status_idx',
+        background=True
+    )
+    safe_create_index(
+        db.users,
+        [('email', ASCENDING)],
+        name='unique_email_idx',
+        unique=True,
+        partialFilterExpression={'email': {'$exists': True}},
+        background=True
+    )
+
+    # Case-insensitive username lookups go through the normalized username_lower field
+    # (older users are backfilled by bootstrap, or `flask --app app nemsa migrate-usernames`)
+    safe_create_index(
+        db.users,
+        [('username_lower', ASCENDING)],
+        name='unique_username_lower_idx',
+        unique=True,
+        partialFilterExpression={'username_lower': {'$exists': True}},
+        background=True
+    )
+
+    # Keyset pagination of the admin listing: newest first, optionally filtered by status or user
+    safe_create_index(
+        db.documents,
+        [('upload_date', DESCENDING), ('_id', DESCENDING)],
+        name='upload_date_id_idx',
+        background=True
+    )
+    safe_create_index(
+        db.documents,
+        [('status', ASCENDING), ('upload_date', DESCENDING), ('_id', DESCENDING)],
+        name='status_upload_date_idx',
+        background=True
+    )
+    safe_create_index(
+        db.documents,
+        [('user_id', ASCENDING), ('upload_date', DESCENDING), ('_id', DESCENDING)],
+        name='user_upload_date_idx',
+        background=True
+    )
+
+    # Admin search: prefix matches on filename words, newest first
+    # (backfill older documents with `flask --app app nemsa backfill-search`)
+    safe_create_index(
+        db.documents,
+        [('search_tokens', ASCENDING), ('upload_date', DESCENDING)],
+        name='search_tokens_idx',
+        background=True
+    )
+
+    # Review-time analytics scan recently reviewed documents
+    safe_create_index(
+        db.documents,
+        [('status_updated_at', DESCENDING)],
+        name='status_updated_at_idx',
+        background=True
+    )
+
+    # Outbox: workers claim by (status, next_attempt_at); sent messages expire via TTL
+    safe_create_index(
+        db.outbox,
+        [('status', ASCENDING), ('next_attempt_at', ASCENDING)],
+        name='outbox_claim_idx',
+        background=True
+    )
+    safe_create_index(
+        db.outbox,
+        [('sent_at', ASCENDING)],
+        name='outbox_sent_ttl_idx',
+        expireAfterSeconds=current_app.config['MAIL_OUTBOX_RETENTION_DAYS'] * 24 * 3600,
+        background=True
+    )
+
+    # Chunked uploads: cleanup scans by expiry. Not a TTL index, since each session also owns a file on disk.
+    safe_create_index(
+        db.upload_sessions,
+        [('expires_at', ASCENDING)],
+        name='upload_sessions_expires_idx',
+        background=True
+    )
+
+
+@nemsa_cli.command('bootstrap')
+def bootstrap():
+    """Create the MongoDB collections and indexes the app needs (run once per deploy)."""
+    try:
+        mongo.cx.server_info()
+        click.echo("✅ MongoDB connection successful")
+    except Exception as e:
+        raise click.ClickException(f"Database initialization failed: {e}")
+    bootstrap_database()
+    # Logins look users up by username_lower; backfill accounts created before it existed
+    _report_username_backfill(*backfill_username_lower())
+    click.echo("✅ Database bootstrap complete.")
+
+
+@nemsa_cli.command('reconcile-counters')
+def reconcile_counters_command():
+    """Rebuild the per-user and global status counters from the documents collection."""
+    users, stale = reconcile_counters()
+    record_change()
+    click.echo(f"✅ Rebuilt counters for {users} users (removed {stale} stale entries).")
+
+
+@nemsa_cli.command('refresh-stats')
+@click.option('--window-days', type=int, default=None, help="Override ANALYTICS_WINDOW_DAYS.")
+def refresh_stats(window_days):
+    """Recompute the admin stats page (suitable for cron)."""
+    stats = refresh_dashboard_stats(window_days or current_app.config['ANALYTICS_WINDOW_DAYS'])
+    click.echo(f"✅ Analytics refreshed in {stats['compute_seconds']}s.")
+
+
+@nemsa_cli.command('cleanup-uploads')
+@click.option('--stale-hours', default=24, show_default=True, help="Age after which leftover single-request temp files are removed.")
+def cleanup_uploads(stale_hours):
+    """Remove expired chunked upload sessions and leftover partial files (suitable for cron)."""
+    sessions, files = cleanup_sessions(stale_temp_age=stale_hours * 3600)
+    click.echo(f"✅ Removed {sessions} upload sessions and {files} partial files.")
+
+
+@nemsa_cli.command('backfill-search')
+@click.option('--batch-size', default=1000, show_default=True, help="Documents updated per bulk_write.")
+@click.option('--all', 'rebuild_all', is_flag=True, help="Recompute tokens for every document, not only missing ones.")
+def backfill_search(batch_size, rebuild_all):
+    """Store search_tokens on documents uploaded before admin search existed."""
+    query = {} if rebuild_all else {'search_tokens': {'$exists': False}}
+    pending, updated = [], 0
+    with recording_change():
+        for doc in mongo.db.documents.find(query, {'original_name': 1, 'filename': 1}):
+            tokens = search_tokens(doc.get('original_name') or doc.get('filename'))
+            pending.append(UpdateOne({'_id': doc['_id']}, {'$set': {'search_tokens': tokens}}))
+            if len(pending) >= batch_size:
+                updated += mongo.db.documents.bulk_write(pending, ordered=False).modified_count
+                pending = []
+        if pending:
+            updated += mongo.db.documents.bulk_write(pending, ordered=False).modified_count
+    click.echo(f"✅ Set search_tokens on {updated} documents.")
+
+
+@nemsa_cli.command('export-documents')
+@click.option('--format', 'export_format', type=click.Choice(['csv', 'ndjson']), default='csv', show_default=True)
+@click.option('--output', type=click.File('w', encoding='utf-8', lazy=True), default='-', help="File to write (default: stdout).")
+@click.option('--since', help="Only documents uploaded on or after this date (YYYY-MM-DD).")
+@click.option('--until', help="Only documents uploaded before this date (YYYY-MM-DD).")
+@click.option('--status', help="Only documents with this status.")
+@click.option('--batch-size', default=1000, show_default=True, help="Cursor batch and owner lookup size.")
+def export_documents(export_format, output, since, until, status, batch_size):
+    """Write document metadata joined with owners as CSV or NDJSON, streaming."""
+    try:
+        query = upload_date_filter(since, until)
+    except ValueError:
+        raise click.BadParameter("Dates must be given as YYYY-MM-DD.")
+    if status:
+        query['status'] = status
+
+    generate = stream_csv if export_format == 'csv' else stream_ndjson
+    documents = iter_documents_with_owners(query, METADATA_PROJECTION, batch_size=batch_size, sort=KEYSET_SORT)
+    for chunk in generate(documents):
+        output.write(chunk)
+    output.flush()
+
+
+def backfill_username_lower(batch_size=1000):
+    """
+    Set username_lower on users created before it existed.
+    Returns (updated, conflicts) where conflicts are (user_id, username, existing_user_id).
+    """
+    claimed = {
+        user['username_lower']: user['_id']
+        for user in mongo.db.users.find({'username_lower': {'$exists': True}}, {'username_lower': 1})
+    }
+
+    pending, updated, conflicts = [], 0, []
+    for user in mongo.db.users.find({'username_lower': {'$exists': False}}, {'username': 1}):
+        username = (user.get('username') or '').strip()
+        if not username:
+            continue
+        username_lower = username.lower()
+        # Two legacy accounts differing only by case cannot share the unique index; leave for manual review
+        if username_lower in claimed:
+            conflicts.append((user['_id'], username, claimed[username_lower]))
+            continue
+        claimed[username_lower] = user['_id']
+        pending.append(UpdateOne({'_id': user['_id']}, {'$set': {'username_lower': username_lower}}))
+
+        if len(pending) >= batch_size:
+            updated += mongo.db.users.bulk_write(pending, ordered=False).modified_count
+            pending = []
+
+    if pending:
+        updated += mongo.db.users.bulk_write(pending, ordered=False).modified_count
+    return updated, conflicts
+
+
+def _report_username_backfill(updated, conflicts):
+    click.echo(f"✅ Set username_lower on {updated} users.")
+    for user_id, username, existing_id in conflicts:
+        click.echo(f"⚠️ Skipped user {user_id} ('{username}'): same username as user {existing_id} ignoring case.")
+
+
+@nemsa_cli.command('migrate-usernames')
+@click.option('--batch-size', default=1000, show_default=True, help="Users updated per bulk_write.")
+def migrate_usernames(batch_size):
+    """Backfill username_lower for users created before it existed (bootstrap also does this)."""
+    _report_username_backfill(*backfill_username_lower(batch_size))
+
+
+# Names already in the content-addressed layout: 64 hex chars plus an extension
+BLOB_NAME_RE = re.compile(r'^[0-9a-f]{64}(\.[A-Za-z0-9]+)?$')
+
+
+def _hash_file(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@nemsa_cli.command('dedup-uploads')
+@click.option('--dry-run', is_flag=True, help="Report what would change without touching files or documents.")
+def dedup_uploads(dry_run):
+    """Move legacy uploads into the content-addressed layout, deleting duplicate copies."""
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    moved, duplicates, orphans, reclaimed = 0, 0, [], 0
+
+    with recording_change():
+        for name in sorted(os.listdir(upload_folder)):
+            path = os.path.join(upload_folder, name)
+            if name.startswith('.') or BLOB_NAME_RE.match(name) or not os.path.isfile(path):
+                continue
+
+            referencing = mongo.db.documents.count_documents({'filename': name})
+            if not referencing:
+                # Nothing points at it; leave it for a human to look at
+                orphans.append(name)
+                continue
+
+            sha256 = _hash_file(path)
+            size = os.path.getsize(path)
+            existing = mongo.db.blobs.find_one({'_id': sha256}, {'filename': 1})
+            target = existing['filename'] if existing else blob_filename(sha256, os.path.splitext(name)[1].lower())
+            target_path = os.path.join(upload_folder, target)
+
+            if dry_run:
+                action = '🗑️ duplicate' if os.path.exists(target_path) else '📦 move'
+                click.echo(f"{action}: {name} -> {target} ({referencing} document(s))")
+                continue
+
+            try:
+                publish_exclusive(path, target_path)
+                moved += 1
+                click.echo(f"📦 moved: {name} -> {target} ({referencing} document(s))")
+            except FileExistsError:
+                os.remove(path)
+                duplicates += 1
+                reclaimed += size
+                click.echo(f"🗑️ duplicate: {name} -> {target} ({referencing} document(s))")
+
+            mongo.db.documents.update_many(
+                {'filename': name},
+                {'$set': {'filename': target, 'sha256': sha256, 'file_size': size}}
+            )
+            if not existing:
+                mongo.db.blobs.update_one(
+                    {'_id': sha256},
+                    {'$setOnInsert': {'filename': target, 'size': size, 'created_at': datetime.utcnow(), 'refcount': 0}},
+                    upsert=True
+                )
+
+        if not dry_run:
+            # Recount references from the documents themselves so refcounts are exact
+            counts = mongo.db.documents.aggregate([
+                {'$match': {'sha256': {'$exists': True}}},
+                {'$group': {'_id': '$sha256', 'refcount': {'$sum': 1}}},
+            ])
+            ops = [UpdateOne({'_id': row['_id']}, {'$set': {'refcount': row['refcount']}}) for row in counts]
+            if ops:
+                mongo.db.blobs.bulk_write(ops, ordered=False)
+
+    click.echo(f"✅ Moved {moved} files, removed {duplicates} duplicates ({reclaimed / (1024 * 1024):.2f} MB reclaimed).")
+    for name in orphans:
+        click.echo(f"⚠️ Left {name} in place: no document references it.")
+
+
+class _HashingReader:
+    """Read-through wrapper that hashes what a storage backend copies, to verify it against the blob's SHA-256."""
+
+    def __init__(self, source):
+        self.source = source
+        self.digest = hashlib.sha256()
+        self.size = 0
+
+    def read(self, size=-1):
+        chunk = self.source.read(size)
+        self.digest.update(chunk)
+        self.size += len(chunk)
+        return chunk
+
+
+def _stored_sha256(storage, filename):
+    digest = hashlib.sha256()
+    with storage.open(filename) as stream:
+        for chunk in iter(lambda: stream.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _migrate_blob(source, target, blob, delete_source, dry_run):
+    """Copies one blob between backends. Returns (outcome, bytes copied)."""
+    filename = blob['filename']
+    if target.exists(filename):
+        if not delete_source or dry_run:
+            return 'present', 0
+        # The original is about to go, so the copy from an earlier run must be proven good first
+        if _stored_sha256(target, filename) == blob['_id']:
+            source.delete(filename)
+            return 'present', 0
+        if not source.exists(filename):
+            return 'mismatch', 0
+        target.delete(filename) # Corrupt copy from an interrupted run: copy again below
+    if not source.exists(filename):
+        return 'missing', 0
+    if dry_run:
+        return 'copied', blob.get('size') or source.size(filename)
+
+    with source.open(filename) as stream:
+        reader = _HashingReader(stream)
+        try:
+            target.write(filename, reader)
+        except FileExistsError:
+            return 'present', 0
+
+    if reader.digest.hexdigest() != blob['_id']:
+        # Never let a corrupt copy shadow the original
+        target.delete(filename)
+        return 'mismatch', 0
+    if delete_source:
+        source.delete(filename)
+    return 'copied', reader.size
+
+
+@nemsa_cli.command('migrate-storage')
+@click.option('--from', 'source_name', type=click.Choice([BACKEND_LOCAL, BACKEND_GRIDFS]), required=True)
+@click.option('--to', 'target_name', type=click.Choice([BACKEND_LOCAL, BACKEND_GRIDFS]), required=True)
+@click.option('--workers', default=8, show_default=True, help="Files copied in parallel.")
+@click.option('--delete-source', is_flag=True, help="Remove each file from the old backend once its copy is verified.")
+@click.option('--dry-run', is_flag=True, help="Report what would be copied without writing anything.")
+def migrate_storage(source_name, target_name, workers, delete_source, dry_run):
+    """
+    Copy every stored blob from one storage backend to another, verifying each copy's SHA-256.
+
+    Safe to re-run: files already in the target are skipped. Run it, switch
+    STORAGE_BACKEND, then run it once more to pick up uploads made in between.
+    """
+    if source_name == target_name:
+        raise click.BadParameter("--from and --to must name different backends.")
+    source, target = get_storage(source_name), get_storage(target_name)
+
+    legacy = mongo.db.documents.count_documents({'sha256': {'$exists': False}})
+    if legacy:
+        click.echo(f"⚠️ {legacy} documents predate content-addressed storage and are not migrated; run `nemsa dedup-uploads` first.")
+
+    outcomes = {'copied': 0, 'present': 0, 'missing': 0, 'mismatch': 0, 'failed': 0}
+    copied_bytes = 0
+    in_flight = {}
+
+    def _collect(done):
+        nonlocal copied_bytes
+        for future in done:
+            blob = in_flight.pop(future)
+            try:
+                outcome, size = future.result()
+            except Exception as e:
+                outcome, size = 'failed', 0
+                click.echo(f"❌ {blob['filename']}: {e}")
+            outcomes[outcome] += 1
+            copied_bytes += size
+            if outcome == 'missing':
+                click.echo(f"⚠️ {blob['filename']} is not in {source_name} storage.")
+            elif outcome == 'mismatch':
+                click.echo(f"❌ {blob['filename']}: copy does not match its SHA-256, left in {source_name} storage.")
+
+    with recording_change():
+        # Bounded submission keeps memory flat however many blobs there are
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for blob in mongo.db.blobs.find({'deleting': {'$ne': True}}, {'filename': 1, 'size': 1}):
+                if len(in_flight) >= workers * 4:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    _collect(done)
+                future = pool.submit(_migrate_blob, source, target, blob, delete_source, dry_run)
+                in_flight[future] = blob
+            _collect(wait(in_flight).done)
+
+    action = 'Would copy' if dry_run else 'Copied'
+    click.echo(f"✅ {action} {outcomes['copied']} files ({copied_bytes / (1024 * 1024):.2f} MB) from {source_name} to {target_name}; "
+               f"{outcomes['present']} already present, {outcomes['missing']} missing, "
+               f"{outcomes['mismatch'] + outcomes['failed']} failed.")
+    if not dry_run and current_app.config['STORAGE_BACKEND'] != target_name:
+        click.echo(f"ℹ️ Set STORAGE_BACKEND={target_name} to serve files from the new backend.")
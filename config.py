@@ -12,12 +12,68 @@ load_dotenv()
 class Config:
     SECRET_KEY = os.getenv('SECRET_KEY', 'd4ff3ab4a1606baefa76b1bf22e19661978bf0e52cfbda9c830b4271d0eb8092')
     MONGO_URI = os.getenv('MONGO_URI')
+    # MongoClient tuning (created per worker process, see extensions.ForkSafePyMongo).
+    # Options set in MONGO_URI take precedence; 0 keeps the driver default.
+    MONGO_MAX_POOL_SIZE = int(os.getenv('MONGO_MAX_POOL_SIZE', 50)) # Per process; >= gunicorn threads
+    MONGO_MIN_POOL_SIZE = int(os.getenv('MONGO_MIN_POOL_SIZE', 0))
+    MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000))
+    # Default time limit for every operation (timeoutMS, sent to the server as maxTimeMS).
+    # It also bounds waiting for a pooled connection: with timeoutMS set, pymongo ignores
+    # waitQueueTimeoutMS, so there is no separate pool wait setting.
+    # `flask nemsa ...` maintenance commands lift it, since they scan whole collections.
+    MONGO_TIMEOUT_MS = int(os.getenv('MONGO_TIMEOUT_MS', 15000))
     UPLOAD_FOLDER = 'uploads'
+    # Where uploaded documents are kept: 'local' (UPLOAD_FOLDER) or 'gridfs' (MongoDB, for several app nodes).
+    # UPLOAD_FOLDER is still used for in-flight uploads either way; with several nodes, route each
+    # chunked upload session to one node (sticky sessions). Move existing files with `nemsa migrate-storage`.
+    STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'local').lower()
+    GRIDFS_BUCKET = os.getenv('GRIDFS_BUCKET', 'uploads') # Collections <bucket>.files / <bucket>.chunks
+    GRIDFS_CHUNK_SIZE = int(os.getenv('GRIDFS_CHUNK_SIZE', 255 * 1024)) # Bytes per GridFS chunk document
     # Add TEMPLATE_DOWNLOAD_FOLDER
     TEMPLATE_DOWNLOAD_FOLDER = 'templates_for_download' # Folder relative to project root
+    TEMPLATE_DOWNLOAD_MAX_AGE = int(os.getenv('TEMPLATE_DOWNLOAD_MAX_AGE', 7 * 24 * 3600)) # Cache-Control max-age for templates
+
+    # How downloads are delivered once the app has authorized them:
+    # 'python' streams from the worker (with Range/ETag/304 support), 'x-accel' hands off to
+    # nginx via X-Accel-Redirect, 'x-sendfile' to Apache/lighttpd via X-Sendfile
+    FILE_SERVING_MODE = os.getenv('FILE_SERVING_MODE', 'python').lower()
+    # Internal nginx locations aliased to UPLOAD_FOLDER / TEMPLATE_DOWNLOAD_FOLDER (x-accel mode only)
+    X_ACCEL_UPLOAD_PREFIX = os.getenv('X_ACCEL_UPLOAD_PREFIX', '/protected/uploads/')
+    X_ACCEL_TEMPLATE_PREFIX = os.getenv('X_ACCEL_TEMPLATE_PREFIX', '/protected/templates/')
+
+    # Image previews for the admin review page (needs Pillow)
+    PREVIEW_CACHE_FOLDER = os.getenv('PREVIEW_CACHE_FOLDER', 'preview_cache')
+    PREVIEW_CACHE_MAX_BYTES = int(os.getenv('PREVIEW_CACHE_MAX_BYTES', 256 * 1024 * 1024)) # LRU-evicted beyond this
+    PREVIEW_MAX_SIZE = int(os.getenv('PREVIEW_MAX_SIZE', 320)) # Longest edge in pixels
+    PREVIEW_FORMAT = os.getenv('PREVIEW_FORMAT', 'WEBP').upper() # 'WEBP' or 'JPEG'
+    PREVIEW_QUALITY = int(os.getenv('PREVIEW_QUALITY', 75))
+    PREVIEW_WORKERS = int(os.getenv('PREVIEW_WORKERS', 2)) # Render processes per web worker
+    PREVIEW_TIMEOUT = float(os.getenv('PREVIEW_TIMEOUT', 10)) # Seconds a request waits for a first render
 
     ALLOWED_EXTENSIONS = {'pdf', 'doc', 'docx', 'png', 'jpg', 'jpeg', 'gif'}
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max upload size
+    # Resumable uploads: large files are sent in fixed-size chunks, each its own request (below MAX_CONTENT_LENGTH)
+    CHUNKED_UPLOAD_CHUNK_SIZE = int(os.getenv('CHUNKED_UPLOAD_CHUNK_SIZE', 4 * 1024 * 1024)) # Bytes per chunk
+    CHUNKED_UPLOAD_MAX_SIZE = int(os.getenv('CHUNKED_UPLOAD_MAX_SIZE', 256 * 1024 * 1024)) # 256MB max file size via chunks
+    CHUNKED_UPLOAD_SESSION_TTL = int(os.getenv('CHUNKED_UPLOAD_SESSION_TTL', 24 * 3600)) # Seconds an idle session is kept
+
+    ADMIN_BULK_MAX_DOCUMENTS = int(os.getenv('ADMIN_BULK_MAX_DOCUMENTS', 500)) # Max documents per bulk status update
+    ADMIN_PAGE_SIZE = int(os.getenv('ADMIN_PAGE_SIZE', 50)) # Documents per page in the admin listing
+    API_MAX_PAGE_SIZE = int(os.getenv('API_MAX_PAGE_SIZE', 100)) # Max documents per /api/v1 page
+    EXPORT_MAX_DOCUMENTS = int(os.getenv('EXPORT_MAX_DOCUMENTS', 1000)) # Max documents in one ZIP export
+    EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', 1000)) # Cursor batch / owner lookup size for CSV and NDJSON exports
+    TYPEAHEAD_LIMIT = int(os.getenv('TYPEAHEAD_LIMIT', 10)) # Max suggestions per keystroke in the notify document picker
+
+    # Admin stats page: aggregation results are materialized in the analytics collection
+    ANALYTICS_MAX_AGE = int(os.getenv('ANALYTICS_MAX_AGE', 900)) # Seconds before a background refresh is started
+    ANALYTICS_WINDOW_DAYS = int(os.getenv('ANALYTICS_WINDOW_DAYS', 30)) # Period covered by uploads/day and review times
+    ANALYTICS_REFRESH_LEASE = int(os.getenv('ANALYTICS_REFRESH_LEASE', 300)) # Max seconds one refresh may hold the lock
+    # Set to false when `flask --app app nemsa refresh-stats` runs from cron instead
+    ANALYTICS_REFRESH_IN_WEB = os.getenv('ANALYTICS_REFRESH_IN_WEB', 'true').lower() == 'true'
+
+    # Per-process cache of logged-in users for the Flask-Login user loader (TTL 0 disables it)
+    USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', 60)) # Seconds a cached user stays valid
+    USER_CACHE_MAXSIZE = int(os.getenv('USER_CACHE_MAXSIZE', 1024)) # Max users cached per process
 
     WTF_CSRF_TIME_LIMIT = 3600
     WTF_CSRF_SSL_STRICT = False
@@ -38,5 +94,21 @@ class Config:
     MAIL_PASSWORD = os.getenv('MAIL_PASSWORD')
     MAIL_DEFAULT_SENDER = os.getenv('MAIL_DEFAULT_SENDER', 'noreply@nemsa.gov.ng') # Get from env or default
 
+    # Mail delivery: 'background' queues messages for the dispatcher threads, 'outbox' stores them
+    # in Mongo for mail_worker.py, 'sync' sends inline
+    MAIL_DELIVERY_MODE = os.getenv('MAIL_DELIVERY_MODE', 'background').lower()
+    MAIL_DISPATCH_WORKERS = int(os.getenv('MAIL_DISPATCH_WORKERS', 2)) # Threads (and SMTP connections) per process
+    MAIL_DISPATCH_BATCH_SIZE = int(os.getenv('MAIL_DISPATCH_BATCH_SIZE', 20)) # Max messages drained per wake-up
+    MAIL_DISPATCH_QUEUE_SIZE = int(os.getenv('MAIL_DISPATCH_QUEUE_SIZE', 1000)) # Beyond this, send inline
+    MAIL_DISPATCH_IDLE_TIMEOUT = int(os.getenv('MAIL_DISPATCH_IDLE_TIMEOUT', 30)) # Seconds before an idle SMTP session is closed
+
+    # Outbox worker (MAIL_DELIVERY_MODE = 'outbox')
+    MAIL_OUTBOX_MAX_ATTEMPTS = int(os.getenv('MAIL_OUTBOX_MAX_ATTEMPTS', 6)) # Then the message is marked failed
+    MAIL_OUTBOX_BACKOFF_BASE = int(os.getenv('MAIL_OUTBOX_BACKOFF_BASE', 30)) # Seconds; doubles on every retry
+    MAIL_OUTBOX_BACKOFF_MAX = int(os.getenv('MAIL_OUTBOX_BACKOFF_MAX', 3600)) # Upper bound on the retry delay
+    MAIL_OUTBOX_LEASE = int(os.getenv('MAIL_OUTBOX_LEASE', 300)) # Seconds a claimed message stays locked to one worker
+    MAIL_OUTBOX_POLL_INTERVAL = float(os.getenv('MAIL_OUTBOX_POLL_INTERVAL', 2)) # Seconds between polls when idle
+    MAIL_OUTBOX_RETENTION_DAYS = int(os.getenv('MAIL_OUTBOX_RETENTION_DAYS', 7)) # Sent messages expire after this
+
     # Add a debug flag from .env
     DEBUG = os.getenv('FLASK_DEBUG', 'False').lower() in ['true', '1']
\ No newline at end of file
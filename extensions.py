@@ -1,11 +1,98 @@
 # extensions.py
-from flask_pymongo import PyMongo
+import os
+import threading
+from flask_pymongo import PyMongo, BSONObjectIdConverter, BSONProvider
+from flask_pymongo.wrappers import MongoClient
+from pymongo import uri_parser
 from flask_login import LoginManager
 from flask_wtf.csrf import CSRFProtect
 from flask_mail import Mail
 
+# Config keys -> MongoClient options. A value already given in MONGO_URI's query string wins.
+MONGO_CLIENT_OPTIONS = {
+    'MONGO_MAX_POOL_SIZE': 'maxPoolSize',
+    'MONGO_MIN_POOL_SIZE': 'minPoolSize',
+    'MONGO_SERVER_SELECTION_TIMEOUT_MS': 'serverSelectionTimeoutMS',
+    'MONGO_TIMEOUT_MS': 'timeoutMS',
+}
+
+
+class ForkSafePyMongo(PyMongo):
+    """
+    Flask-PyMongo whose MongoClient is created on first use in each process.
+
+    PyMongo.init_app builds the client straight away, so with `gunicorn --preload`
+    it would be created in the master and inherited by every forked worker;
+    MongoClient is not fork-safe. Here init_app only records the settings, and
+    .cx/.db build a client the first time they are used in a process (checked by
+    PID), so each worker gets its own pool and monitor threads after the fork.
+    """
+
+    def __init__(self):
+        # PyMongo.__init__ is skipped on purpose: it assigns cx/db, which are properties here
+        self._uri = None
+        self._database_name = None
+        self._client_kwargs = {}
+        self._client = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app, uri=None, **kwargs):
+        uri = uri or app.config.get('MONGO_URI')
+        if not uri:
+            raise ValueError("You must specify a URI or set the MONGO_URI Flask config variable")
+
+        parsed_uri = uri_parser.parse_uri(uri)
+        uri_options = parsed_uri['options']
+        for config_key, option in MONGO_CLIENT_OPTIONS.items():
+            value = app.config.get(config_key)
+            # 0 / None means "driver default" (timeoutMS: no client-wide operation timeout)
+            if value and option not in uri_options:
+                kwargs.setdefault(option, value)
+        kwargs['connect'] = False
+
+        with self._lock:
+            self._uri = uri
+            self._database_name = parsed_uri['database']
+            self._client_kwargs = kwargs
+            self._client = None
+            self._pid = None
+
+        # The rest of what PyMongo.init_app sets up
+        app.url_map.converters['ObjectId'] = BSONObjectIdConverter
+        app.json = BSONProvider(app)
+        app.extensions['pymongo'] = self
+
+    @property
+    def cx(self):
+        client, pid = self._client, self._pid
+        if client is not None and pid == os.getpid():
+            return client
+        with self._lock:
+            if self._client is None or self._pid != os.getpid():
+                if self._uri is None:
+                    raise RuntimeError("MongoDB used before init_app()")
+                # A client inherited from the parent process is dropped, not closed:
+                # its sockets and threads belong to the parent
+                self._client = MongoClient(self._uri, **self._client_kwargs)
+                self._pid = os.getpid()
+            return self._client
+
+    @property
+    def db(self):
+        return self.cx[self._database_name] if self._database_name else None
+
+    def close(self):
+        """Close this process's client (a new one is created on next use)."""
+        with self._lock:
+            if self._client is not None and self._pid == os.getpid():
+                self._client.close()
+            self._client = None
+            self._pid = None
+
+
 # Initialize extensions, but don't link to an app yet
-mongo = PyMongo(connect=False)
+mongo = ForkSafePyMongo()
 login_manager = LoginManager()
 csrf = CSRFProtect()
-mail = Mail()
\ No newline at end of file
+mail = Mail()
@@ -0,0 +1,38 @@
+# gunicorn.conf.py
+"""
+Gunicorn settings, picked up automatically by `gunicorn app:app` (see Procfile).
+
+Worker modes (GUNICORN_WORKER_CLASS):
+
+- gthread (default): WEB_CONCURRENCY processes x GUNICORN_THREADS threads. Each
+  process has one MongoClient pool, so keep MONGO_MAX_POOL_SIZE >= GUNICORN_THREADS
+  or requests queue for a connection (and fail once MONGO_TIMEOUT_MS runs out).
+- gevent: up to GUNICORN_WORKER_CONNECTIONS greenlets per process share the pool;
+  MONGO_MAX_POOL_SIZE then caps concurrent queries and the wait queue absorbs bursts.
+  pymongo must be imported after gevent's monkey-patching, so the app is not
+  preloaded in this mode.
+
+With preload_app the app is imported once in the master and forked. That is safe
+because nothing at import time opens a MongoDB connection (extensions.ForkSafePyMongo
+creates the client lazily per process, the mail dispatcher starts its threads lazily).
+Compare modes with benchmarks/bench_mongo_pool.py.
+"""
+import logging
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+workers = int(os.getenv('WEB_CONCURRENCY', min(4, multiprocessing.cpu_count() * 2 + 1)))
+threads = int(os.getenv('GUNICORN_THREADS', 8))
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', 100))
+preload_app = worker_class != 'gevent' and os.getenv('GUNICORN_PRELOAD', 'true').lower() == 'true'
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 60))
+graceful_timeout = 30
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 0)) # Recycle workers after N requests (0 = never)
+max_requests_jitter = max_requests // 10
+
+
+def post_fork(server, worker):
+    # Nothing to reset: Mongo, mail dispatcher and preview pool all notice the new PID on first use
+    logging.getLogger('gunicorn.error').debug(f"Worker {worker.pid} forked ({worker_class})")
@@ -0,0 +1,40 @@
+# mail_worker.py
+"""
+Standalone outbox mail worker.
+
+Run alongside the web process (see Procfile):
+
+    python mail_worker.py          # poll forever
+    python mail_worker.py --once   # drain everything that is due, then exit
+
+Only polls when MAIL_DELIVERY_MODE = 'outbox'; in any other mode nothing is ever
+queued in the outbox, so it idles until it is stopped (exiting would make process
+managers that restart dead processes, such as Heroku's, restart it in a loop).
+"""
+import argparse
+import logging
+import threading
+from app import app
+from services.outbox import OutboxWorker
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Deliver queued NEMSA Forms emails from the outbox collection.")
+    arg_parser.add_argument('--once', action='store_true', help="Exit when no messages are due instead of polling.")
+    args = arg_parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    delivery_mode = app.config.get('MAIL_DELIVERY_MODE')
+    if delivery_mode != 'outbox':
+        logging.getLogger(__name__).warning(
+            f"MAIL_DELIVERY_MODE is '{delivery_mode}', not 'outbox'; the mail worker has nothing to deliver. "
+            f"Set MAIL_DELIVERY_MODE=outbox to use it, or scale the worker process to 0.")
+        if args.once:
+            return
+        threading.Event().wait() # Blocks until the process is signalled to stop
+        return
+    OutboxWorker(app).run(once=args.once)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,38 @@
-from flask import Blueprint, render_template, redirect, request, flash, url_for, current_app
+import os
+from flask import (Blueprint, render_template, redirect, request, flash, url_for, current_app, jsonify, send_file, abort,
+                   Response, stream_with_context)
 from flask_login import login_required, current_user
 from bson import ObjectId
+from pymongo import UpdateOne, ReturnDocument
+from datetime import datetime
 from extensions import mongo
-from services.email_services import send_email # Assuming email_services exists and is functional
+from services.email_services import send_email, build_message, send_bulk_emails
+from services.document_services import attach_owners
+from services.previews import get_preview, preview_mimetype
+from services.document_stats import DOCUMENT_STATUSES, get_counts, record_status_changes, safe_record, recording_change
+from services.document_search import build_search_query
+from services.analytics import get_dashboard_stats
+from services.exports import (stream_zip, stream_csv, stream_ndjson, iter_documents_with_owners, upload_date_filter,
+                              ZIP_DOCUMENT_PROJECTION, METADATA_PROJECTION)
+from utils.pagination import fetch_page, KEYSET_SORT
+from routes.auth import find_user
+from services.mail_dispatcher import mail_dispatcher
+from services.user_cache import user_cache
 from pymongo.errors import PyMongoError # Import PyMongoError
 
 admin_bp = Blueprint('admin', __name__)
 
+# Only the fields templates/admin/documents.html renders (plus upload_date for the page cursor)
+DOCUMENT_LIST_PROJECTION = {
+    'original_name': 1,
+    'user_id': 1,
+    'upload_date': 1,
+    'status': 1,
+    'file_size': 1,
+    'filename': 1, # With mime_type, decides whether a preview thumbnail is shown
+    'mime_type': 1,
+}
+
 # CORRECTED ROUTE PATH: Removed the leading /admin
 @admin_bp.route('/documents')
 @login_required
@@ -16,14 +42,264 @@ def manage_documents():
         current_app.logger.warning(f"Unauthorized admin access attempt by user {current_user.id}")
         return redirect(url_for('main.dashboard'))
 
+    status_filter = request.args.get('status', '').strip()
+    user_filter = request.args.get('user', '').strip()
+    search = request.args.get('q', '').strip()
+    cursor = request.args.get('cursor')
+    next_cursor = None
+
     try:
-        documents = list(mongo.db.documents.find())
+        query = build_document_query(status_filter, user_filter, search)
+
+        documents, next_cursor = fetch_page(
+            mongo.db.documents,
+            query,
+            DOCUMENT_LIST_PROJECTION,
+            cursor,
+            current_app.config.get('ADMIN_PAGE_SIZE', 50)
+        )
+        attach_owners(documents)
+        status_counts, total_documents = get_counts() # O(1) badges from the maintained counters
     except Exception as e:
         current_app.logger.error(f"Database error fetching all documents: {str(e)}", exc_info=True)
         flash('Could not load documents for admin view.', 'danger')
         documents = []
+        status_counts, total_documents = {}, 0
+
+    return render_template(
+        'admin/documents.html',
+        documents=documents,
+        next_cursor=next_cursor,
+        is_first_page=not cursor,
+        status_filter=status_filter,
+        user_filter=user_filter,
+        search=search,
+        statuses=DOCUMENT_STATUSES,
+        status_counts=status_counts,
+        total_documents=total_documents
+    )
+
+
+def build_document_query(status_filter, user_filter, search):
+    """Combines the admin listing filters and free-text search into one Mongo filter."""
+    clauses = []
+    if status_filter:
+        clauses.append({'status': status_filter})
+    if user_filter:
+        clauses.append({'user_id': resolve_user_filter(user_filter)})
+    search_query = build_search_query(search) if search else None
+    if search_query:
+        clauses.append(search_query)
+    if not clauses:
+        return {}
+    return clauses[0] if len(clauses) == 1 else {'$and': clauses}
+
+
+@admin_bp.route('/documents/search')
+@login_required
+def search_documents():
+    """
+    JSON search over original_name words, owner username/email and status.
+
+    Query parameters: q (search text), status, user, cursor (from a previous
+    response). Returns one keyset page of results with only the listing fields.
+    """
+    if not current_user.is_admin:
+        return jsonify({'error': 'Unauthorized access'}), 403
+
+    search = request.args.get('q', '').strip()
+    try:
+        query = build_document_query(
+            request.args.get('status', '').strip(),
+            request.args.get('user', '').strip(),
+            search
+        )
+        documents, next_cursor = fetch_page(
+            mongo.db.documents,
+            query,
+            DOCUMENT_LIST_PROJECTION,
+            request.args.get('cursor'),
+            current_app.config.get('ADMIN_PAGE_SIZE', 50)
+        )
+        attach_owners(documents, {'username': 1})
+    except PyMongoError as e:
+        current_app.logger.error(f"Database error during document search '{search}': {str(e)}", exc_info=True)
+        return jsonify({'error': 'Database error occurred during search.'}), 500
+
+    return jsonify({
+        'query': search,
+        'results': [{
+            'id': str(doc['_id']),
+            'original_name': doc.get('original_name'),
+            'owner': doc['owner'].get('username') if doc['owner'] else None,
+            'status': doc.get('status'),
+            'upload_date': doc['upload_date'].isoformat() if doc.get('upload_date') else None,
+            'file_size': doc.get('file_size'),
+        } for doc in documents],
+        'next_cursor': next_cursor,
+    })
+
+
+@admin_bp.route('/documents/typeahead')
+@login_required
+def document_typeahead():
+    """
+    Top matches for the notify form's document picker: ?q=<text>&limit=<n>.
+    Same matching as the admin search, newest first, a single bounded indexed query.
+    """
+    if not current_user.is_admin:
+        return jsonify({'error': 'Unauthorized access'}), 403
+
+    max_limit = current_app.config.get('TYPEAHEAD_LIMIT', 10)
+    limit = min(request.args.get('limit', max_limit, type=int) or max_limit, max_limit)
+    query = build_search_query(request.args.get('q', ''))
+    if query is None:
+        return jsonify({'results': []})
+
+    try:
+        documents = list(mongo.db.documents.find(query, {'original_name': 1, 'user_id': 1, 'status': 1})
+                         .sort(KEYSET_SORT).limit(limit))
+        attach_owners(documents, {'username': 1})
+    except PyMongoError as e:
+        current_app.logger.error(f"Database error during document typeahead: {str(e)}", exc_info=True)
+        return jsonify({'error': 'Database error occurred during search.'}), 500
+
+    return jsonify({'results': [{
+        'id': str(doc['_id']),
+        'original_name': doc.get('original_name'),
+        'owner': doc['owner'].get('username') if doc['owner'] else None,
+        'status': doc.get('status'),
+    } for doc in documents]})
+
+
+@admin_bp.route('/documents/export.zip', methods=['GET', 'POST'])
+@login_required
+def export_documents():
+    """
+    Streams a ZIP of many documents' files.
+
+    POST takes document_ids (the bulk form's checkboxes); GET exports whatever the
+    listing filters select (q, status, user). At most EXPORT_MAX_DOCUMENTS are included.
+    """
+    if not current_user.is_admin:
+        flash('Unauthorized access', 'danger')
+        current_app.logger.warning(f"Unauthorized admin export attempt by user {current_user.id}")
+        return redirect(url_for('main.dashboard'))
+
+    max_documents = current_app.config.get('EXPORT_MAX_DOCUMENTS', 1000)
+    if request.method == 'POST':
+        raw_ids = request.form.getlist('document_ids')
+        document_ids = [ObjectId(raw_id) for raw_id in raw_ids if ObjectId.is_valid(raw_id)]
+        if not document_ids:
+            flash('Select at least one document to export.', 'danger')
+            return redirect(url_for('admin.manage_documents'))
+        if len(document_ids) > max_documents:
+            flash(f'At most {max_documents} documents can be exported at once.', 'danger')
+            return redirect(url_for('admin.manage_documents'))
+        query = {'_id': {'$in': document_ids}}
+    else:
+        query = build_document_query(
+            request.args.get('status', '').strip(),
+            request.args.get('user', '').strip(),
+            request.args.get('q', '').strip()
+        )
+
+    try:
+        # Checked up front: once streaming starts, an error can no longer become a flash message
+        matched = mongo.db.documents.count_documents(query, limit=max_documents + 1)
+    except PyMongoError as e:
+        current_app.logger.error(f"Database error preparing export: {str(e)}", exc_info=True)
+        flash('Database error occurred while preparing the export.', 'danger')
+        return redirect(url_for('admin.manage_documents'))
+    if not matched:
+        flash('No documents matched the export.', 'warning')
+        return redirect(url_for('admin.manage_documents'))
+    if matched > max_documents:
+        flash(f'More than {max_documents} documents match; narrow the filters to export them.', 'danger')
+        return redirect(url_for('admin.manage_documents'))
+
+    current_app.logger.info(f"Admin {current_user.id} exporting {matched} documents as ZIP")
+    documents = iter_documents_with_owners(query, ZIP_DOCUMENT_PROJECTION, sort=KEYSET_SORT)
+    filename = f"nemsa-documents-{datetime.utcnow():%Y%m%d-%H%M%S}.zip"
+    return Response(
+        stream_with_context(stream_zip(documents)),
+        mimetype='application/zip',
+        headers={
+            'Content-Disposition': f'attachment; filename="{filename}"',
+            'X-Accel-Buffering': 'no', # Let nginx pass chunks through instead of buffering the archive
+            'Cache-Control': 'no-store',
+        }
+    )
+
+
+METADATA_EXPORT_FORMATS = {
+    'csv': (stream_csv, 'text/csv'),
+    'ndjson': (stream_ndjson, 'application/x-ndjson'),
+}
 
-    return render_template('admin/documents.html', documents=documents)
+
+@admin_bp.route('/documents/export.<any(csv, ndjson):export_format>')
+@login_required
+def export_metadata(export_format):
+    """
+    Streams document metadata joined with owner details as CSV or NDJSON.
+
+    Takes the listing filters (q, status, user) plus since/until (YYYY-MM-DD, on
+    upload_date) for monthly reports. Rows come from a server-side cursor and
+    owners are looked up per batch, so memory use is flat for any number of rows.
+    """
+    if not current_user.is_admin:
+        flash('Unauthorized access', 'danger')
+        current_app.logger.warning(f"Unauthorized admin export attempt by user {current_user.id}")
+        return redirect(url_for('main.dashboard'))
+
+    try:
+        clauses = [
+            build_document_query(
+                request.args.get('status', '').strip(),
+                request.args.get('user', '').strip(),
+                request.args.get('q', '').strip()
+            ),
+            upload_date_filter(request.args.get('since'), request.args.get('until')),
+        ]
+    except ValueError:
+        flash('Dates must be given as YYYY-MM-DD.', 'danger')
+        return redirect(url_for('admin.manage_documents'))
+    except PyMongoError as e:
+        current_app.logger.error(f"Database error preparing export: {str(e)}", exc_info=True)
+        flash('Database error occurred while preparing the export.', 'danger')
+        return redirect(url_for('admin.manage_documents'))
+    clauses = [clause for clause in clauses if clause]
+    query = {'$and': clauses} if len(clauses) > 1 else (clauses[0] if clauses else {})
+
+    generate, mimetype = METADATA_EXPORT_FORMATS[export_format]
+    documents = iter_documents_with_owners(
+        query, METADATA_PROJECTION,
+        batch_size=current_app.config.get('EXPORT_BATCH_SIZE', 1000),
+        sort=KEYSET_SORT
+    )
+    current_app.logger.info(f"Admin {current_user.id} exporting document metadata as {export_format}")
+    filename = f"nemsa-documents-{datetime.utcnow():%Y%m%d-%H%M%S}.{export_format}"
+    return Response(
+        stream_with_context(generate(documents)),
+        mimetype=mimetype,
+        headers={
+            'Content-Disposition': f'attachment; filename="{filename}"',
+            'X-Accel-Buffering': 'no',
+            'Cache-Control': 'no-store',
+        }
+    )
+
+
+def resolve_user_filter(user_filter):
+    """
+    Turns the admin 'user' filter (a user id or a username) into a user_id value.
+    Unknown usernames resolve to a fresh ObjectId so the listing is simply empty.
+    """
+    if ObjectId.is_valid(user_filter):
+        return ObjectId(user_filter)
+    user = find_user(user_filter)
+    return user['_id'] if user else ObjectId()
 
 # CORRECTED ROUTE PATH: Removed the leading /admin
 @admin_bp.route('/notify', methods=['GET', 'POST'])
@@ -35,13 +311,18 @@ def notify_user():
         return redirect(url_for('main.dashboard'))
 
     if request.method == 'GET':
-         try:
-             documents = list(mongo.db.documents.find())
-         except Exception as e:
-             current_app.logger.error(f"Database error fetching documents for notify page: {str(e)}", exc_info=True)
-             flash('Could not load documents.', 'danger')
-             documents = []
-         return render_template('admin/notify.html', documents=documents)
+         # Documents are picked through the typeahead endpoint; only a preselected one is loaded here
+         selected = None
+         document_id_str = request.args.get('document', '')
+         if ObjectId.is_valid(document_id_str):
+             try:
+                 selected = mongo.db.documents.find_one({'_id': ObjectId(document_id_str)}, {'original_name': 1, 'user_id': 1})
+                 if selected:
+                     attach_owners([selected], {'username': 1})
+             except Exception as e:
+                 current_app.logger.error(f"Database error fetching document for notify page: {str(e)}", exc_info=True)
+                 flash('Could not load the selected document.', 'danger')
+         return render_template('admin/notify.html', selected=selected, statuses=DOCUMENT_STATUSES)
 
     if request.method == 'POST':
         try:
@@ -59,17 +340,21 @@ def notify_user():
 
             document_id = ObjectId(document_id_str)
 
-            update_result = mongo.db.documents.update_one(
-                {'_id': document_id},
-                {'$set': {'status': new_status}}
-            )
+            # Returns the document as it was before the update: its old status moves the counters
+            with recording_change():
+                document = mongo.db.documents.find_one_and_update(
+                    {'_id': document_id},
+                    {'$set': {'status': new_status, 'status_updated_at': datetime.utcnow()}},
+                    return_document=ReturnDocument.BEFORE
+                )
 
-            if update_result.matched_count == 0:
+            if document is None:
                  flash('Document not found.', 'danger')
                  current_app.logger.warning(f"Admin tried to update non-existent doc ID: {document_id_str}")
                  return redirect(url_for('admin.notify_user'))
 
-            document = mongo.db.documents.find_one({'_id': document_id})
+            safe_record(record_status_changes, [(document.get('user_id'), document.get('status'), new_status)])
+
             if not document or 'user_id' not in document or not ObjectId.is_valid(str(document['user_id'])):
                  flash('Could not find user associated with document.', 'danger')
                  current_app.logger.error(f"Document {document_id} missing user_id or user_id invalid.")
@@ -107,4 +392,192 @@ def notify_user():
             return redirect(url_for('admin.notify_user'))
 
     flash('Invalid request method.', 'warning')
-    return redirect(url_for('admin.manage_documents'))
\ No newline at end of file
+    return redirect(url_for('admin.manage_documents'))
+
+
+@admin_bp.route('/notify/bulk', methods=['POST'])
+@login_required
+def bulk_notify():
+    """
+    Set one status (and optional message) on many documents and notify their owners.
+
+    Accepts form fields (document_ids repeated, status, message) or a JSON body with
+    the same keys. Costs a fixed number of database round-trips however many
+    documents are selected: one documents query, one users query, one bulk_write
+    and one counter update, with all emails handed to send_bulk_emails together.
+    """
+    wants_json = request.is_json
+    if not current_user.is_admin:
+        current_app.logger.warning(f"Unauthorized admin bulk notify attempt by user {current_user.id}")
+        if wants_json:
+            return jsonify({'error': 'Unauthorized access'}), 403
+        flash('Unauthorized access', 'danger')
+        return redirect(url_for('main.dashboard'))
+
+    if wants_json:
+        payload = request.get_json(silent=True) or {}
+        raw_ids = payload.get('document_ids') or []
+        new_status = (payload.get('status') or '').strip()
+        message = payload.get('message') or ''
+    else:
+        raw_ids = request.form.getlist('document_ids')
+        new_status = request.form.get('status', '').strip()
+        message = request.form.get('message', '')
+
+    max_documents = current_app.config.get('ADMIN_BULK_MAX_DOCUMENTS', 500)
+    error = None
+    if not new_status:
+        error = 'Status is required.'
+    elif not raw_ids:
+        error = 'Select at least one document.'
+    elif len(raw_ids) > max_documents:
+        error = f'At most {max_documents} documents can be updated at once.'
+    if error:
+        if wants_json:
+            return jsonify({'error': error}), 400
+        flash(error, 'danger')
+        return redirect(url_for('admin.manage_documents'))
+
+    # One result entry per requested id, in request order (duplicates collapsed)
+    results = {}
+    document_ids = []
+    for raw_id in raw_ids:
+        key = str(ObjectId(raw_id)) if ObjectId.is_valid(raw_id) else str(raw_id)
+        if key in results:
+            continue
+        if ObjectId.is_valid(raw_id):
+            results[key] = {'document_id': key, 'result': 'not_found'}
+            document_ids.append(ObjectId(key))
+        else:
+            results[key] = {'document_id': key, 'result': 'invalid_id'}
+
+    try:
+        # Read first so the old statuses are known for the counters
+        documents = attach_owners(list(mongo.db.documents.find(
+            {'_id': {'$in': document_ids}},
+            {'user_id': 1, 'original_name': 1, 'filename': 1, 'status': 1}
+        ))) if document_ids else []
+
+        if documents:
+            status_updated_at = datetime.utcnow()
+            with recording_change():
+                mongo.db.documents.bulk_write(
+                    [UpdateOne({'_id': doc['_id']}, {'$set': {'status': new_status, 'status_updated_at': status_updated_at}})
+                     for doc in documents],
+                    ordered=False
+                )
+            safe_record(record_status_changes, [(doc.get('user_id'), doc.get('status'), new_status) for doc in documents])
+    except PyMongoError as e:
+        current_app.logger.error(f"Database error during bulk notify: {str(e)}", exc_info=True)
+        if wants_json:
+            return jsonify({'error': 'Database error occurred during bulk update.'}), 500
+        flash('Database error occurred during bulk update.', 'danger')
+        return redirect(url_for('admin.manage_documents'))
+
+    # Build every notification first, then deliver them together
+    messages = []
+    message_results = []
+    for doc in documents:
+        entry = results[str(doc['_id'])]
+        entry['original_name'] = doc.get('original_name', doc.get('filename', 'Document'))
+        owner = doc['owner']
+        if not owner or not owner.get('email') or not owner.get('username'):
+            entry['result'] = 'updated_no_owner'
+            current_app.logger.error(f"Owner of document {doc['_id']} not found or missing email/username.")
+            continue
+        try:
+            messages.append(build_message(
+                f"Document Status Update: {new_status}",
+                [owner['email']],
+                'status_update',
+                username=owner['username'],
+                document_name=entry['original_name'],
+                new_status=new_status,
+                admin_message=message
+            ))
+            message_results.append(entry)
+        except Exception as e:
+            entry['result'] = 'email_failed'
+            current_app.logger.error(f"Could not render notification for document {doc['_id']}: {e}", exc_info=True)
+
+    for entry, delivered in zip(message_results, send_bulk_emails(messages)):
+        entry['result'] = 'notified' if delivered else 'email_failed'
+
+    results = list(results.values())
+    notified = sum(1 for entry in results if entry['result'] == 'notified')
+    current_app.logger.info(f"Admin {current_user.id} bulk-set status '{new_status}' on {len(documents)} documents, {notified} notified")
+
+    if wants_json:
+        return jsonify({'status': new_status, 'updated': len(documents), 'notified': notified, 'results': results})
+
+    flash(f'Updated {len(documents)} of {len(results)} documents; {notified} notifications sent.',
+          'success' if notified == len(results) else 'warning')
+    return render_template('admin/bulk_results.html', results=results, new_status=new_status)
+
+
+@admin_bp.route('/documents/<document_id>/preview')
+@login_required
+def document_preview(document_id):
+    """Small WebP/JPEG thumbnail of an uploaded image, rendered once and served from the preview cache."""
+    if not current_user.is_admin:
+        abort(403)
+    if not ObjectId.is_valid(document_id):
+        abort(404)
+
+    document = mongo.db.documents.find_one(
+        {'_id': ObjectId(document_id)},
+        {'filename': 1, 'sha256': 1, 'mime_type': 1}
+    )
+    if not document:
+        abort(404)
+
+    path = get_preview(document)
+    if not path:
+        abort(404)
+
+    # Previews are derived from immutable content, so browsers may keep them for a day
+    return send_file(os.path.abspath(path), mimetype=preview_mimetype(), max_age=86400, conditional=True)
+
+
+@admin_bp.route('/stats')
+@login_required
+def stats():
+    """Throughput and backlog figures, read from the materialized analytics document."""
+    if not current_user.is_admin:
+        flash('Unauthorized access', 'danger')
+        current_app.logger.warning(f"Unauthorized admin stats access attempt by user {current_user.id}")
+        return redirect(url_for('main.dashboard'))
+
+    try:
+        analytics = get_dashboard_stats(current_app._get_current_object())
+    except Exception as e:
+        current_app.logger.error(f"Database error loading analytics: {str(e)}", exc_info=True)
+        flash('Could not load statistics.', 'danger')
+        analytics = None
+
+    # A lease-only placeholder (first refresh still running) has no computed_at yet
+    if analytics and not analytics.get('computed_at'):
+        analytics = None
+    return render_template('admin/stats.html', analytics=analytics)
+
+
+@admin_bp.route('/mail/stats')
+@login_required
+def mail_stats():
+    """Queue depth, delivery counters and latency of this process's mail dispatcher."""
+    if not current_user.is_admin:
+        return jsonify({'error': 'Unauthorized access'}), 403
+
+    stats = mail_dispatcher.stats()
+    stats['delivery_mode'] = current_app.config.get('MAIL_DELIVERY_MODE')
+    return jsonify(stats)
+
+
+
+@admin_bp.route('/cache/stats')
+@login_required
+def cache_stats():
+    """Hit/miss counters of this process's user loader cache."""
+    if not current_user.is_admin:
+        return jsonify({'error': 'Unauthorized access'}), 403
+    return jsonify(user_cache.stats())
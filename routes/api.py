@@ -0,0 +1,159 @@
+# routes/api.py
+import hashlib
+import logging
+from datetime import datetime
+from functools import wraps
+from flask import Blueprint, request, jsonify, current_app
+from flask_login import current_user
+from bson import ObjectId
+from pymongo.errors import PyMongoError
+from extensions import mongo
+from routes.admin import build_document_query
+from services.document_stats import stats_version
+from utils.pagination import fetch_page
+
+api_bp = Blueprint('api', __name__)
+logger = logging.getLogger(__name__)
+
+# Fields a client may ask for with ?fields=; 'id' is the document's _id
+API_DOCUMENT_FIELDS = {
+    'id', 'original_name', 'filename', 'status', 'upload_date', 'status_updated_at',
+    'file_size', 'mime_type', 'sha256', 'user_id',
+}
+DEFAULT_DOCUMENT_FIELDS = ['id', 'original_name', 'status', 'upload_date', 'file_size']
+
+
+def api_login_required(view):
+    """Like login_required, but answers 401 JSON instead of redirecting to the login page."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not current_user.is_authenticated:
+            return jsonify({'error': 'Authentication required'}), 401
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def parse_fields(raw):
+    """
+    Turns ?fields=a,b into (fields, projection). Unknown names raise ValueError.
+    upload_date and _id are always fetched because the page cursor is built from them.
+    """
+    fields = [f.strip() for f in raw.split(',') if f.strip()] if raw else DEFAULT_DOCUMENT_FIELDS
+    unknown = sorted(set(fields) - API_DOCUMENT_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}. Allowed: {', '.join(sorted(API_DOCUMENT_FIELDS))}")
+    projection = {field: 1 for field in fields if field != 'id'}
+    projection['upload_date'] = 1
+    return fields, projection
+
+
+def serialize_document(document, fields):
+    item = {}
+    for field in fields:
+        value = document.get('_id' if field == 'id' else field)
+        if isinstance(value, ObjectId):
+            value = str(value)
+        elif isinstance(value, datetime):
+            value = value.isoformat() + 'Z' # Stored as naive UTC
+        item[field] = value
+    return item
+
+
+def collection_etag(*parts):
+    """
+    Strong ETag for a response: the documents change marker plus everything that
+    shapes the response (user, query string). Any upload or status change bumps the
+    marker, so an unchanged ETag means the response would be identical.
+    """
+    raw = '|'.join(str(part) for part in (stats_version(), current_user.id, *parts))
+    return hashlib.sha256(raw.encode()).hexdigest()[:32]
+
+
+def not_modified(etag):
+    """304 response if the client already has this ETag, else None."""
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    return None
+
+
+def with_etag(response, etag):
+    response.set_etag(etag)
+    # Clients may keep the body but must revalidate every time (cheap: usually a 304)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+@api_bp.route('/documents')
+@api_login_required
+def list_documents():
+    """
+    Keyset-paginated documents, newest first.
+
+    Query parameters:
+        fields: comma-separated subset of API_DOCUMENT_FIELDS (projection is done by Mongo).
+        limit: page size, at most API_MAX_PAGE_SIZE.
+        cursor: next_cursor from the previous page.
+        status, q: filter by status / admin search text.
+        user: admins only, a user id or username (others always see their own documents).
+    """
+    try:
+        fields, projection = parse_fields(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    max_page_size = current_app.config.get('API_MAX_PAGE_SIZE', 100)
+    limit = min(max(request.args.get('limit', max_page_size, type=int) or max_page_size, 1), max_page_size)
+    status_filter = request.args.get('status', '').strip()
+    search = request.args.get('q', '').strip()
+    user_filter = request.args.get('user', '').strip() if current_user.is_admin else current_user.id
+
+    try:
+        etag = collection_etag(request.query_string.decode(), limit)
+        cached = not_modified(etag)
+        if cached:
+            return cached
+
+        query = build_document_query(status_filter, user_filter, search)
+        documents, next_cursor = fetch_page(mongo.db.documents, query, projection, request.args.get('cursor'), limit)
+    except PyMongoError as e:
+        current_app.logger.error(f"Database error in documents API: {str(e)}", exc_info=True)
+        return jsonify({'error': 'Database error'}), 500
+
+    response = jsonify({
+        'documents': [serialize_document(doc, fields) for doc in documents],
+        'next_cursor': next_cursor,
+    })
+    return with_etag(response, etag)
+
+
+@api_bp.route('/documents/<document_id>')
+@api_login_required
+def get_document(document_id):
+    """One document (owners see their own, admins any); supports fields= and If-None-Match."""
+    if not ObjectId.is_valid(document_id):
+        return jsonify({'error': 'Not found'}), 404
+    try:
+        fields, projection = parse_fields(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    query = {'_id': ObjectId(document_id)}
+    if not current_user.is_admin:
+        query['user_id'] = ObjectId(current_user.id)
+
+    try:
+        etag = collection_etag(document_id, ','.join(fields))
+        cached = not_modified(etag)
+        if cached:
+            return cached
+        document = mongo.db.documents.find_one(query, projection)
+    except PyMongoError as e:
+        current_app.logger.error(f"Database error in documents API: {str(e)}", exc_info=True)
+        return jsonify({'error': 'Database error'}), 500
+
+    if not document:
+        return jsonify({'error': 'Not found'}), 404
+    return with_etag(jsonify(serialize_document(document, fields)), etag)
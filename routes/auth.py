@@ -2,11 +2,13 @@ from flask import Blueprint, render_template, request, flash, redirect, url_for,
 from flask_login import login_user, logout_user, current_user
 from werkzeug.security import check_password_hash, generate_password_hash
 from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
 import re
 import logging
 from extensions import mongo
 from models import User
 from services.email_services import send_email # Assuming email_services exists and is functional
+from services.user_cache import user_cache
 from flask_wtf import FlaskForm # Import FlaskForm
 
 auth_bp = Blueprint('auth', __name__)
@@ -56,6 +58,7 @@ def logout():
     """Handle user logout with security notifications."""
     if current_user.is_authenticated:
         handle_logout_notification()
+        user_cache.invalidate(current_user.id) # Next login reloads a fresh copy
 
     logout_user()
     flash('You have been logged out.', 'info')
@@ -87,6 +90,7 @@ def handle_login_request(form_data):
              return redirect(url_for('auth.login'))
 
         login_user(user)
+        user_cache.set(user.id, user) # Just loaded, so the next request needs no users lookup
         send_login_notification(user)
         flash('Login successful!', 'success')
         return redirect(url_for('main.dashboard'))
@@ -107,12 +111,13 @@ def handle_registration_request(form_data):
         if not validate_registration(username, email, password, confirm_password):
             return redirect(url_for('auth.register'))
 
-        if user_exists(username, email):
+        # A single insert: the unique username_lower and email indexes reject duplicates
+        try:
+            create_new_user(username, email, password)
+        except DuplicateKeyError:
             flash('Username or email already exists', 'danger')
             return redirect(url_for('auth.register'))
 
-        create_new_user(username, email, password)
-
         try:
              send_welcome_email(username, email)
         except Exception as e:
@@ -170,11 +175,11 @@ def validate_registration(username, email, password, confirm_password):
 
 # Database operations (Keep as is)
 def find_user(username):
-    """Find user in database by username (case-insensitive)."""
+    """Find user in database by username (case-insensitive, via the username_lower index)."""
     if not username:
         return None
     return mongo.db.users.find_one({
-        'username': {'$regex': f'^{re.escape(username)}$', '$options': 'i'}
+        'username_lower': username.strip().lower()
     })
 
 def find_user_by_email(email):
@@ -185,24 +190,12 @@ def find_user_by_email(email):
         'email': email.lower()
     })
 
-def user_exists(username, email):
-    """Check if user already exists in database by username (case-insensitive) or email (case-insensitive)."""
-    query_parts = []
-    if username:
-         query_parts.append({'username': {'$regex': f'^{re.escape(username)}$', '$options': 'i'}})
-    if email:
-         query_parts.append({'email': email.lower()})
-
-    if not query_parts:
-        return False
-
-    return mongo.db.users.find_one({'$or': query_parts}) is not None
-
 def create_new_user(username, email, password):
-    """Create new user in database."""
+    """Create new user in database. Raises DuplicateKeyError if the username or email is taken."""
     hashed_pw = generate_password_hash(password)
     user_data = {
         'username': username.strip(),
+        'username_lower': username.strip().lower(), # Backs case-insensitive login and uniqueness
         'email': email.strip().lower(),
         'password': hashed_pw,
         'is_admin': False
@@ -1,14 +1,21 @@
 from flask import (Blueprint, render_template, redirect, url_for,
-                   flash, request, send_from_directory, current_app)
+                   flash, request, current_app, jsonify)
 from flask_login import login_required, current_user
-from datetime import datetime
-import os
 import logging
 from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.utils import secure_filename # Keep this import as it's used elsewhere (e.g., in utils)
 from pymongo.errors import PyMongoError
 from extensions import mongo
 from utils.file_utils import allowed_file, save_uploaded_file
+from services.blob_store import release_blob
+from services.document_services import create_document
+from services.document_stats import get_counts
+from services.storage import get_storage
+from services.upload_sessions import (UploadSessionError, create_session, get_session, write_chunk,
+                                      finalize_session, cancel_session, session_summary)
+from utils.file_serving import serve_file
+from utils.upload_stream import DisallowedContent
+from utils.template_manifest import template_manifest
 from bson import ObjectId
 from flask_wtf import FlaskForm
 
@@ -29,6 +36,8 @@ def dashboard():
         documents = list(mongo.db.documents.find({
             'user_id': user_obj_id
         }).sort('upload_date', -1))
+        # Summary tiles read the maintained counters instead of counting documents
+        status_counts, total_documents = get_counts(user_obj_id)
 
         template_dir = current_app.config['TEMPLATE_DOWNLOAD_FOLDER']
         # abs_template_dir = os.path.abspath(template_dir) # Keep debug logging if needed
@@ -36,12 +45,8 @@ def dashboard():
         # current_app.logger.debug(f"Resolved absolute path for template directory: {abs_template_dir}")
 
         try:
-            all_items_in_dir = os.listdir(template_dir)
-            # current_app.logger.debug(f"All items found in '{template_dir}': {all_items_in_dir}")
-
-            template_files = [f for f in all_items_in_dir if os.path.isfile(os.path.join(template_dir, f))]
-            # current_app.logger.debug(f"Filtered list (only files): {template_files}")
-
+            # Cached manifest: the folder is only rescanned when its mtime changes
+            template_files = template_manifest.names(template_dir)
         except OSError as e:
             current_app.logger.error(f"Error listing template files from {template_dir}: {e}")
             template_files = []
@@ -51,8 +56,10 @@ def dashboard():
         flash('Could not load documents.', 'danger')
         documents = []
         template_files = []
+        status_counts, total_documents = {}, 0
 
-    return render_template('dashboard.html', documents=documents, template_files=template_files)
+    return render_template('dashboard.html', documents=documents, template_files=template_files,
+                           status_counts=status_counts, total_documents=total_documents)
 
 # Add route for downloading template files
 @main_bp.route('/download_template/<filename>')
@@ -61,19 +68,15 @@ def download_template(filename):
 
     template_dir = current_app.config['TEMPLATE_DOWNLOAD_FOLDER']
 
-    # --- CORRECTED LOGIC ---
-    # Do NOT use secure_filename here. Use the original filename from the URL
-    # because that's the name listed by os.listdir and the name of the file on disk.
-    # send_from_directory is secure and prevents path traversal by ensuring the
-    # final path resolved from 'directory' and 'path' is inside 'directory'.
-    # secure_filename_part = secure_filename(filename) # REMOVE THIS LINE
-
-    # Construct the full path to the intended file using the ORIGINAL filename
-    filepath = os.path.join(template_dir, filename) # USE filename directly
+    # Look the file up in the cached manifest instead of exists/isfile calls.
+    # Only names actually present in the folder are served, which also rules out path tricks.
+    try:
+        entry = template_manifest.get(template_dir, filename)
+    except OSError as e:
+        current_app.logger.error(f"Error reading template manifest for {template_dir}: {e}")
+        entry = None
 
-    # Check if the file exists at the constructed path AND is a file
-    # This check still uses the path constructed with the original filename
-    if not os.path.exists(filepath) or not os.path.isfile(filepath):
+    if entry is None:
         flash(f"Template file not found: {filename}", 'danger')
         current_app.logger.warning(f"Attempted download of non-existent or non-file template: {filename}")
         if current_user.is_authenticated:
@@ -81,15 +84,17 @@ def download_template(filename):
         return redirect(url_for('main.home'))
 
 
-    # Serve the file using send_from_directory
-    # Pass the ORIGINAL filename as the path argument to send_from_directory.
-    # send_from_directory will handle the secure resolution of this path relative to the directory.
+    # Serve the file using serve_file (send_from_directory, or a proxy hand-off per FILE_SERVING_MODE).
+    # Templates are public and their ETag is the content hash, so they can be cached for long.
     try:
-        return send_from_directory(
-            directory=template_dir,
-            path=filename, # USE filename directly here
-            as_attachment=True,
-            download_name=filename # Use original filename for the download client side
+        return serve_file(
+            template_dir,
+            entry.name,
+            download_name=entry.name, # Use original filename for the download client side
+            etag=entry.etag,
+            mimetype=entry.mimetype,
+            max_age=current_app.config.get('TEMPLATE_DOWNLOAD_MAX_AGE'),
+            accel_prefix=current_app.config.get('X_ACCEL_TEMPLATE_PREFIX')
         )
     except Exception as e:
         current_app.logger.error(f"Error serving template file {filename}: {e}", exc_info=True)
@@ -104,7 +109,9 @@ def download_template(filename):
 @login_required
 # Remember if you are using csrf.exempt in app.py, you don't need any decorator here
 def upload():
-    form = FlaskForm()
+    # Only renders the CSRF field: the body is parsed (and streamed to disk) by request.files
+    # inside the try below, so size and content rejections raised while parsing are handled there
+    form = FlaskForm(formdata=None)
 
     if request.method == 'POST':
         try:
@@ -122,27 +129,12 @@ def upload():
                 allowed = ", ".join(current_app.config.get('ALLOWED_EXTENSIONS', []))
                 raise ValueError(f"Invalid file type. Allowed extensions: {allowed}")
 
-            stored_filename = save_uploaded_file(file)
-            if not stored_filename:
-                 raise RuntimeError("File save failed on the server.")
+            # Size and SHA-256 are measured while the file streams to disk, no extra stat/read needed
+            saved_file = save_uploaded_file(file)
+            if not saved_file:
+                 raise RuntimeError("File could not be saved. Make sure it is a valid PDF, Word document or image.")
 
-            filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], stored_filename)
-            try:
-                file_size = os.path.getsize(filepath)
-            except OSError as e:
-                 current_app.logger.error(f"Error getting size of saved file {filepath}: {e}")
-                 file_size = 0
-
-            document = {
-                'user_id': ObjectId(current_user.id),
-                'filename': stored_filename,
-                'original_name': file.filename,
-                'upload_date': datetime.utcnow(),
-                'status': 'Pending Review',
-                'file_size': file_size
-            }
-
-            mongo.db.documents.insert_one(document)
+            create_document(ObjectId(current_user.id), saved_file, file.filename)
 
             flash('Document uploaded successfully!', 'success')
             return redirect(url_for('main.dashboard'))
@@ -150,19 +142,23 @@ def upload():
         except RequestEntityTooLarge:
             flash(f'File exceeds maximum size limit ({current_app.config.get("MAX_CONTENT_LENGTH", 0) // (1024*1024)}MB).', 'danger')
             return render_template('upload.html', form=form)
+        except DisallowedContent:
+            # Raised while request.files is parsed, as soon as the start of the file was sniffed
+            flash("File could not be saved. Make sure it is a valid PDF, Word document or image.", 'danger')
+            return render_template('upload.html', form=form)
         except (ValueError, RuntimeError) as e:
             flash(str(e), 'danger')
             return render_template('upload.html', form=form)
         except PyMongoError as e:
             logger.error(f"Database error during upload: {str(e)}", exc_info=True)
             flash('Database error occurred while saving document metadata.', 'danger')
-            if 'stored_filename' in locals() and stored_filename:
+            if 'saved_file' in locals() and saved_file:
                 try:
-                    if os.path.exists(filepath):
-                        os.remove(filepath)
-                        logger.info(f"Cleaned up uploaded file {stored_filename} due to DB error.")
+                    # Drop this upload's blob reference; the file goes only if nothing else uses it
+                    release_blob(saved_file.sha256)
+                    logger.info(f"Released blob {saved_file.filename} due to DB error.")
                 except Exception as cleanup_e:
-                    logger.error(f"Error cleaning up file {stored_filename} at {filepath}: {cleanup_e}")
+                    logger.error(f"Error releasing blob {saved_file.filename}: {cleanup_e}")
             return render_template('upload.html', form=form)
         except Exception as e:
             logger.error(f"Unexpected error during upload: {str(e)}", exc_info=True)
@@ -172,35 +168,108 @@ def upload():
 
     return render_template('upload.html', form=form)
 
-@main_bp.route('/download/<filename>')
+
+# Resumable chunked uploads (JSON; the upload page switches to these for large files).
+# CSRF is checked by Flask-WTF from the X-CSRFToken header.
+@main_bp.route('/uploads/sessions', methods=['POST'])
+@login_required
+def start_upload_session():
+    payload = request.get_json(silent=True) or {}
+    try:
+        session = create_session(ObjectId(current_user.id), payload.get('filename'), payload.get('size'))
+    except UploadSessionError as e:
+        return jsonify({'error': str(e)}), e.status
+    except Exception as e:
+        logger.error(f"Error starting upload session: {str(e)}", exc_info=True)
+        return jsonify({'error': 'Could not start the upload.'}), 500
+    return jsonify(session_summary(session)), 201
+
+
+@main_bp.route('/uploads/sessions/<session_id>', methods=['GET', 'DELETE'])
+@login_required
+def upload_session(session_id):
+    try:
+        if request.method == 'DELETE':
+            cancel_session(session_id, ObjectId(current_user.id))
+            return '', 204
+        # Lets a client resume after a dropped connection: only missing_chunks need sending
+        return jsonify(session_summary(get_session(session_id, ObjectId(current_user.id))))
+    except UploadSessionError as e:
+        return jsonify({'error': str(e)}), e.status
+    except PyMongoError as e:
+        logger.error(f"Database error reading upload session {session_id}: {str(e)}", exc_info=True)
+        return jsonify({'error': 'Database error occurred.'}), 500
+
+
+@main_bp.route('/uploads/sessions/<session_id>/chunks/<int:index>', methods=['PUT'])
+@login_required
+def upload_chunk(session_id, index):
+    try:
+        # The raw body is copied to disk in small pieces; it is never buffered whole
+        session = write_chunk(session_id, ObjectId(current_user.id), index, request.content_length, request.stream)
+    except UploadSessionError as e:
+        return jsonify({'error': str(e)}), e.status
+    except RequestEntityTooLarge:
+        return jsonify({'error': 'Chunk exceeds the maximum request size.'}), 413
+    except Exception as e:
+        logger.error(f"Error writing chunk {index} of upload session {session_id}: {str(e)}", exc_info=True)
+        return jsonify({'error': 'Could not store the chunk; send it again.'}), 500
+    return jsonify({'received': len(session.get('received', [])), 'total_chunks': session['total_chunks']})
+
+
+@main_bp.route('/uploads/sessions/<session_id>/finalize', methods=['POST'])
+@login_required
+def finalize_upload_session(session_id):
+    # Safe to retry: a completed session answers with the same document, and a failed
+    # document insert keeps the stored file for the next attempt
+    try:
+        session, document_id = finalize_session(session_id, ObjectId(current_user.id))
+    except UploadSessionError as e:
+        return jsonify({'error': str(e)}), e.status
+    except PyMongoError as e:
+        logger.error(f"Database error finalizing upload session {session_id}: {str(e)}", exc_info=True)
+        return jsonify({'error': 'Database error occurred while saving the document; try again.'}), 503
+    except Exception as e:
+        logger.error(f"Error finalizing upload session {session_id}: {str(e)}", exc_info=True)
+        return jsonify({'error': 'An unexpected error occurred while saving the document; try again.'}), 500
+
+    flash('Document uploaded successfully!', 'success')
+    return jsonify({'document_id': str(document_id), 'redirect': url_for('main.dashboard')}), 201
+
+
+@main_bp.route('/download/<document_id>')
 @login_required
-def download(filename):
+def download(document_id):
      try:
           user_obj_id = ObjectId(current_user.id)
+          # Keyed on the document, not the stored filename: deduplicated uploads share one blob
+          # name, and each document keeps its own original_name for the download
           document = mongo.db.documents.find_one({
-              'filename': filename,
+              '_id': ObjectId(document_id),
               'user_id': user_obj_id
-          })
+          }) if ObjectId.is_valid(document_id) else None
 
           if not document:
               flash('File not found or unauthorized access', 'danger')
-              current_app.logger.warning(f"Unauthorized download attempt for file {filename} by user {current_user.id}")
+              current_app.logger.warning(f"Unauthorized download attempt for document {document_id} by user {current_user.id}")
               return redirect(url_for('main.dashboard'))
 
-          filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-          if not os.path.exists(filepath) or not os.path.isfile(filepath):
+          filename = document['filename']
+          storage = get_storage()
+          if not storage.exists(filename):
               flash('File content not found on server.', 'danger')
-              current_app.logger.error(f"File {filename} not found on disk for document {document.get('_id')}")
+              current_app.logger.error(f"File {filename} not found in {storage.name} storage for document {document.get('_id')}")
               return redirect(url_for('main.dashboard'))
 
-          return send_from_directory(
-              directory=current_app.config['UPLOAD_FOLDER'],
-              path=filename,
-              as_attachment=True,
-              download_name=document.get('original_name', filename)
+          # Ownership is checked above; local files may be handed to the front proxy, GridFS
+          # files are streamed in chunks. Stored files are content-addressed, so their SHA-256 is a strong ETag.
+          return storage.serve(
+              filename,
+              download_name=document.get('original_name', filename),
+              etag=document.get('sha256')
           )
 
      except Exception as e:
-         current_app.logger.error(f"Error during download for file {filename}: {str(e)}", exc_info=True)
+         current_app.logger.error(f"Error during download for document {document_id}: {str(e)}", exc_info=True)
          flash('An error occurred during download.', 'danger')
          return redirect(url_for('main.dashboard'))
\ No newline at end of file
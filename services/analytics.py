@@ -0,0 +1,160 @@
+# services/analytics.py
+import os
+import threading
+import time
+import logging
+from datetime import datetime, timedelta
+from pymongo.errors import DuplicateKeyError
+from extensions import mongo
+
+logger = logging.getLogger(__name__)
+
+# Materialized results live in the analytics collection under this _id
+DASHBOARD_ID = 'admin_dashboard'
+PENDING_STATUS = 'Pending Review'
+
+
+def uploads_per_day(since):
+    """[{'day': 'YYYY-MM-DD', 'uploads': n, 'bytes': n}] for documents uploaded since `since`."""
+    pipeline = [
+        {'$match': {'upload_date': {'$gte': since}}}, # Range on the upload_date index
+        {'$group': {
+            '_id': {'$dateToString': {'format': '%Y-%m-%d', 'date': '$upload_date'}},
+            'uploads': {'$sum': 1},
+            'bytes': {'$sum': {'$ifNull': ['$file_size', 0]}},
+        }},
+        {'$sort': {'_id': 1}},
+    ]
+    return [{'day': row['_id'], 'uploads': row['uploads'], 'bytes': row['bytes']}
+            for row in mongo.db.documents.aggregate(pipeline, allowDiskUse=True)]
+
+
+def review_times(since):
+    """
+    Time from upload to the last status change for documents reviewed since `since`.
+    Returns {'reviewed': n, 'avg_hours': x, 'median_hours': x} (None values when nothing was reviewed).
+
+    The median is found by counting, then sorting the durations and skipping to the
+    middle one, which works on every MongoDB version ($median needs 7.0).
+    """
+    match = {'$match': {
+        'status': {'$ne': PENDING_STATUS},
+        'status_updated_at': {'$gte': since},
+    }}
+    duration = {'$project': {'_id': 0, 'ms': {'$subtract': ['$status_updated_at', '$upload_date']}}}
+
+    summary = list(mongo.db.documents.aggregate([
+        match, duration,
+        {'$group': {'_id': None, 'reviewed': {'$sum': 1}, 'avg_ms': {'$avg': '$ms'}}},
+    ], allowDiskUse=True))
+    if not summary or not summary[0]['reviewed']:
+        return {'reviewed': 0, 'avg_hours': None, 'median_hours': None}
+
+    reviewed = summary[0]['reviewed']
+    middle = list(mongo.db.documents.aggregate([
+        match, duration,
+        {'$sort': {'ms': 1}},
+        {'$skip': (reviewed - 1) // 2},
+        {'$limit': 2 - reviewed % 2}, # Two middle values when the count is even
+    ], allowDiskUse=True))
+    median_ms = sum(row['ms'] for row in middle) / len(middle)
+    return {
+        'reviewed': reviewed,
+        'avg_hours': round(summary[0]['avg_ms'] / 3600000, 1),
+        'median_hours': round(median_ms / 3600000, 1),
+    }
+
+
+def backlog_by_status():
+    """[{'status', 'documents', 'oldest_upload'}] for every status, largest first."""
+    pipeline = [
+        {'$group': {'_id': '$status', 'documents': {'$sum': 1}, 'oldest_upload': {'$min': '$upload_date'}}},
+        {'$sort': {'documents': -1}},
+    ]
+    return [{'status': row['_id'] or 'Unknown', 'documents': row['documents'], 'oldest_upload': row['oldest_upload']}
+            for row in mongo.db.documents.aggregate(pipeline, allowDiskUse=True)]
+
+
+def storage_by_type():
+    """
+    [{'mime_type', 'documents', 'bytes'}], largest first. Bytes are per document;
+    shared (deduplicated) blobs are counted for each document that uses them.
+    """
+    pipeline = [
+        {'$group': {
+            '_id': {'$ifNull': ['$mime_type', 'unknown']},
+            'documents': {'$sum': 1},
+            'bytes': {'$sum': {'$ifNull': ['$file_size', 0]}},
+        }},
+        {'$sort': {'bytes': -1}},
+    ]
+    return [{'mime_type': row['_id'], 'documents': row['documents'], 'bytes': row['bytes']}
+            for row in mongo.db.documents.aggregate(pipeline, allowDiskUse=True)]
+
+
+def stored_bytes():
+    """Bytes actually on disk: one copy per blob."""
+    rows = list(mongo.db.blobs.aggregate([{'$group': {'_id': None, 'bytes': {'$sum': '$size'}, 'blobs': {'$sum': 1}}}]))
+    return {'bytes': rows[0]['bytes'], 'blobs': rows[0]['blobs']} if rows else {'bytes': 0, 'blobs': 0}
+
+
+def refresh_dashboard_stats(window_days):
+    """Run every pipeline and store the results as one analytics document. Returns it."""
+    started = time.monotonic()
+    now = datetime.utcnow()
+    since = now - timedelta(days=window_days)
+    stats = {
+        'window_days': window_days,
+        'uploads_per_day': uploads_per_day(since),
+        'review_times': review_times(since),
+        'backlog': backlog_by_status(),
+        'storage_by_type': storage_by_type(),
+        'stored': stored_bytes(),
+        'computed_at': now,
+        'compute_seconds': round(time.monotonic() - started, 2),
+        'refreshing_until': None,
+    }
+    mongo.db.analytics.update_one({'_id': DASHBOARD_ID}, {'$set': stats}, upsert=True)
+    logger.info(f"Analytics refreshed in {stats['compute_seconds']}s")
+    return stats
+
+
+def get_dashboard_stats(app):
+    """
+    Returns the materialized stats document (or None before the first refresh)
+    without running any aggregation. When it is older than ANALYTICS_MAX_AGE
+    seconds a refresh is started in a background thread and the stale copy is
+    returned meanwhile; a lease in the analytics document ensures only one
+    worker process refreshes at a time.
+    """
+    config = app.config
+    stats = mongo.db.analytics.find_one({'_id': DASHBOARD_ID})
+    now = datetime.utcnow()
+    computed_at = stats.get('computed_at') if stats else None
+    if computed_at and now - computed_at < timedelta(seconds=config['ANALYTICS_MAX_AGE']):
+        return stats
+    if config.get('ANALYTICS_REFRESH_IN_WEB') and _claim_refresh(now, config['ANALYTICS_REFRESH_LEASE']):
+        threading.Thread(target=_refresh_in_background, args=(app,), name='analytics-refresh', daemon=True).start()
+    return stats
+
+
+def _claim_refresh(now, lease_seconds):
+    """Atomically take the refresh lease. False if another process holds it."""
+    try:
+        # If the lease is held the filter misses and the upsert collides with the existing _id
+        mongo.db.analytics.update_one(
+            {'_id': DASHBOARD_ID, 'refreshing_until': {'$not': {'$gt': now}}},
+            {'$set': {'refreshing_until': now + timedelta(seconds=lease_seconds)}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        return False
+    return True
+
+
+def _refresh_in_background(app):
+    with app.app_context():
+        try:
+            refresh_dashboard_stats(app.config['ANALYTICS_WINDOW_DAYS'])
+        except Exception as e:
+            logger.error(f"Background analytics refresh failed in process {os.getpid()}: {e}", exc_info=True)
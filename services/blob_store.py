@@ -0,0 +1,125 @@
+# services/blob_store.py
+import uuid
+import logging
+from datetime import datetime
+from pymongo import ReturnDocument
+from extensions import mongo
+from services.storage import get_storage
+
+logger = logging.getLogger(__name__)
+
+
+def blob_filename(sha256, extension):
+    """Stored name of a blob: its content hash plus the (already secured) extension, e.g. '3a7b...e1.pdf'."""
+    return f"{sha256}{extension}"
+
+
+def store_blob(stream, extension):
+    """
+    Stores the content of a HashingFileStream in the content-addressed storage backend.
+
+    Args:
+        stream: HashingFileStream whose content has been fully written.
+        extension (str): Secured extension including the dot, used when the blob is new.
+
+    Returns:
+        str: The blob's stored filename (documents keep this in 'filename').
+
+    Every blob has a record in the blobs collection keyed by SHA-256 with a
+    reference count. The record is upserted and its count incremented in one
+    atomic find_one_and_update; only the upload that creates the record (or that
+    revives one release_blob is deleting) publishes its temp file (a rename on
+    local storage, a copy into GridFS), so identical re-uploads add no file to storage.
+    """
+    sha256 = stream.sha256
+    previous = mongo.db.blobs.find_one_and_update(
+        {'_id': sha256},
+        {
+            '$inc': {'refcount': 1},
+            '$setOnInsert': {
+                'filename': blob_filename(sha256, extension),
+                'size': stream.size,
+                'created_at': datetime.utcnow(),
+            },
+        },
+        upsert=True,
+        return_document=ReturnDocument.BEFORE,
+    )
+
+    filename = previous['filename'] if previous else blob_filename(sha256, extension)
+    try:
+        # Exclusive create: never overwrites, so no race between workers. A new or
+        # tombstoned record always publishes; a live one only does if its file went
+        # missing (manual cleanup, restore...), and otherwise the exclusive create just fails.
+        # If a release has already moved the file to the trash, this puts a fresh copy
+        # back; if not, the release sees the new reference and restores its copy.
+        get_storage().save(stream, filename)
+        if previous is None or previous.get('deleting'):
+            logger.info(f"Stored new blob {filename} ({stream.size} bytes)")
+        else:
+            logger.warning(f"Blob {filename} was missing from storage, restored it from the new upload")
+    except FileExistsError:
+        # Same name means same content: keep the copy already stored
+        stream.discard()
+        logger.info(f"Upload matches existing blob {filename}, refcount now {(previous or {}).get('refcount', 0) + 1}")
+    return filename
+
+
+def release_blob(sha256):
+    """
+    Drops one reference to a blob, deleting the record and the file when none remain.
+    Call this whenever a document that points at the blob is removed.
+
+    An upload of the same content may re-reference the blob at any point, so the
+    file is never deleted under its live name. The record is first tombstoned,
+    the file moved to a private trash name, and only then is the record removed,
+    conditionally on still being unreferenced. If an upload revived it meanwhile,
+    the file is moved back (or dropped, if that upload already stored a fresh copy).
+    """
+    blob = mongo.db.blobs.find_one_and_update(
+        {'_id': sha256},
+        {'$inc': {'refcount': -1}},
+        return_document=ReturnDocument.AFTER,
+    )
+    if blob is None or blob.get('refcount', 0) > 0:
+        return False
+
+    # Only one release may take the blob apart
+    claimed = mongo.db.blobs.find_one_and_update(
+        {'_id': sha256, 'refcount': {'$lte': 0}, 'deleting': {'$ne': True}},
+        {'$set': {'deleting': True}},
+    )
+    if claimed is None:
+        return False
+
+    storage = get_storage()
+    filename = claimed['filename']
+    trash_name = f".trash-{uuid.uuid4().hex}-{filename}"
+    try:
+        storage.rename(filename, trash_name)
+    except FileNotFoundError:
+        trash_name = None # Already gone; only the record needs removing
+    except Exception as e:
+        logger.error(f"Could not move unreferenced blob {filename} to the trash: {e}")
+        mongo.db.blobs.update_one({'_id': sha256}, {'$unset': {'deleting': ''}})
+        return False
+
+    removed = mongo.db.blobs.delete_one({'_id': sha256, 'refcount': {'$lte': 0}, 'deleting': True}).deleted_count
+    if not removed:
+        # Re-referenced while we were deleting: the file must stay under its name
+        if trash_name:
+            try:
+                storage.rename(trash_name, filename)
+            except FileExistsError:
+                storage.delete(trash_name) # The new upload already stored the same content
+        mongo.db.blobs.update_one({'_id': sha256}, {'$unset': {'deleting': ''}})
+        logger.info(f"Blob {filename} was re-referenced during release, kept it")
+        return False
+
+    if trash_name:
+        try:
+            storage.delete(trash_name)
+            logger.info(f"Deleted unreferenced blob {filename}")
+        except Exception as e:
+            logger.error(f"Could not delete unreferenced blob {filename} ({trash_name}): {e}")
+    return True
@@ -0,0 +1,82 @@
+# services/document_search.py
+import re
+import logging
+from extensions import mongo
+from services.document_stats import DOCUMENT_STATUSES
+
+logger = logging.getLogger(__name__)
+
+# Letters/digits runs; '_' and punctuation separate words ("COSTING_-_ELECTRICAL.docx" -> costing, electrical, docx)
+TOKEN_RE = re.compile(r'[^\W_]+')
+MAX_TOKENS = 32 # Bounds the multikey index entries per document
+MAX_QUERY_TERMS = 5
+MAX_TERM_LENGTH = 64
+OWNER_MATCH_LIMIT = 100
+
+
+def search_tokens(text):
+    """
+    Normalized words of a filename, stored on documents as the indexed search_tokens array.
+    Lowercased (casefold) and de-duplicated, in order of appearance.
+    """
+    tokens = []
+    for token in TOKEN_RE.findall((text or '').casefold()):
+        token = token[:MAX_TERM_LENGTH]
+        if token not in tokens:
+            tokens.append(token)
+            if len(tokens) >= MAX_TOKENS:
+                break
+    return tokens
+
+
+def prefix_regex(term):
+    """Anchored, escaped regex; Mongo turns ^literal into an index range scan."""
+    return {'$regex': f"^{re.escape(term)}"}
+
+
+def name_clause(terms):
+    """Every term must be the prefix of some word of original_name."""
+    clauses = [{'search_tokens': prefix_regex(term)} for term in terms]
+    return clauses[0] if len(clauses) == 1 else {'$and': clauses}
+
+
+def matching_owner_ids(text, limit=OWNER_MATCH_LIMIT):
+    """Ids of users whose username or email starts with text (both stored lowercased and indexed)."""
+    prefix = text.strip().lower()
+    if not prefix:
+        return []
+    cursor = mongo.db.users.find(
+        {'$or': [{'username_lower': prefix_regex(prefix)}, {'email': prefix_regex(prefix)}]},
+        {'_id': 1}
+    ).limit(limit)
+    return [user['_id'] for user in cursor]
+
+
+def matching_statuses(text):
+    """Known statuses that start with text, compared case-insensitively (no database access)."""
+    prefix = text.strip().casefold()
+    return [status for status in DOCUMENT_STATUSES if prefix and status.casefold().startswith(prefix)]
+
+
+def build_search_query(text):
+    """
+    Mongo filter for a free-text admin search, or None when text has no searchable words.
+
+    A document matches when every word of text prefixes a word of its original_name,
+    or its owner's username/email starts with text, or its status starts with text.
+    Each branch is served by an index (search_tokens, username_lower/email) or
+    resolved in Python (status), so nothing scans the collection.
+    """
+    text = (text or '').strip()
+    terms = search_tokens(text)[:MAX_QUERY_TERMS]
+    if not terms:
+        return None
+
+    clauses = [name_clause(terms)]
+    owner_ids = matching_owner_ids(text)
+    if owner_ids:
+        clauses.append({'user_id': {'$in': owner_ids}})
+    statuses = matching_statuses(text)
+    if statuses:
+        clauses.append({'status': {'$in': statuses}})
+    return clauses[0] if len(clauses) == 1 else {'$or': clauses}
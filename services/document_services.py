@@ -0,0 +1,74 @@
+# services/document_services.py
+import logging
+from datetime import datetime
+from bson import ObjectId
+from extensions import mongo
+from services.document_search import search_tokens
+from services.document_stats import record_upload, safe_record, recording_change
+from services.previews import schedule_preview
+
+logger = logging.getLogger(__name__)
+
+OWNER_PROJECTION = {'username': 1, 'email': 1}
+
+
+def attach_owners(documents, projection=None):
+    """
+    Resolves the owner of every document with a single users query.
+
+    Args:
+        documents (list): Document dicts with a 'user_id' field. Modified in place.
+        projection (dict): User fields to fetch (defaults to username and email).
+
+    Returns:
+        list: The same documents, each with an 'owner' key holding the user dict
+              (or None when the user no longer exists).
+
+    Costs one round-trip however many documents are passed, instead of a
+    users.find_one per document.
+    """
+    owner_ids = {doc.get('user_id') for doc in documents if isinstance(doc.get('user_id'), ObjectId)}
+    owners = {}
+    if owner_ids:
+        cursor = mongo.db.users.find({'_id': {'$in': list(owner_ids)}}, projection or OWNER_PROJECTION)
+        owners = {user['_id']: user for user in cursor}
+
+    for doc in documents:
+        doc['owner'] = owners.get(doc.get('user_id'))
+    return documents
+
+
+def create_document(user_id, saved_file, original_name):
+    """
+    Inserts the documents entry for a stored upload and updates everything derived from it.
+
+    Args:
+        user_id (ObjectId): Owner of the document.
+        saved_file (SavedFile): Result of storing the content (see utils.file_utils).
+        original_name (str): Filename as the user uploaded it.
+
+    Returns:
+        dict: The inserted document (with its _id).
+
+    The status counters and the image preview are best-effort: a failure there is
+    logged and does not undo the upload.
+    """
+    uploaded_at = datetime.utcnow()
+    document = {
+        'user_id': user_id,
+        'filename': saved_file.filename,
+        'original_name': original_name,
+        'upload_date': uploaded_at,
+        'status': 'Pending Review',
+        'status_updated_at': uploaded_at,
+        'file_size': saved_file.size,
+        'sha256': saved_file.sha256, # Also the _id of the shared blob record
+        'mime_type': saved_file.mimetype,
+        'search_tokens': search_tokens(original_name), # Indexed words of original_name for admin search
+    }
+
+    with recording_change():
+        mongo.db.documents.insert_one(document)
+    safe_record(record_upload, user_id, document['status'])
+    schedule_preview(document) # Warm the admin preview cache for images; never blocks
+    return document
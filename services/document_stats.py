@@ -0,0 +1,168 @@
+# services/document_stats.py
+import logging
+from collections import defaultdict
+from contextlib import contextmanager
+from bson import ObjectId
+from pymongo import UpdateOne, ReplaceOne
+from extensions import mongo
+
+logger = logging.getLogger(__name__)
+
+# Statuses an admin can set from the UI (stored values are free text, so others may exist)
+DOCUMENT_STATUSES = ['Pending Review', 'Approved', 'Rejected', 'Needs More Info']
+
+# Counter documents in the document_stats collection:
+#   {'_id': 'global', 'counts': {<status>: n, ...}, 'total': n}
+#   {'_id': 'user:<user_id>', 'user_id': ObjectId, 'counts': {...}, 'total': n}
+#   {'_id': 'changes', 'version': n}
+# 'version' goes up around every write to the documents collection (see
+# recording_change) and is a cheap "has anything changed" marker. It is kept apart
+# from the counters because counter updates are best-effort (safe_record).
+GLOBAL_STATS_ID = 'global'
+CHANGES_ID = 'changes'
+
+
+def user_stats_id(user_id):
+    return f"user:{user_id}"
+
+
+def status_key(status):
+    """Status values come from admin input; keep them usable as a field name."""
+    return str(status).replace('.', '．').lstrip('$') or 'unknown'
+
+
+def record_upload(user_id, status):
+    """Count one new document. One bulk_write for the user and global counters."""
+    _apply({(user_id, status): 1}, total_deltas={user_id: 1})
+
+
+def record_status_changes(changes):
+    """
+    Move documents between status counters.
+
+    Args:
+        changes (list): (user_id, old_status, new_status) tuples, one per updated document.
+    """
+    deltas = defaultdict(int)
+    for user_id, old_status, new_status in changes:
+        if old_status == new_status:
+            continue
+        deltas[(user_id, old_status)] -= 1
+        deltas[(user_id, new_status)] += 1
+    if deltas:
+        _apply(deltas)
+
+
+def get_counts(user_id=None):
+    """
+    Returns ({status: count}, total) for one user, or for all documents when user_id is None.
+    A single _id lookup; missing counters read as zero.
+    """
+    stats_id = user_stats_id(user_id) if user_id is not None else GLOBAL_STATS_ID
+    stats = mongo.db.document_stats.find_one({'_id': stats_id}, {'counts': 1, 'total': 1}) or {}
+    counts = {status.replace('．', '.'): n for status, n in stats.get('counts', {}).items() if n}
+    return counts, stats.get('total', 0)
+
+
+def stats_version():
+    """Change marker of the document set (see module comment); 0 before the first write."""
+    stats = mongo.db.document_stats.find_one({'_id': CHANGES_ID}, {'version': 1}) or {}
+    return stats.get('version', 0)
+
+
+def record_change():
+    """Bump the change marker. Unlike the counters, failures are not swallowed."""
+    mongo.db.document_stats.update_one({'_id': CHANGES_ID}, {'$inc': {'version': 1}}, upsert=True)
+
+
+@contextmanager
+def recording_change():
+    """
+    Wrap every write to the documents collection in this.
+
+    The marker is bumped before the write, so if that fails the write is not
+    attempted and cached responses stay valid, and again after it, so a response
+    built while the write was in flight is not kept. If the second bump fails the
+    first has already invalidated earlier ETags, so it is logged, not raised.
+    """
+    record_change()
+    try:
+        yield
+    finally:
+        try:
+            record_change()
+        except Exception as e:
+            logger.error(f"Change marker update after a document write failed: {e}", exc_info=True)
+
+
+def safe_record(func, *args):
+    """
+    Counter updates run after the document write has succeeded; a failure here must
+    not fail the request. The drift is logged and fixed by `nemsa reconcile-counters`.
+    """
+    try:
+        func(*args)
+    except Exception as e:
+        logger.error(f"Document counter update failed ({func.__name__}), run reconcile-counters: {e}", exc_info=True)
+
+
+def _apply(deltas, total_deltas=None):
+    """One unordered bulk_write of $inc upserts: per-user counter docs plus the global one."""
+    user_incs = defaultdict(dict)
+    global_inc = {}
+    for (user_id, status), delta in deltas.items():
+        field = f"counts.{status_key(status)}"
+        user_incs[user_id][field] = user_incs[user_id].get(field, 0) + delta
+        global_inc[field] = global_inc.get(field, 0) + delta
+    for user_id, delta in (total_deltas or {}).items():
+        user_incs[user_id]['total'] = user_incs[user_id].get('total', 0) + delta
+        global_inc['total'] = global_inc.get('total', 0) + delta
+
+    ops = [UpdateOne({'_id': GLOBAL_STATS_ID}, {'$inc': global_inc}, upsert=True)]
+    for user_id, inc in user_incs.items():
+        ops.append(UpdateOne(
+            {'_id': user_stats_id(user_id)},
+            {'$inc': inc, '$setOnInsert': {'user_id': user_id}},
+            upsert=True
+        ))
+    mongo.db.document_stats.bulk_write(ops, ordered=False)
+
+
+def reconcile_counters():
+    """
+    Rebuild every counter from the documents collection with one aggregation.
+    Returns (users_counted, stale_removed).
+    """
+    per_user = defaultdict(lambda: {'counts': defaultdict(int), 'total': 0})
+    global_counts = defaultdict(int)
+    total = 0
+    for row in mongo.db.documents.aggregate([
+        {'$group': {'_id': {'user_id': '$user_id', 'status': '$status'}, 'n': {'$sum': 1}}},
+    ]):
+        user_id, status, n = row['_id'].get('user_id'), row['_id'].get('status'), row['n']
+        key = status_key(status)
+        global_counts[key] += n
+        total += n
+        if isinstance(user_id, ObjectId):
+            per_user[user_id]['counts'][key] += n
+            per_user[user_id]['total'] += n
+
+    ops = [UpdateOne(
+        {'_id': GLOBAL_STATS_ID},
+        {'$set': {'counts': dict(global_counts), 'total': total}},
+        upsert=True
+    )]
+    for user_id, stats in per_user.items():
+        ops.append(ReplaceOne(
+            {'_id': user_stats_id(user_id)},
+            {'user_id': user_id, 'counts': dict(stats['counts']), 'total': stats['total']},
+            upsert=True
+        ))
+    mongo.db.document_stats.bulk_write(ops, ordered=False)
+
+    # Users whose documents are all gone (the changes marker must survive: its version only ever goes up)
+    stale = mongo.db.document_stats.delete_many({
+        '_id': {'$nin': [GLOBAL_STATS_ID, CHANGES_ID]},
+        'user_id': {'$nin': list(per_user)},
+    })
+    return len(per_user), stale.deleted_count
@@ -2,6 +2,8 @@
 from flask_mail import Message
 from flask import render_template, current_app
 from extensions import mail # Import the mail instance initialized in extensions.py
+from services.mail_dispatcher import mail_dispatcher
+from services import outbox
 import logging
 
 logger = logging.getLogger(__name__)
@@ -17,21 +19,33 @@ def send_email(subject, recipients, template, **kwargs):
                         Expects template files like template.txt and template.html
                         in the "emails" subdirectory of your templates folder.
         **kwargs: Context variables to pass to the template.
+
+    The templates are always rendered here, inside the caller's request context.
+    With MAIL_DELIVERY_MODE = 'background' the rendered message is handed to the
+    mail dispatcher and this returns as soon as it is queued; with 'outbox' it is
+    written to the outbox collection for the mail worker process (mail_worker.py)
+    to deliver with retries; with 'sync' it is sent over SMTP before returning.
     """
     try:
         if not recipients:
             logger.warning(f"Attempted to send email '{subject}' with no recipients.")
             return False
 
-        # Render email body from templates
-        text_body = render_template(f'emails/{template}.txt', **kwargs)
-        html_body = render_template(f'emails/{template}.html', **kwargs)
+        msg = build_message(subject, recipients, template, **kwargs)
 
-        msg = Message(subject,
-                      sender=current_app.config['MAIL_DEFAULT_SENDER'],
-                      recipients=recipients)
-        msg.body = text_body
-        msg.html = html_body
+        delivery_mode = current_app.config.get('MAIL_DELIVERY_MODE')
+        if delivery_mode == 'outbox':
+            try:
+                outbox_id = outbox.enqueue_message(msg)
+                logger.info(f"Email '{subject}' stored in outbox ({outbox_id}) for {recipients}")
+                return True
+            except Exception as e:
+                logger.error(f"Could not store '{subject}' in outbox, sending inline: {e}", exc_info=True)
+        elif delivery_mode == 'background':
+            if mail_dispatcher.enqueue(msg):
+                logger.info(f"Email '{subject}' queued for {recipients}")
+                return True
+            logger.warning(f"Mail dispatcher queue full, sending '{subject}' inline")
 
         mail.send(msg)
         logger.info(f"Email '{subject}' sent successfully to {recipients}")
@@ -42,6 +56,77 @@ def send_email(subject, recipients, template, **kwargs):
         # Depending on requirements, you might re-raise or return False
         return False
 
+
+def build_message(subject, recipients, template, **kwargs):
+    """Render the text and HTML templates for an email into a flask_mail.Message."""
+    # Render email body from templates
+    text_body = render_template(f'emails/{template}.txt', **kwargs)
+    html_body = render_template(f'emails/{template}.html', **kwargs)
+
+    msg = Message(subject,
+                  sender=current_app.config['MAIL_DEFAULT_SENDER'],
+                  recipients=recipients)
+    msg.body = text_body
+    msg.html = html_body
+    return msg
+
+
+def send_bulk_emails(messages):
+    """
+    Delivers many already-built messages in one go.
+
+    Args:
+        messages (list): flask_mail.Message objects (see build_message).
+
+    Returns:
+        list: One bool per message, True if it was sent or accepted for delivery.
+
+    In 'outbox' mode all messages are stored with a single insert; in 'background'
+    mode they are queued for the dispatcher; otherwise they are sent over one
+    SMTP session instead of one connection per message.
+    """
+    if not messages:
+        return []
+
+    delivery_mode = current_app.config.get('MAIL_DELIVERY_MODE')
+    if delivery_mode == 'outbox':
+        try:
+            outbox.enqueue_messages(messages)
+            logger.info(f"Stored {len(messages)} emails in outbox")
+            return [True] * len(messages)
+        except Exception as e:
+            logger.error(f"Could not store {len(messages)} emails in outbox, sending inline: {e}", exc_info=True)
+    elif delivery_mode == 'background':
+        results = [mail_dispatcher.enqueue(msg) for msg in messages]
+        if all(results):
+            logger.info(f"Queued {len(messages)} emails for background delivery")
+            return results
+        # Whatever did not fit in the queue is sent inline below
+        pending = [i for i, queued in enumerate(results) if not queued]
+        logger.warning(f"Mail dispatcher queue full, sending {len(pending)} of {len(messages)} emails inline")
+        return _send_over_one_connection(messages, results, pending)
+
+    return _send_over_one_connection(messages, [False] * len(messages), range(len(messages)))
+
+
+def _send_over_one_connection(messages, results, indexes):
+    """Send messages[i] for each i in indexes over a single SMTP connection, filling in results."""
+    try:
+        with mail.connect() as connection:
+            for i in indexes:
+                msg = messages[i]
+                try:
+                    connection.send(msg)
+                    results[i] = True
+                except Exception as e:
+                    logger.error(f"Failed to send email '{msg.subject}' to {msg.recipients}: {e}", exc_info=True)
+    except Exception as e:
+        # Connecting (or closing) failed; anything not yet sent stays False
+        logger.error(f"SMTP session for bulk send failed: {e}", exc_info=True)
+
+    logger.info(f"Bulk send finished: {sum(1 for i in indexes if results[i])}/{len(indexes)} delivered")
+    return results
+
 # You will need corresponding email template files in templates/emails/
 # e.g., templates/emails/status_update.txt and templates/emails/status_update.html
 # and templates/emails/welcome.txt, templates/emails/welcome.html
@@ -0,0 +1,218 @@
+# services/exports.py
+import csv
+import io
+import json
+import os
+import posixpath
+import time
+import zipfile
+import logging
+from datetime import datetime
+from extensions import mongo
+from services.storage import get_storage
+from services.document_services import attach_owners
+
+logger = logging.getLogger(__name__)
+
+EXPORT_CHUNK_SIZE = 256 * 1024
+OWNER_BATCH_SIZE = 200 # Documents per users $in lookup while streaming
+
+# Formats that are already compressed: deflating them again costs CPU and saves nothing
+# (DOCX is itself a ZIP; PDFs compress their streams internally)
+STORED_EXTENSIONS = {'.pdf', '.docx', '.jpg', '.jpeg', '.png', '.gif', '.webp', '.zip'}
+STORED_MIME_PREFIXES = ('image/', 'application/pdf', 'application/zip',
+                        'application/vnd.openxmlformats-officedocument')
+
+ZIP_DOCUMENT_PROJECTION = {'filename': 1, 'original_name': 1, 'user_id': 1, 'upload_date': 1, 'file_size': 1, 'mime_type': 1}
+
+# Columns of the CSV/NDJSON metadata export, in order
+METADATA_COLUMNS = [
+    'id', 'original_name', 'status', 'upload_date', 'status_updated_at', 'file_size',
+    'mime_type', 'sha256', 'owner_id', 'owner_username', 'owner_email',
+]
+METADATA_PROJECTION = {
+    'original_name': 1, 'status': 1, 'upload_date': 1, 'status_updated_at': 1,
+    'file_size': 1, 'mime_type': 1, 'sha256': 1, 'user_id': 1,
+}
+EXPORT_FLUSH_BYTES = 64 * 1024 # Rows are grouped into chunks of about this size
+
+
+def iter_documents_with_owners(query, projection, batch_size=OWNER_BATCH_SIZE, limit=0, sort=None):
+    """
+    Yields documents from a server-side cursor with 'owner' attached, one users
+    query per batch_size documents. Memory stays flat however many rows match.
+    """
+    cursor = mongo.db.documents.find(query, projection, batch_size=batch_size, limit=limit)
+    if sort:
+        cursor = cursor.sort(sort)
+
+    batch = []
+    for document in cursor:
+        batch.append(document)
+        if len(batch) >= batch_size:
+            yield from attach_owners(batch)
+            batch = []
+    if batch:
+        yield from attach_owners(batch)
+
+
+def compression_for(document):
+    extension = os.path.splitext(document.get('filename', ''))[1].lower()
+    mime_type = document.get('mime_type') or ''
+    if extension in STORED_EXTENSIONS or mime_type.startswith(STORED_MIME_PREFIXES):
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+def entry_name(document, used_names):
+    """'<owner>/<original name>', made safe for archive paths and unique within the archive."""
+    owner = document.get('owner')
+    folder = _clean_component(owner.get('username') if owner else f"user-{document.get('user_id')}")
+    name = _clean_component(document.get('original_name') or document.get('filename') or str(document['_id']))
+    candidate = posixpath.join(folder, name)
+
+    stem, extension = os.path.splitext(name)
+    counter = 2
+    while candidate.lower() in used_names:
+        candidate = posixpath.join(folder, f"{stem} ({counter}){extension}")
+        counter += 1
+    used_names.add(candidate.lower())
+    return candidate
+
+
+def _clean_component(value):
+    # No path separators, no '..', no control characters; archive tools would honour them
+    cleaned = ''.join(c for c in str(value) if c.isprintable()).replace('/', '_').replace('\\', '_').strip(' .')
+    return cleaned or 'unnamed'
+
+
+class _StreamSink:
+    """Write-only file object for ZipFile; collected bytes are handed out by drain()."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        """Yields everything written since the last drain as one chunk (nothing if empty)."""
+        if self._chunks:
+            data = b''.join(self._chunks)
+            self._chunks = []
+            yield data
+
+
+def stream_zip(documents):
+    """
+    Generator of ZIP archive bytes for the given documents (with 'owner' attached).
+
+    Entries are written as they are read from the storage backend, in
+    EXPORT_CHUNK_SIZE pieces, so memory use does not depend on the number or size
+    of the files. ZipFile sees an unseekable stream and writes sizes and CRCs in
+    data descriptors after each entry. Files missing from storage are listed in a
+    MISSING_FILES.txt entry at the end instead of failing the whole download.
+    """
+    sink = _StreamSink()
+    used_names = set()
+    missing = []
+    storage = get_storage()
+
+    with zipfile.ZipFile(sink, mode='w', allowZip64=True) as archive:
+        for document in documents:
+            name = entry_name(document, used_names)
+            try:
+                source = storage.open(document['filename'])
+            except OSError as e:
+                logger.warning(f"Export skipped {document['filename']} (document {document['_id']}): {e}")
+                missing.append(f"{name}\t{document['_id']}")
+                continue
+
+            with source:
+                upload_date = document.get('upload_date')
+                info = zipfile.ZipInfo(name, date_time=(upload_date.timetuple()[:6] if upload_date else time.localtime()[:6]))
+                info.compress_type = compression_for(document)
+                info.external_attr = 0o644 << 16
+                info.file_size = document.get('file_size') or storage.size(document['filename']) # Lets ZipFile pick ZIP64 up front
+                with archive.open(info, mode='w') as entry:
+                    for chunk in iter(lambda: source.read(EXPORT_CHUNK_SIZE), b''):
+                        entry.write(chunk)
+                        yield from sink.drain()
+            yield from sink.drain()
+
+        if missing:
+            archive.writestr('MISSING_FILES.txt', 'These documents had no file on the server:\n' + '\n'.join(missing) + '\n')
+    yield from sink.drain()
+
+
+def upload_date_filter(since=None, until=None):
+    """Mongo filter for since <= upload_date < until (YYYY-MM-DD strings, either optional). Raises ValueError."""
+    date_range = {}
+    if since:
+        date_range['$gte'] = datetime.strptime(since, '%Y-%m-%d')
+    if until:
+        date_range['$lt'] = datetime.strptime(until, '%Y-%m-%d')
+    return {'upload_date': date_range} if date_range else {}
+
+
+def metadata_row(document):
+    """Flat dict of METADATA_COLUMNS for one document with 'owner' attached."""
+    owner = document.get('owner') or {}
+    return {
+        'id': str(document['_id']),
+        'original_name': document.get('original_name'),
+        'status': document.get('status'),
+        'upload_date': _iso(document.get('upload_date')),
+        'status_updated_at': _iso(document.get('status_updated_at')),
+        'file_size': document.get('file_size'),
+        'mime_type': document.get('mime_type'),
+        'sha256': document.get('sha256'),
+        'owner_id': str(document['user_id']) if document.get('user_id') else None,
+        'owner_username': owner.get('username'),
+        'owner_email': owner.get('email'),
+    }
+
+
+def stream_csv(documents):
+    """Generator of UTF-8 CSV text chunks: a header row, then one row per document."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(METADATA_COLUMNS)
+    for document in documents:
+        row = metadata_row(document)
+        writer.writerow(_csv_safe(row[column]) for column in METADATA_COLUMNS)
+        if buffer.tell() >= EXPORT_FLUSH_BYTES:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def stream_ndjson(documents):
+    """Generator of newline-delimited JSON chunks, one object per document."""
+    lines = []
+    size = 0
+    for document in documents:
+        line = json.dumps(metadata_row(document), ensure_ascii=False) + '\n'
+        lines.append(line)
+        size += len(line)
+        if size >= EXPORT_FLUSH_BYTES:
+            yield ''.join(lines)
+            lines, size = [], 0
+    if lines:
+        yield ''.join(lines)
+
+
+def _iso(value):
+    return value.isoformat() + 'Z' if isinstance(value, datetime) else None # Stored as naive UTC
+
+
+def _csv_safe(value):
+    # User-supplied names starting with these would run as formulas when the CSV is opened in a spreadsheet
+    if isinstance(value, str) and value[:1] in ('=', '+', '-', '@', '\t', '\r'):
+        return "'" + value
+    return '' if value is None else value
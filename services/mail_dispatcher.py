@@ -0,0 +1,241 @@
+# services/mail_dispatcher.py
+import atexit
+import os
+import queue
+import smtplib
+import socket
+import threading
+import time
+import logging
+from extensions import mail # Shared Flask-Mail instance
+
+logger = logging.getLogger(__name__)
+
+# Errors that mean the SMTP session itself is unusable (server hung up, network drop).
+# On these we reconnect once and retry the message before counting it as failed.
+# Not OSError as a whole: every smtplib.SMTPException is one, and a refused recipient
+# or rejected DATA must not be resent (recipients that were accepted would get it twice).
+# SMTPConnectError is an SMTPResponseException, so check this tuple first.
+CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, ConnectionError, socket.timeout)
+
+
+def is_permanent_failure(error):
+    """True for SMTP rejections that retrying cannot fix (5xx replies, all recipients refused)."""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return True
+    return isinstance(error, smtplib.SMTPResponseException) and error.smtp_code >= 500
+
+
+class MailDispatcher:
+    """
+    Background mail dispatcher.
+
+    Rendered flask_mail.Message objects are put on an in-process queue and returned
+    from immediately; a small pool of worker threads drains the queue in batches,
+    each worker keeping its own SMTP connection open between batches until it has
+    been idle for MAIL_DISPATCH_IDLE_TIMEOUT seconds.
+
+    Workers are started lazily on the first enqueue in each process, so the
+    dispatcher is safe to initialise before gunicorn forks its workers.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._queue = None
+        self._threads = []
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._reset_stats()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('MAIL_DISPATCH_WORKERS', 2)
+        app.config.setdefault('MAIL_DISPATCH_BATCH_SIZE', 20)
+        app.config.setdefault('MAIL_DISPATCH_QUEUE_SIZE', 1000)
+        app.config.setdefault('MAIL_DISPATCH_IDLE_TIMEOUT', 30)
+        self.app = app
+        app.extensions['mail_dispatcher'] = self
+        atexit.register(self.shutdown)
+
+    # --- Public API ---
+
+    def enqueue(self, msg):
+        """
+        Queue a rendered message for background delivery.
+        Returns False if the queue is full so the caller can fall back to sending inline.
+        """
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((msg, time.monotonic()))
+        except queue.Full:
+            with self._stats_lock:
+                self._stats['rejected'] += 1
+            return False
+
+        with self._stats_lock:
+            self._stats['enqueued'] += 1
+        return True
+
+    def stats(self):
+        """Snapshot of queue depth, delivery counters and latency (milliseconds)."""
+        with self._stats_lock:
+            snapshot = dict(self._stats)
+
+        sent = snapshot['sent']
+        snapshot['queue_depth'] = self._queue.qsize() if self._queue is not None else 0
+        snapshot['workers_alive'] = sum(1 for t in self._threads if t.is_alive()) if self._pid == os.getpid() else 0
+        snapshot['avg_send_ms'] = round(snapshot.pop('send_ms_total') / sent, 2) if sent else 0.0
+        snapshot['avg_queue_wait_ms'] = round(snapshot.pop('queue_wait_ms_total') / sent, 2) if sent else 0.0
+        snapshot['max_send_ms'] = round(snapshot['max_send_ms'], 2)
+        return snapshot
+
+    def shutdown(self, timeout=10):
+        """Ask workers to finish what is queued and stop. Called automatically at exit."""
+        if self._queue is None or self._pid != os.getpid():
+            return
+        for _ in self._threads:
+            try:
+                self._queue.put((None, None), timeout=timeout)
+            except queue.Full:
+                break
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0, deadline - time.monotonic()))
+        self._threads = []
+        self._queue = None
+
+    # --- Internals ---
+
+    def _reset_stats(self):
+        self._stats = {
+            'enqueued': 0,
+            'sent': 0,
+            'failed': 0,
+            'rejected': 0,
+            'reconnects': 0,
+            'batches': 0,
+            'send_ms_total': 0.0,
+            'queue_wait_ms_total': 0.0,
+            'max_send_ms': 0.0,
+        }
+
+    def _ensure_started(self):
+        # Compare PIDs so a forked worker never reuses threads/sockets from its parent
+        if self._pid == os.getpid() and self._queue is not None:
+            return
+        with self._start_lock:
+            if self._pid == os.getpid() and self._queue is not None:
+                return
+            if self.app is None:
+                raise RuntimeError("MailDispatcher used before init_app()")
+
+            config = self.app.config
+            self._queue = queue.Queue(maxsize=config['MAIL_DISPATCH_QUEUE_SIZE'])
+            self._threads = []
+            self._pid = os.getpid()
+            with self._stats_lock:
+                self._reset_stats()
+
+            for i in range(max(1, int(config['MAIL_DISPATCH_WORKERS']))):
+                thread = threading.Thread(target=self._worker_loop, name=f"mail-dispatch-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            logger.info(f"Mail dispatcher started {len(self._threads)} worker(s) in process {self._pid}")
+
+    def _worker_loop(self):
+        config = self.app.config
+        batch_size = max(1, int(config['MAIL_DISPATCH_BATCH_SIZE']))
+        idle_timeout = float(config['MAIL_DISPATCH_IDLE_TIMEOUT'])
+        work_queue = self._queue
+        connection = None
+
+        # Flask-Mail needs an app context to resolve its state and emit signals
+        with self.app.app_context():
+            try:
+                while True:
+                    try:
+                        first = work_queue.get(timeout=idle_timeout if connection else None)
+                    except queue.Empty:
+                        # Idle long enough: close the SMTP session rather than let the server drop it
+                        connection = self._close(connection)
+                        continue
+
+                    # Stop collecting at a shutdown sentinel so each worker consumes exactly one
+                    batch = [first]
+                    while len(batch) < batch_size and batch[-1][0] is not None:
+                        try:
+                            batch.append(work_queue.get_nowait())
+                        except queue.Empty:
+                            break
+
+                    stop = False
+                    for msg, queued_at in batch:
+                        if msg is None:
+                            stop = True
+                        else:
+                            connection = self._deliver(connection, msg, queued_at)
+                        work_queue.task_done()
+
+                    with self._stats_lock:
+                        self._stats['batches'] += 1
+                    if stop:
+                        break
+            finally:
+                self._close(connection)
+
+    def _deliver(self, connection, msg, queued_at):
+        """Send one message over the worker's connection, reconnecting once on a dropped session."""
+        for attempt in (1, 2):
+            try:
+                if connection is None:
+                    connection = mail.connect()
+                    connection.__enter__()
+                started = time.monotonic()
+                connection.send(msg)
+                self._record_sent(started, queued_at)
+                return connection
+            except CONNECTION_ERRORS as e:
+                connection = self._close(connection)
+                if attempt == 1:
+                    with self._stats_lock:
+                        self._stats['reconnects'] += 1
+                    logger.warning(f"SMTP connection lost while sending '{msg.subject}', reconnecting: {e}")
+                    continue
+                self._record_failed(msg, e)
+            except smtplib.SMTPException as e:
+                # The server answered, so the session is still usable; the message is not retried
+                self._record_failed(msg, e)
+                break
+            except Exception as e:
+                self._record_failed(msg, e)
+                break
+        return connection
+
+    def _record_sent(self, started, queued_at):
+        now = time.monotonic()
+        send_ms = (now - started) * 1000
+        with self._stats_lock:
+            self._stats['sent'] += 1
+            self._stats['send_ms_total'] += send_ms
+            self._stats['queue_wait_ms_total'] += (started - queued_at) * 1000
+            self._stats['max_send_ms'] = max(self._stats['max_send_ms'], send_ms)
+
+    def _record_failed(self, msg, error):
+        with self._stats_lock:
+            self._stats['failed'] += 1
+        logger.error(f"Background delivery of '{msg.subject}' to {msg.recipients} failed: {error}", exc_info=True)
+
+    @staticmethod
+    def _close(connection):
+        if connection is not None:
+            try:
+                connection.__exit__(None, None, None)
+            except Exception as e:
+                logger.debug(f"Ignoring error while closing SMTP connection: {e}")
+        return None
+
+
+# Single dispatcher shared by the app; bound to the app in create_app()
+mail_dispatcher = MailDispatcher()
@@ -0,0 +1,230 @@
+# services/outbox.py
+import os
+import signal
+import socket
+import time
+import logging
+from datetime import datetime, timedelta
+from flask_mail import Message
+from pymongo import ReturnDocument
+from extensions import mongo, mail
+from services.mail_dispatcher import CONNECTION_ERRORS, is_permanent_failure
+
+logger = logging.getLogger(__name__)
+
+# Outbox message lifecycle: pending -> sending -> sent, or back to pending with a
+# later next_attempt_at on failure, and finally failed after MAIL_OUTBOX_MAX_ATTEMPTS.
+STATUS_PENDING = 'pending'
+STATUS_SENDING = 'sending'
+STATUS_SENT = 'sent'
+STATUS_FAILED = 'failed'
+
+
+def enqueue_message(msg):
+    """
+    Persist a rendered flask_mail.Message to the outbox collection.
+    Returns the inserted outbox id; delivery happens in the mail worker process.
+    """
+    result = mongo.db.outbox.insert_one(_outbox_document(msg, datetime.utcnow()))
+    return result.inserted_id
+
+
+def enqueue_messages(messages):
+    """Persist several messages with a single insert_many. Returns the inserted ids."""
+    now = datetime.utcnow()
+    result = mongo.db.outbox.insert_many([_outbox_document(msg, now) for msg in messages])
+    return result.inserted_ids
+
+
+def _outbox_document(msg, now):
+    return {
+        'subject': msg.subject,
+        'sender': msg.sender,
+        'recipients': list(msg.recipients),
+        'reply_to': msg.reply_to,
+        'body': msg.body,
+        'html': msg.html,
+        'status': STATUS_PENDING,
+        'attempts': 0,
+        'created_at': now,
+        'next_attempt_at': now,
+    }
+
+
+def message_from_document(doc):
+    """Rebuild a flask_mail.Message from an outbox document."""
+    msg = Message(doc['subject'],
+                  sender=doc.get('sender'),
+                  recipients=doc.get('recipients', []),
+                  reply_to=doc.get('reply_to'))
+    msg.body = doc.get('body')
+    msg.html = doc.get('html')
+    return msg
+
+
+def backoff_seconds(attempts, base, maximum):
+    """Exponential backoff: base, 2*base, 4*base, ... capped at maximum."""
+    return min(maximum, base * (2 ** max(0, attempts - 1)))
+
+
+class OutboxWorker:
+    """
+    Drains the outbox collection over a single reused SMTP connection.
+
+    Messages are claimed one at a time with an atomic find_one_and_update, which
+    also pushes next_attempt_at forward by MAIL_OUTBOX_LEASE seconds. Any number of
+    worker processes can therefore run side by side, and a message claimed by a
+    worker that died mid-send becomes claimable again once its lease runs out.
+    """
+
+    def __init__(self, app, worker_id=None):
+        self.app = app
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.running = False
+        self.connection = None
+        self.last_used = 0.0
+
+        config = app.config
+        self.max_attempts = int(config.get('MAIL_OUTBOX_MAX_ATTEMPTS', 6))
+        self.backoff_base = int(config.get('MAIL_OUTBOX_BACKOFF_BASE', 30))
+        self.backoff_max = int(config.get('MAIL_OUTBOX_BACKOFF_MAX', 3600))
+        self.lease = int(config.get('MAIL_OUTBOX_LEASE', 300))
+        self.poll_interval = float(config.get('MAIL_OUTBOX_POLL_INTERVAL', 2))
+        self.idle_timeout = float(config.get('MAIL_DISPATCH_IDLE_TIMEOUT', 30))
+
+    def run(self, once=False):
+        """
+        Process messages until stopped (SIGTERM/SIGINT).
+        With once=True, exit as soon as nothing is due instead of polling.
+        """
+        self.running = True
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+        logger.info(f"Outbox worker {self.worker_id} started")
+
+        with self.app.app_context():
+            try:
+                while self.running:
+                    doc = self.claim_next()
+                    if doc is None:
+                        self.dead_letter_abandoned()
+                        if once:
+                            break
+                        self._close_if_idle()
+                        time.sleep(self.poll_interval)
+                        continue
+                    self.process(doc)
+            finally:
+                self._close()
+        logger.info(f"Outbox worker {self.worker_id} stopped")
+
+    def claim_next(self):
+        """Atomically claim the oldest due message, or return None if nothing is due."""
+        now = datetime.utcnow()
+        return mongo.db.outbox.find_one_and_update(
+            {
+                # 'sending' messages are only due again once their lease expires
+                'status': {'$in': [STATUS_PENDING, STATUS_SENDING]},
+                'next_attempt_at': {'$lte': now},
+                # attempts counts claims, so a message that kills its worker still runs out of tries
+                'attempts': {'$lt': self.max_attempts},
+            },
+            {
+                '$set': {
+                    'status': STATUS_SENDING,
+                    'locked_by': self.worker_id,
+                    'next_attempt_at': now + timedelta(seconds=self.lease),
+                },
+                '$inc': {'attempts': 1},
+            },
+            sort=[('next_attempt_at', 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def dead_letter_abandoned(self):
+        """
+        Fail messages whose last allowed claim expired without an outcome being
+        recorded (the worker died mid-send, possibly because of the message itself).
+        claim_next no longer picks these up. Returns the number of messages failed.
+        """
+        result = mongo.db.outbox.update_many(
+            {
+                'status': STATUS_SENDING,
+                'next_attempt_at': {'$lte': datetime.utcnow()},
+                'attempts': {'$gte': self.max_attempts},
+            },
+            {
+                '$set': {'status': STATUS_FAILED, 'last_error': 'Lease expired without a result on the last attempt'},
+                '$unset': {'locked_by': ''},
+            }
+        )
+        if result.modified_count:
+            logger.error(f"Outbox: {result.modified_count} message(s) failed permanently after {self.max_attempts} abandoned attempts")
+        return result.modified_count
+
+    def process(self, doc):
+        """Send one claimed message and record the outcome."""
+        try:
+            self._send(message_from_document(doc))
+        except Exception as e:
+            self._record_failure(doc, e)
+            return
+
+        mongo.db.outbox.update_one(
+            {'_id': doc['_id'], 'locked_by': self.worker_id},
+            {'$set': {'status': STATUS_SENT, 'sent_at': datetime.utcnow()},
+             '$unset': {'locked_by': '', 'last_error': ''}}
+        )
+        logger.info(f"Outbox message {doc['_id']} '{doc.get('subject')}' sent to {doc.get('recipients')}")
+
+    def _send(self, msg):
+        # Reconnect once if the reused session was dropped by the server
+        for attempt in (1, 2):
+            if self.connection is None:
+                self.connection = mail.connect()
+                self.connection.__enter__()
+            try:
+                self.connection.send(msg)
+                self.last_used = time.monotonic()
+                return
+            except CONNECTION_ERRORS:
+                self._close()
+                if attempt == 2:
+                    raise
+
+    def _record_failure(self, doc, error):
+        attempts = doc.get('attempts', 1)
+        update = {'last_error': str(error)[:500]}
+
+        if is_permanent_failure(error):
+            update['status'] = STATUS_FAILED
+            logger.error(f"Outbox message {doc['_id']} rejected by the SMTP server, not retrying: {error}")
+        elif attempts >= self.max_attempts:
+            update['status'] = STATUS_FAILED
+            logger.error(f"Outbox message {doc['_id']} failed permanently after {attempts} attempts: {error}")
+        else:
+            delay = backoff_seconds(attempts, self.backoff_base, self.backoff_max)
+            update['status'] = STATUS_PENDING
+            update['next_attempt_at'] = datetime.utcnow() + timedelta(seconds=delay)
+            logger.warning(f"Outbox message {doc['_id']} attempt {attempts} failed, retrying in {delay}s: {error}")
+
+        mongo.db.outbox.update_one(
+            {'_id': doc['_id'], 'locked_by': self.worker_id},
+            {'$set': update, '$unset': {'locked_by': ''}}
+        )
+
+    def _close_if_idle(self):
+        if self.connection is not None and time.monotonic() - self.last_used > self.idle_timeout:
+            self._close()
+
+    def _close(self):
+        if self.connection is not None:
+            try:
+                self.connection.__exit__(None, None, None)
+            except Exception as e:
+                logger.debug(f"Ignoring error while closing SMTP connection: {e}")
+            self.connection = None
+
+    def _handle_stop(self, signum, frame):
+        logger.info(f"Outbox worker {self.worker_id} received signal {signum}, finishing current message")
+        self.running = False
@@ -0,0 +1,225 @@
+# services/previews.py
+import atexit
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import logging
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from importlib.util import find_spec
+from flask import current_app
+from services.storage import get_storage, COPY_CHUNK_SIZE
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.gif'}
+PREVIEW_EXTENSIONS = {'WEBP': '.webp', 'JPEG': '.jpg'}
+PREVIEW_MIMETYPES = {'WEBP': 'image/webp', 'JPEG': 'image/jpeg'}
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+_in_flight = {} # cache path -> Future, so concurrent requests share one render
+_in_flight_lock = threading.Lock()
+
+
+def render_preview(source_path, dest_path, max_size, image_format, quality):
+    """
+    Runs in a pool process: writes a max_size x max_size thumbnail of source_path.
+    Written to a temp name and renamed, so readers never see a half-written file.
+    """
+    from PIL import Image # Imported in the worker only; the web process never loads Pillow
+
+    with Image.open(source_path) as image:
+        # Lets the JPEG decoder downscale while decoding, much cheaper than a full decode
+        image.draft('RGB', (max_size, max_size))
+        image.thumbnail((max_size, max_size))
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+        if image_format == 'JPEG' and image.mode == 'RGBA':
+            image = image.convert('RGB')
+
+        tmp_path = f"{dest_path}.{os.getpid()}.tmp"
+        image.save(tmp_path, image_format, quality=quality)
+    os.replace(tmp_path, dest_path)
+    return os.path.getsize(dest_path)
+
+
+def previews_available():
+    """Pillow is optional; without it documents simply have no preview."""
+    return find_spec('PIL') is not None
+
+
+def is_previewable(document):
+    mime_type = document.get('mime_type')
+    if mime_type:
+        return mime_type.startswith('image/')
+    return os.path.splitext(document.get('filename', ''))[1].lower() in IMAGE_EXTENSIONS
+
+
+def preview_path(document):
+    """Cache location of a document's preview. Keyed by content hash, so shared blobs share previews."""
+    config = current_app.config
+    key = document.get('sha256') or os.path.splitext(document['filename'])[0]
+    image_format = config['PREVIEW_FORMAT']
+    name = f"{key}_{config['PREVIEW_MAX_SIZE']}{PREVIEW_EXTENSIONS[image_format]}"
+    return os.path.join(config['PREVIEW_CACHE_FOLDER'], name)
+
+
+def preview_mimetype():
+    return PREVIEW_MIMETYPES[current_app.config['PREVIEW_FORMAT']]
+
+
+def get_preview(document, wait=True):
+    """
+    Returns the path of the document's cached preview, rendering it in the
+    process pool on first request. Returns None if the document is not an
+    image, Pillow is unavailable, or rendering failed or timed out.
+    With wait=False the render is only scheduled (used right after upload).
+    """
+    if not is_previewable(document) or not previews_available():
+        return None
+
+    config = current_app.config
+    dest_path = preview_path(document)
+    try:
+        # Cache hit: bump the mtime so LRU eviction keeps recently viewed previews
+        os.utime(dest_path)
+        return dest_path
+    except FileNotFoundError:
+        pass
+
+    storage = get_storage()
+    source_path = storage.local_path(document['filename'])
+    temporary_source = False
+    if source_path is None:
+        # Remote backends: the render process needs a real file, so fetch a copy next to the cache.
+        # The .tmp suffix keeps it out of cache eviction; it is deleted once the render finishes.
+        with _in_flight_lock:
+            future = _in_flight.get(dest_path)
+        if future is None:
+            if not storage.exists(document['filename']):
+                return None
+            os.makedirs(config['PREVIEW_CACHE_FOLDER'], exist_ok=True)
+            fd, source_path = tempfile.mkstemp(dir=config['PREVIEW_CACHE_FOLDER'], suffix='.source.tmp')
+            try:
+                with storage.open(document['filename']) as source, os.fdopen(fd, 'wb') as target:
+                    shutil.copyfileobj(source, target, COPY_CHUNK_SIZE)
+            except Exception:
+                _remove_quietly(source_path)
+                raise
+            temporary_source = True
+
+    if source_path is not None:
+        future = _submit(source_path, dest_path, config, temporary_source)
+    if not wait:
+        return None
+    try:
+        future.result(timeout=config['PREVIEW_TIMEOUT'])
+        return dest_path
+    except FutureTimeoutError:
+        logger.warning(f"Preview for {document['filename']} not ready within {config['PREVIEW_TIMEOUT']}s")
+    except Exception as e:
+        logger.error(f"Preview rendering failed for {document['filename']}: {e}")
+    return None
+
+
+def schedule_preview(document):
+    """Start rendering a preview in the background without waiting for it."""
+    try:
+        get_preview(document, wait=False)
+    except Exception as e:
+        logger.warning(f"Could not schedule preview for {document.get('filename')}: {e}")
+
+
+def enforce_cache_limit(cache_folder, max_bytes):
+    """Delete least recently used previews until the cache folder fits in max_bytes."""
+    entries = []
+    total = 0
+    with os.scandir(cache_folder) as it:
+        for item in it:
+            if item.is_file() and not item.name.endswith('.tmp'):
+                stat = item.stat()
+                entries.append((stat.st_mtime, stat.st_size, item.path))
+                total += stat.st_size
+
+    if total <= max_bytes:
+        return 0
+
+    removed = 0
+    for _, size, path in sorted(entries):
+        try:
+            os.remove(path)
+            removed += 1
+            total -= size
+        except FileNotFoundError:
+            pass
+        if total <= max_bytes:
+            break
+    logger.info(f"Preview cache over limit, evicted {removed} files")
+    return removed
+
+
+def _submit(source_path, dest_path, config, temporary_source=False):
+    with _in_flight_lock:
+        future = _in_flight.get(dest_path)
+        if future is not None:
+            if temporary_source:
+                _remove_quietly(source_path)
+            return future
+
+        os.makedirs(config['PREVIEW_CACHE_FOLDER'], exist_ok=True)
+        args = (render_preview, source_path, dest_path,
+                config['PREVIEW_MAX_SIZE'], config['PREVIEW_FORMAT'], config['PREVIEW_QUALITY'])
+        try:
+            future = _get_pool(config['PREVIEW_WORKERS']).submit(*args)
+        except BrokenProcessPool:
+            # A render process died (e.g. killed for memory on a hostile image); start a fresh pool
+            logger.warning("Preview process pool was broken, recreating it")
+            future = _get_pool(config['PREVIEW_WORKERS'], replace=True).submit(*args)
+        _in_flight[dest_path] = future
+
+    cache_folder, max_bytes = config['PREVIEW_CACHE_FOLDER'], config['PREVIEW_CACHE_MAX_BYTES']
+
+    def _done(finished):
+        with _in_flight_lock:
+            _in_flight.pop(dest_path, None)
+        if temporary_source:
+            _remove_quietly(source_path)
+        # exception() raises CancelledError on a cancelled future (e.g. at pool shutdown)
+        if not finished.cancelled() and finished.exception() is None:
+            try:
+                enforce_cache_limit(cache_folder, max_bytes)
+            except OSError as e:
+                logger.warning(f"Preview cache eviction failed: {e}")
+
+    future.add_done_callback(_done)
+    return future
+
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _get_pool(max_workers, replace=False):
+    """One bounded pool per process, created on first use (after any gunicorn fork)."""
+    global _pool, _pool_pid
+    with _pool_lock:
+        if replace and _pool is not None and _pool_pid == os.getpid():
+            _pool.shutdown(wait=False, cancel_futures=True)
+        if replace or _pool is None or _pool_pid != os.getpid():
+            # 'spawn' children start clean instead of inheriting this process's threads and sockets
+            _pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'))
+            _pool_pid = os.getpid()
+        return _pool
+
+
+@atexit.register
+def _shutdown_pool():
+    if _pool is not None and _pool_pid == os.getpid():
+        _pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,184 @@
+# services/storage.py
+import os
+import tempfile
+import logging
+from flask import current_app
+from gridfs import GridFSBucket, NoFile
+from extensions import mongo
+from utils.file_serving import serve_file, serve_stream
+from utils.upload_stream import publish_exclusive
+
+logger = logging.getLogger(__name__)
+
+# STORAGE_BACKEND values
+BACKEND_LOCAL = 'local'   # Files in UPLOAD_FOLDER (single node, or a shared filesystem)
+BACKEND_GRIDFS = 'gridfs' # Files in MongoDB GridFS, so any app node can serve any file
+
+# Piece size for every copy between a stream and a backend
+COPY_CHUNK_SIZE = 256 * 1024
+
+
+class LocalStorage:
+    """Stored files are plain files in a directory (UPLOAD_FOLDER)."""
+
+    name = BACKEND_LOCAL
+
+    def __init__(self, root, accel_prefix=None):
+        self.root = root
+        self.accel_prefix = accel_prefix
+
+    def path(self, filename):
+        return os.path.join(self.root, filename)
+
+    def local_path(self, filename):
+        """Path of the stored file on this machine, or None if it does not exist."""
+        path = self.path(filename)
+        return path if os.path.isfile(path) else None
+
+    def exists(self, filename):
+        return os.path.isfile(self.path(filename))
+
+    def size(self, filename):
+        return os.path.getsize(self.path(filename))
+
+    def open(self, filename):
+        """Binary file object for reading. Raises FileNotFoundError."""
+        return open(self.path(filename), 'rb')
+
+    def save(self, stream, filename):
+        """
+        Publishes a fully written HashingFileStream under filename with one rename.
+        Raises FileExistsError (leaving the stream for discard()) if the name is taken.
+        """
+        stream.commit(self.path(filename), exclusive=True)
+
+    def write(self, filename, source):
+        """Copies a readable binary file object in under filename. Raises FileExistsError."""
+        os.makedirs(self.root, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix='.upload-', suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as target:
+                for chunk in iter(lambda: source.read(COPY_CHUNK_SIZE), b''):
+                    target.write(chunk)
+            publish_exclusive(tmp_path, self.path(filename))
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+    def rename(self, filename, new_name):
+        """
+        Moves a stored file to new_name without ever replacing an existing one.
+        Raises FileNotFoundError if filename is missing, FileExistsError if new_name is taken.
+        """
+        publish_exclusive(self.path(filename), self.path(new_name))
+
+    def delete(self, filename):
+        """Removes the file. Returns False if it did not exist."""
+        try:
+            os.remove(self.path(filename))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def serve(self, filename, download_name, etag=None):
+        # Local files keep the proxy hand-off modes (x-accel / x-sendfile)
+        return serve_file(self.root, filename, download_name=download_name, etag=etag,
+                          accel_prefix=self.accel_prefix)
+
+
+class GridFSStorage:
+    """
+    Stored files live in a GridFS bucket, keyed by filename.
+
+    Files are read and written a chunk at a time through GridIn/GridOut rather than
+    upload_from_stream/download_to_stream, so the per-operation MONGO_TIMEOUT_MS
+    applies to each chunk instead of to a whole large transfer.
+    Uploads of the same name are serialized by the blobs collection (only the
+    request that creates a blob record writes it); if two writes ever race, GridFS
+    keeps both as revisions of identical content and delete() removes them all.
+    """
+
+    name = BACKEND_GRIDFS
+
+    def __init__(self, db, bucket_name='uploads', chunk_size_bytes=COPY_CHUNK_SIZE):
+        self.bucket_name = bucket_name
+        self.files = db[f'{bucket_name}.files']
+        self.bucket = GridFSBucket(db, bucket_name=bucket_name, chunk_size_bytes=chunk_size_bytes)
+
+    def local_path(self, filename):
+        return None
+
+    def exists(self, filename):
+        return self.files.find_one({'filename': filename}, {'_id': 1}) is not None
+
+    def size(self, filename):
+        stored = self.files.find_one({'filename': filename}, {'length': 1}, sort=[('uploadDate', -1)])
+        if stored is None:
+            raise FileNotFoundError(filename)
+        return stored['length']
+
+    def open(self, filename):
+        """Seekable GridOut for the newest revision. Raises FileNotFoundError."""
+        try:
+            return self.bucket.open_download_stream_by_name(filename)
+        except NoFile:
+            raise FileNotFoundError(filename)
+
+    def save(self, stream, filename):
+        """Copies a fully written HashingFileStream into GridFS, then deletes the temp file."""
+        stream.flush()
+        stream.seek(0)
+        self.write(filename, stream)
+        stream.discard()
+
+    def write(self, filename, source):
+        if self.exists(filename):
+            raise FileExistsError(filename)
+        target = self.bucket.open_upload_stream(filename)
+        try:
+            for chunk in iter(lambda: source.read(COPY_CHUNK_SIZE), b''):
+                target.write(chunk)
+        except BaseException:
+            # GridIn.__exit__ only marks the file closed on error; abort() deletes the chunks written so far
+            target.abort()
+            raise
+        target.close() # Writes the files document, making the file visible
+
+    def rename(self, filename, new_name):
+        if self.exists(new_name):
+            raise FileExistsError(new_name)
+        # Renames every revision, so the old name is gone in a single update
+        if not self.files.update_many({'filename': filename}, {'$set': {'filename': new_name}}).matched_count:
+            raise FileNotFoundError(filename)
+
+    def delete(self, filename):
+        deleted = False
+        for stored in self.files.find({'filename': filename}, {'_id': 1}):
+            try:
+                self.bucket.delete(stored['_id'])
+                deleted = True
+            except NoFile:
+                pass
+        return deleted
+
+    def serve(self, filename, download_name, etag=None):
+        source = self.open(filename)
+        return serve_stream(source, source.length, download_name=download_name, etag=etag)
+
+
+def get_storage(backend=None):
+    """
+    The storage backend named by STORAGE_BACKEND (or backend, for migrations).
+    Cheap to build: no I/O happens until a file is read or written.
+    """
+    config = current_app.config
+    backend = (backend or config['STORAGE_BACKEND']).lower()
+    if backend == BACKEND_LOCAL:
+        return LocalStorage(config['UPLOAD_FOLDER'], accel_prefix=config.get('X_ACCEL_UPLOAD_PREFIX'))
+    if backend == BACKEND_GRIDFS:
+        return GridFSStorage(mongo.db, bucket_name=config['GRIDFS_BUCKET'],
+                             chunk_size_bytes=config['GRIDFS_CHUNK_SIZE'])
+    raise ValueError(f"Unknown STORAGE_BACKEND '{backend}'. Use '{BACKEND_LOCAL}' or '{BACKEND_GRIDFS}'.")
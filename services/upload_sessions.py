@@ -0,0 +1,344 @@
+# services/upload_sessions.py
+import math
+import os
+import time
+import logging
+from datetime import datetime, timedelta
+from bson import ObjectId
+from flask import current_app
+from pymongo import ReturnDocument
+from extensions import mongo
+from utils.mime_sniff import SNIFF_BYTES, head_is_disallowed
+from utils.upload_stream import HashingFileStream
+from utils.file_utils import SavedFile, secure_extension, store_stream
+from services.blob_store import release_blob
+from services.document_services import create_document
+
+logger = logging.getLogger(__name__)
+
+# Session lifecycle: open -> finalizing -> stored -> completed, or deleted by cleanup once expired.
+# 'stored' means the file is a blob (the session holds its reference) but the document
+# insert failed; finalize can be retried from there without re-sending any chunk.
+# A failed finalize with bad content deletes the session and its file.
+SESSION_OPEN = 'open'
+SESSION_FINALIZING = 'finalizing'
+SESSION_STORED = 'stored'
+SESSION_COMPLETED = 'completed'
+
+PART_PREFIX = '.session-'
+PART_SUFFIX = '.part'
+WRITE_PIECE_SIZE = 64 * 1024
+
+
+class UploadSessionError(Exception):
+    """A request the session cannot accept; .status is the HTTP status to answer with."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def part_path(session_id):
+    """Assembly file of a session. A dot file in UPLOAD_FOLDER, so publishing it is a rename."""
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], f"{PART_PREFIX}{session_id}{PART_SUFFIX}")
+
+
+def session_summary(session):
+    """JSON-friendly view of a session for the client (what to send next)."""
+    received = set(session.get('received', []))
+    return {
+        'session_id': str(session['_id']),
+        'filename': session['original_name'],
+        'size': session['size'],
+        'chunk_size': session['chunk_size'],
+        'total_chunks': session['total_chunks'],
+        'received_chunks': sorted(received),
+        'missing_chunks': [i for i in range(session['total_chunks']) if i not in received],
+        'status': session['status'],
+        'expires_at': session['expires_at'].isoformat() + 'Z',
+    }
+
+
+def create_session(user_id, original_name, size):
+    """
+    Starts a chunked upload: validates name and size, records the session and
+    preallocates the assembly file (sparse) so chunks can be written at any offset.
+    """
+    config = current_app.config
+    if not original_name or not original_name.strip():
+        raise UploadSessionError('A filename is required.')
+    if not isinstance(size, int) or size <= 0:
+        raise UploadSessionError('The file size must be a positive number of bytes.')
+    if size > config['CHUNKED_UPLOAD_MAX_SIZE']:
+        raise UploadSessionError(f"File exceeds the maximum size of {config['CHUNKED_UPLOAD_MAX_SIZE'] // (1024 * 1024)}MB.", 413)
+
+    extension = secure_extension(original_name)
+    if not extension:
+        allowed = ", ".join(sorted(config.get('ALLOWED_EXTENSIONS', [])))
+        raise UploadSessionError(f"Invalid file type. Allowed extensions: {allowed}")
+
+    chunk_size = config['CHUNKED_UPLOAD_CHUNK_SIZE']
+    now = datetime.utcnow()
+    session = {
+        '_id': ObjectId(),
+        'user_id': user_id,
+        'original_name': original_name,
+        'extension': extension,
+        'size': size,
+        'chunk_size': chunk_size,
+        'total_chunks': math.ceil(size / chunk_size),
+        'received': [],
+        'status': SESSION_OPEN,
+        'created_at': now,
+        'expires_at': now + timedelta(seconds=config['CHUNKED_UPLOAD_SESSION_TTL']),
+    }
+
+    os.makedirs(config['UPLOAD_FOLDER'], exist_ok=True)
+    fd = os.open(part_path(session['_id']), os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+    try:
+        os.ftruncate(fd, size)
+    finally:
+        os.close(fd)
+
+    try:
+        mongo.db.upload_sessions.insert_one(session)
+    except Exception:
+        _remove_part(session['_id'])
+        raise
+    logger.info(f"Upload session {session['_id']} started for '{original_name}' ({size} bytes, {session['total_chunks']} chunks)")
+    return session
+
+
+def get_session(session_id, user_id):
+    """The user's session, or UploadSessionError(404)."""
+    if not ObjectId.is_valid(session_id):
+        raise UploadSessionError('Upload session not found.', 404)
+    session = mongo.db.upload_sessions.find_one({'_id': ObjectId(session_id), 'user_id': user_id})
+    if not session:
+        raise UploadSessionError('Upload session not found.', 404)
+    return session
+
+
+def write_chunk(session_id, user_id, index, length, stream):
+    """
+    Writes chunk number index from a request body straight into the assembly file.
+
+    Chunks may arrive in any order and in parallel: each is written with pwrite at
+    its own offset, so no locking is needed, and re-sending a chunk rewrites the
+    same bytes. The chunk is only marked received once all of its bytes are on disk.
+    Chunk 0 is sniffed as it arrives: if its first bytes are not an allowed type the
+    session is dropped (415) before the client sends the rest of the file.
+    Returns the updated session.
+    """
+    session = get_session(session_id, user_id)
+    if session['status'] != SESSION_OPEN:
+        raise UploadSessionError('This upload is no longer accepting chunks.', 409)
+    if session['expires_at'] < datetime.utcnow():
+        raise UploadSessionError('This upload session has expired.', 410)
+
+    chunk_size, size = session['chunk_size'], session['size']
+    if not 0 <= index < session['total_chunks']:
+        raise UploadSessionError(f"Chunk index must be between 0 and {session['total_chunks'] - 1}.")
+    offset = index * chunk_size
+    expected = min(chunk_size, size - offset)
+    if length is not None and length != expected:
+        raise UploadSessionError(f'Chunk {index} must be exactly {expected} bytes.')
+
+    written, head = 0, b''
+    try:
+        fd = os.open(part_path(session['_id']), os.O_WRONLY)
+    except FileNotFoundError:
+        # Finalized (or cancelled) since the status check above, e.g. a late retry of a chunk
+        raise UploadSessionError('This upload is no longer accepting chunks.', 409)
+    try:
+        while written < expected:
+            piece = stream.read(min(WRITE_PIECE_SIZE, expected - written))
+            if not piece:
+                break
+            if index == 0 and len(head) < SNIFF_BYTES:
+                head += piece[:SNIFF_BYTES - len(head)]
+            view = memoryview(piece)
+            while view:
+                count = os.pwrite(fd, view, offset + written)
+                written += count
+                view = view[count:]
+        # Extra bytes past the chunk mean the client and server disagree on the layout
+        if written == expected and stream.read(1):
+            raise UploadSessionError(f'Chunk {index} is longer than {expected} bytes.')
+    finally:
+        os.close(fd)
+
+    if written != expected:
+        raise UploadSessionError(f'Chunk {index} was incomplete ({written} of {expected} bytes); send it again.')
+
+    if index == 0 and head_is_disallowed(head, current_app.config.get('ALLOWED_MIME_TYPES', set()), session['extension']):
+        # Conditional, so a finalize that claimed the session meanwhile keeps it
+        if mongo.db.upload_sessions.delete_one({'_id': session['_id'], 'status': SESSION_OPEN}).deleted_count:
+            _remove_part(session['_id'])
+        raise UploadSessionError('The file content is not an allowed document type.', 415)
+
+    # Each received chunk also extends the session, so slow but active uploads do not expire
+    return mongo.db.upload_sessions.find_one_and_update(
+        {'_id': session['_id'], 'status': SESSION_OPEN},
+        {
+            '$addToSet': {'received': index},
+            '$set': {'expires_at': datetime.utcnow() + timedelta(seconds=current_app.config['CHUNKED_UPLOAD_SESSION_TTL'])},
+        },
+        return_document=ReturnDocument.AFTER,
+    ) or session
+
+
+def finalize_session(session_id, user_id):
+    """
+    Claims a session whose chunks have all arrived, stores the assembled file and
+    creates its document.
+
+    The claim is one atomic update that only matches an open session with every
+    chunk received (or a 'stored' one whose document insert failed earlier), so a
+    double finalize or a finalize racing a missing chunk is rejected. The assembly
+    file is copied and hashed in one pass (see _store_assembled_file), then the copy
+    is content-checked and published as a blob exactly like a single-request upload
+    (utils.file_utils.store_stream). The session only becomes
+    'completed' once the document exists; finalizing a completed session again
+    returns the same document, so clients can safely retry.
+    Returns (session, document_id).
+    """
+    session = get_session(session_id, user_id)
+    if session['status'] == SESSION_COMPLETED:
+        return session, session['document_id']
+
+    claimed = mongo.db.upload_sessions.find_one_and_update(
+        {'_id': session['_id'], '$or': [
+            {'status': SESSION_OPEN, 'received': {'$size': session['total_chunks']}},
+            {'status': SESSION_STORED},
+        ]},
+        {'$set': {'status': SESSION_FINALIZING, 'finalizing_since': datetime.utcnow()}},
+        return_document=ReturnDocument.BEFORE,
+    )
+    if claimed is None:
+        if session['status'] != SESSION_OPEN:
+            raise UploadSessionError('This upload is already being finalized.', 409)
+        missing = session['total_chunks'] - len(session.get('received', []))
+        raise UploadSessionError(f'{missing} chunk(s) have not been received yet.', 409)
+
+    if claimed['status'] == SESSION_STORED:
+        saved_file = SavedFile(**claimed['saved_file'])
+    else:
+        saved_file = _store_assembled_file(claimed)
+
+    try:
+        document = create_document(user_id, saved_file, claimed['original_name'])
+    except Exception:
+        # Keep the blob reference on the session so a retry only has to insert the document
+        mongo.db.upload_sessions.update_one(
+            {'_id': claimed['_id']},
+            {'$set': {'status': SESSION_STORED, 'saved_file': saved_file._asdict()}}
+        )
+        raise
+
+    mongo.db.upload_sessions.update_one(
+        {'_id': claimed['_id']},
+        {'$set': {
+            'status': SESSION_COMPLETED,
+            'document_id': document['_id'],
+            'completed_at': datetime.utcnow(),
+            # Kept for a while so a client that missed the response can finalize again
+            'expires_at': datetime.utcnow() + timedelta(seconds=current_app.config['CHUNKED_UPLOAD_SESSION_TTL']),
+        }, '$unset': {'saved_file': ''}}
+    )
+    return claimed, document['_id']
+
+
+def _store_assembled_file(session):
+    """
+    Content-checks the assembly file and stores a copy of it as a blob. Returns SavedFile.
+
+    The assembly file itself is never published: a chunk PUT that passed its status
+    check just before the claim may still pwrite into it, and if it were hard-linked
+    as the blob those bytes would land in content shared by every document with that
+    hash. The copy is hashed as it is written, so the blob always matches its name.
+    """
+    stream = HashingFileStream(current_app.config['UPLOAD_FOLDER'])
+    try:
+        with open(part_path(session['_id']), 'rb') as part:
+            for piece in iter(lambda: part.read(WRITE_PIECE_SIZE), b''):
+                stream.write(piece)
+        saved_file = store_stream(stream, session['extension'], session['original_name'])
+    except Exception:
+        # Storage failed: keep the assembled file and reopen the session so finalize can be retried
+        stream.discard()
+        mongo.db.upload_sessions.update_one({'_id': session['_id']}, {'$set': {'status': SESSION_OPEN}})
+        raise
+
+    stream.discard() # Deletes the copy unless it became the blob
+    _remove_part(session['_id'])
+    if not saved_file:
+        mongo.db.upload_sessions.delete_one({'_id': session['_id']})
+        raise UploadSessionError('The file content is not an allowed document type.', 415)
+    return saved_file
+
+
+def cancel_session(session_id, user_id):
+    session = get_session(session_id, user_id)
+    if session['status'] in (SESSION_FINALIZING, SESSION_COMPLETED):
+        raise UploadSessionError('This upload is already being finalized.', 409)
+    # Conditional, so a finalize claiming the session meanwhile keeps it
+    if not mongo.db.upload_sessions.delete_one({'_id': session['_id'], 'status': session['status']}).deleted_count:
+        raise UploadSessionError('This upload is already being finalized.', 409)
+    _release_session(session)
+
+
+def cleanup_sessions(stale_temp_age=24 * 3600):
+    """
+    Removes expired sessions with their assembly files, completed session records,
+    and assembly/temp files in UPLOAD_FOLDER that no session owns any more.
+    Returns (sessions_removed, files_removed).
+    """
+    now = datetime.utcnow()
+    sessions_removed = 0
+    # Every status expires: a worker that died mid-finalize leaves the session claimed,
+    # and its file is safe to drop once the session has been idle for the full TTL
+    for session in mongo.db.upload_sessions.find({'expires_at': {'$lt': now}}, {'status': 1, 'saved_file': 1}):
+        if mongo.db.upload_sessions.delete_one({'_id': session['_id'], 'status': session['status']}).deleted_count:
+            _release_session(session)
+            sessions_removed += 1
+
+    files_removed = 0
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    live_ids = {str(s['_id']) for s in mongo.db.upload_sessions.find({}, {'_id': 1})}
+    with os.scandir(upload_folder) as entries:
+        for entry in entries:
+            name = entry.name
+            if name.startswith(PART_PREFIX) and name.endswith(PART_SUFFIX):
+                orphan = name[len(PART_PREFIX):-len(PART_SUFFIX)] not in live_ids
+            elif name.startswith('.upload-') and name.endswith('.part'):
+                # Single-request temp files are removed when their request ends; these were left by a crash
+                orphan = time.time() - entry.stat().st_mtime > stale_temp_age
+            else:
+                continue
+            if orphan:
+                try:
+                    os.remove(entry.path)
+                    files_removed += 1
+                except FileNotFoundError:
+                    pass
+    return sessions_removed, files_removed
+
+
+def _release_session(session):
+    """Frees what a deleted session held: its assembly file, and its blob reference if 'stored'."""
+    _remove_part(session['_id'])
+    if session.get('status') == SESSION_STORED and session.get('saved_file'):
+        try:
+            release_blob(session['saved_file']['sha256'])
+        except Exception as e:
+            logger.error(f"Could not release blob of abandoned upload session {session['_id']}: {e}")
+
+
+def _remove_part(session_id):
+    try:
+        os.remove(part_path(session_id))
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.error(f"Could not remove upload session file for {session_id}: {e}")
@@ -0,0 +1,93 @@
+# services/user_cache.py
+import threading
+import time
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class UserCache:
+    """
+    Bounded per-process cache of User objects for the Flask-Login user loader.
+
+    Entries expire USER_CACHE_TTL seconds after they were loaded and the least
+    recently used entry is evicted once USER_CACHE_MAXSIZE users are cached.
+    Code that changes a user record (admin flag, email, password...) must call
+    invalidate(user_id) so this process stops serving the old copy; other worker
+    processes pick up the change when their entry expires.
+    """
+
+    def __init__(self, app=None, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict() # user_id -> (expires_at, User)
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.maxsize = int(app.config.get('USER_CACHE_MAXSIZE', self.maxsize))
+        self.ttl = float(app.config.get('USER_CACHE_TTL', self.ttl))
+        app.extensions['user_cache'] = self
+
+    @property
+    def enabled(self):
+        return self.ttl > 0 and self.maxsize > 0
+
+    def get(self, user_id):
+        """Return the cached User for user_id, or None on a miss or expired entry."""
+        if not self.enabled:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._entries[user_id]
+                self._misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self._hits += 1
+            return entry[1]
+
+    def set(self, user_id, user):
+        """Cache a freshly loaded User."""
+        if not self.enabled or user is None:
+            return
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl, user)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def invalidate(self, user_id):
+        """Drop one user so the next request reloads it from the database."""
+        with self._lock:
+            self._entries.pop(str(user_id), None)
+
+    def clear(self):
+        """Drop every cached user (e.g. after a bulk change to the users collection)."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'ttl_seconds': self.ttl,
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'hit_ratio': round(self._hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+# Shared cache used by the user loader in create_app()
+user_cache = UserCache()
@@ -0,0 +1,131 @@
+import mimetypes
+import os
+import logging
+from urllib.parse import quote
+from flask import abort, current_app, request, send_from_directory
+from werkzeug.security import safe_join
+from werkzeug.wsgi import wrap_file
+
+logger = logging.getLogger(__name__)
+
+# For x-accel mode nginx needs internal locations matching X_ACCEL_*_PREFIX, e.g.:
+#
+#     location /protected/uploads/   { internal; alias /srv/nemsa/uploads/; }
+#     location /protected/templates/ { internal; alias /srv/nemsa/templates_for_download/; }
+
+# FILE_SERVING_MODE values
+SERVE_PYTHON = 'python'         # Flask streams the file (range requests, ETag, 304 handled here)
+SERVE_X_ACCEL = 'x-accel'       # nginx: X-Accel-Redirect to an internal location
+SERVE_X_SENDFILE = 'x-sendfile' # Apache mod_xsendfile / lighttpd: X-Sendfile with the absolute path
+
+
+def serve_file(directory, filename, download_name, etag=None, max_age=None, accel_prefix=None, mimetype=None):
+    """
+    Sends a file from directory as an attachment, using the configured FILE_SERVING_MODE.
+
+    Args:
+        directory (str): Folder the file lives in (UPLOAD_FOLDER, TEMPLATE_DOWNLOAD_FOLDER...).
+        filename (str): Name of the file inside directory.
+        download_name (str): Name the browser should save the file as.
+        etag (str): Strong ETag to use, e.g. the content SHA-256. Defaults to one
+                    derived from mtime and size.
+        max_age (int): Cache lifetime in seconds for public files. None sends
+                       'no-cache' so clients revalidate with If-None-Match.
+        accel_prefix (str): Internal nginx location mapped to directory (x-accel mode).
+        mimetype (str): Content type if already known; guessed from download_name otherwise.
+
+    Callers must have done their authorization checks already: in proxy modes the
+    front server delivers the bytes without calling back into the app.
+    In every mode a matching If-None-Match is answered with 304 by the app itself.
+    """
+    mode = current_app.config.get('FILE_SERVING_MODE', SERVE_PYTHON)
+
+    if mode == SERVE_X_ACCEL and accel_prefix:
+        return _x_accel_response(directory, filename, download_name, etag, max_age, accel_prefix, mimetype)
+
+    # Python and X-Sendfile modes: send_from_directory honours USE_X_SENDFILE (set from
+    # FILE_SERVING_MODE in create_app) and, with conditional=True, answers Range and
+    # If-None-Match / If-Modified-Since requests itself.
+    return send_from_directory(
+        directory=directory,
+        path=filename,
+        as_attachment=True,
+        download_name=download_name,
+        mimetype=mimetype,
+        conditional=True,
+        etag=etag if etag else True,
+        max_age=max_age
+    )
+
+
+def serve_stream(source, size, download_name, etag=None, max_age=None, mimetype=None):
+    """
+    Sends an open, seekable binary file object (e.g. a GridFS GridOut) as an attachment.
+
+    For files that are not on the local filesystem, so proxy modes do not apply: the
+    body is streamed from source in pieces, and Range / If-None-Match requests are
+    answered here, seeking source for partial content. source is closed with the response.
+    """
+    response = current_app.response_class(
+        wrap_file(request.environ, source),
+        mimetype=mimetype or mimetypes.guess_type(download_name)[0] or 'application/octet-stream',
+        direct_passthrough=True
+    )
+    response.call_on_close(source.close) # Also covers 304s, whose body is never iterated
+    response.content_length = size
+    response.headers.set('Content-Disposition', 'attachment', **_disposition_names(download_name))
+    if etag:
+        response.set_etag(etag)
+
+    if max_age:
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+    else:
+        response.cache_control.no_cache = True
+
+    return response.make_conditional(request, accept_ranges=True, complete_length=size)
+
+
+def _x_accel_response(directory, filename, download_name, etag, max_age, accel_prefix, mimetype):
+    # Same traversal protection send_from_directory applies
+    if safe_join(directory, filename) is None:
+        abort(404)
+
+    response = current_app.response_class(
+        mimetype=mimetype or mimetypes.guess_type(download_name)[0] or 'application/octet-stream'
+    )
+    # nginx serves the body (including Range requests) from its internal location
+    response.headers['X-Accel-Redirect'] = accel_prefix.rstrip('/') + '/' + quote(filename)
+    response.headers.set('Content-Disposition', 'attachment', **_disposition_names(download_name))
+
+    if etag:
+        response.set_etag(etag)
+    else:
+        try:
+            stat = os.stat(safe_join(directory, filename))
+            response.set_etag(f"{stat.st_mtime}-{stat.st_size}")
+            response.last_modified = stat.st_mtime
+        except OSError as e:
+            logger.warning(f"Could not stat {filename} for ETag: {e}")
+
+    if max_age:
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+    else:
+        response.cache_control.no_cache = True
+
+    # A matching If-None-Match becomes a bodiless 304 and nginx is never involved
+    response = response.make_conditional(request)
+    if response.status_code == 304:
+        response.headers.pop('X-Accel-Redirect', None)
+    return response
+
+
+def _disposition_names(download_name):
+    # Same filename / filename* handling as werkzeug's send_file
+    try:
+        download_name.encode('ascii')
+        return {'filename': download_name}
+    except UnicodeEncodeError:
+        simple = download_name.encode('ascii', 'ignore').decode('ascii')
+        return {'filename': simple, 'filename*': f"UTF-8''{quote(download_name, safe='!#$&+-.^_`|~')}"}
@@ -1,14 +1,25 @@
     
 import os
-import uuid
 import logging
+from typing import NamedTuple
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.utils import secure_filename
 from flask import current_app
-import mimetypes # Optional: for checking MIME types as well
+from utils.upload_stream import DisallowedContent, stream_to_upload_folder
+from utils.mime_sniff import is_allowed_content
+from services.blob_store import store_blob
 
 logger = logging.getLogger(__name__)
 
 
+class SavedFile(NamedTuple):
+    """Result of save_uploaded_file: the stored name plus what was measured while streaming."""
+    filename: str
+    size: int
+    sha256: str
+    mimetype: str
+
+
 def allowed_file(filename):
     """
     Checks if the file extension is in the allowed set.
@@ -26,120 +37,115 @@ def allowed_file(filename):
     return is_allowed
 
 
-def save_uploaded_file(file):
+def secure_extension(original_filename):
     """
-    Securely saves an uploaded file with collision prevention and validation.
-    Includes a second check against allowed extensions after securing.
-    Returns: stored_filename or None on failure.
+    Returns the secured, lowercased extension of a client filename including the dot
+    (e.g. '.pdf'), or None if there is none or it is not in ALLOWED_EXTENSIONS.
     """
-    try:
-        if not file or file.filename.strip() == '':
-            logger.warning("No file or empty filename provided to save_uploaded_file")
-            return None
+    # Split original filename into name and extension part
+    filename_part, extension_part = os.path.splitext(original_filename) # extension_part includes the dot, e.g., '.png'
 
-        original_filename = file.filename
-        # Split original filename into name and extension part
-        filename_part, extension_part = os.path.splitext(original_filename) # extension_part includes the dot, e.g., '.png'
+    # Secure the extension part (including the dot) and ensure lowercase
+    secure_ext = secure_filename(extension_part.lower())
 
-        # Secure the filename part (before the dot)
-        secure_name = secure_filename(filename_part)
-        if not secure_name:
-             # If securing results in an empty string, use a UUID as the base name
-             secure_name = str(uuid.uuid4())
+    # Ensure the secured extension starts with a dot and handle cases like "filename."
+    if not secure_ext.startswith('.'):
+         # secure_filename strips the leading dot of a bare extension; put it back
+         if secure_ext: # If there's a secured extension string, add a dot
+             secure_ext = '.' + secure_ext
+         # If secure_ext is empty, it means no extension was found/secured, handle below
 
-        # Secure the extension part (including the dot) and ensure lowercase
-        secure_ext = secure_filename(extension_part.lower())
+    # Check if a valid secured extension exists
+    if not secure_ext or secure_ext == '.':
+        logger.warning(f"File missing valid extension after securing filename '{original_filename}'. Secured extension part: '{secure_ext}'")
+        # This catches files like "filename." or files with no extension or only unsafe chars in extension
+        return None
 
-        # Ensure the secured extension starts with a dot and handle cases like "filename."
-        if not secure_ext.startswith('.'):
-             # This shouldn't typically happen if os.path.splitext provided an extension_part,
-             # but secure_filename might change things or handle edge cases.
-             if secure_ext: # If there's a secured extension string, add a dot
-                 secure_ext = '.' + secure_ext
-             # If secure_ext is empty, it means no extension was found/secured, handle below
+    # --- Add detailed logging before the second extension check ---
+    actual_extension_without_dot = secure_ext[1:] # Get the extension string without the leading dot
+    allowed_extensions_set = current_app.config.get('ALLOWED_EXTENSIONS', set()) # Get the allowed set safely
 
+    logger.debug(f"Save check: Original='{original_filename}', Secured Ext='{secure_ext}'")
+    logger.debug(f"Save check: Ext without dot='{actual_extension_without_dot}'")
+    logger.debug(f"Save check: Allowed Extensions Set: {allowed_extensions_set}")
+    logger.debug(f"Save check: Is '{actual_extension_without_dot}' IN {allowed_extensions_set}? --> {actual_extension_without_dot in allowed_extensions_set}")
+    # --- End logging ---
+
+    # Validate against allowed extensions *again* after securing
+    if actual_extension_without_dot not in allowed_extensions_set:
+        # The warning message includes the exact extension being checked
+        logger.warning(f"Invalid file extension '{actual_extension_without_dot}' after securing. Allowed: {allowed_extensions_set}")
+        return None # Return None if extension is not allowed
+
+    return secure_ext
 
-        # Check if a valid secured extension exists
-        if not secure_ext or secure_ext == '.':
-            logger.warning(f"File missing valid extension after securing filename '{original_filename}'. Secured extension part: '{secure_ext}'")
-            # This catches files like "filename." or files with no extension or only unsafe chars in extension
-            return None
 
-        # --- Add detailed logging before the second extension check ---
-        actual_extension_without_dot = secure_ext[1:] # Get the extension string without the leading dot
-        allowed_extensions_set = current_app.config.get('ALLOWED_EXTENSIONS', set()) # Get the allowed set safely
-
-        logger.debug(f"Save check: Original='{original_filename}', Secured Name='{secure_name}', Secured Ext='{secure_ext}'")
-        logger.debug(f"Save check: Ext without dot='{actual_extension_without_dot}'")
-        logger.debug(f"Save check: Allowed Extensions Set: {allowed_extensions_set}")
-        logger.debug(f"Save check: Is '{actual_extension_without_dot}' IN {allowed_extensions_set}? --> {actual_extension_without_dot in allowed_extensions_set}")
-        # --- End logging ---
-
-
-        # Validate against allowed extensions *again* after securing
-        # This checks if the extracted/secured extension (without the dot) is in the allowed set.
-        if actual_extension_without_dot not in allowed_extensions_set:
-            # This condition is TRUE if the extension is NOT allowed
-            # The warning message should now include the exact extension being checked
-            logger.warning(f"Invalid file extension '{actual_extension_without_dot}' after securing. Allowed: {allowed_extensions_set}")
-            return None # Return None if extension is not allowed
-
-
-        # Optional: Validate MIME type as well for added security
-        # mimetype, _ = mimetypes.guess_type(original_filename)
-        # allowed_mimetypes = current_app.config.get('ALLOWED_MIME_TYPES', set())
-        # if mimetype and mimetype not in allowed_mimetypes:
-        #    logger.warning(f"Invalid MIME type '{mimetype}' for file '{original_filename}'. Allowed: {allowed_mimetypes}")
-        #    return None
-        # elif not mimetype:
-        #    logger.warning(f"Could not determine MIME type for file '{original_filename}'")
-        #    # Decide if you want to reject files with unknown MIME types
-
-
-        # Generate a unique filename to prevent collision
-        base_name_for_final = secure_name # Use the secured filename part
-        final_filename = f"{base_name_for_final}{secure_ext}" # Append the secured extension
-
-        upload_folder = current_app.config['UPLOAD_FOLDER']
-
-        # Ensure the upload directory exists
-        os.makedirs(upload_folder, exist_ok=True)
-        # Consider setting permissions: os.chmod(upload_folder, 0o755) # Permissions might vary based on OS/deployment needs
-
-        # Prevent overwrites by adding a counter if a file with the same name exists
-        counter = 1
-        check_filename = final_filename
-        while os.path.exists(os.path.join(upload_folder, check_filename)):
-            # Construct the next filename attempt with a counter
-            check_filename = f"{base_name_for_final}_{counter}{secure_ext}"
-            counter += 1
-        final_filename = check_filename # Use the final unique name
-
-        # Construct the full path where the file will be saved
-        file_path = os.path.join(upload_folder, final_filename)
-
-        # Save the file to disk
-        file.save(file_path)
-
-        # Verify that the file was successfully written (basic check)
-        if not os.path.exists(file_path):
-            logger.error(f"File save verification failed: file does not exist after saving at {file_path}")
-            # Raise an error or return None if verification fails
+def store_stream(stream, secure_ext, original_filename):
+    """
+    Validates the content of a complete HashingFileStream and stores it as a blob.
+
+    Returns: SavedFile, or None if the content is not one of ALLOWED_MIME_TYPES,
+    or not a type its extension may hold (a PNG named .pdf is rejected).
+    The caller still owns the stream and must discard() it (a no-op once stored).
+    """
+    # Validate the actual content: the magic number in the first chunk must be an allowed type.
+    # The head was captured while streaming; only ZIP/OLE2 files have a few KB of their directory read back.
+    stream.flush()
+    allowed_mimetypes = current_app.config.get('ALLOWED_MIME_TYPES', set())
+    content_allowed, detected_mimetype = is_allowed_content(stream.head, allowed_mimetypes, stream, secure_ext)
+    if not content_allowed:
+        logger.warning(f"Rejected '{original_filename}': content looks like '{detected_mimetype}', not an allowed type for '{secure_ext}'")
+        return None
+
+    # Uploads are stored content-addressed: the stored name is the SHA-256 of the
+    # content (computed while streaming), so identical files share one copy on disk
+    final_filename = store_blob(stream, secure_ext)
+
+    logger.info(f"File saved successfully: Stored as '{final_filename}' (Original: '{original_filename}', {stream.size} bytes, sha256 {stream.sha256})")
+    return SavedFile(final_filename, stream.size, stream.sha256, detected_mimetype)
+
+
+def save_uploaded_file(file):
+    """
+    Securely saves an uploaded file with collision prevention and validation.
+    Includes a second check against allowed extensions after securing.
+
+    The file content is never copied: it was streamed into a temporary file in the
+    upload folder while the request was parsed (see utils.upload_stream), hashing
+    and counting bytes on the way (a file whose first bytes already rule it out is
+    refused there, before the rest arrives). It is then stored under its content hash (see
+    services.blob_store): a new blob is published with one atomic rename, a
+    duplicate just gains a reference and its temp file is dropped.
+
+    Returns: SavedFile(filename, size, sha256, mimetype) or None on failure
+             (including content that is not one of ALLOWED_MIME_TYPES). Each successful
+             call holds one blob reference; release it with release_blob(sha256)
+             if the document is not kept.
+    Raises: RequestEntityTooLarge if the file exceeds MAX_CONTENT_LENGTH.
+    """
+    stream = None
+    try:
+        if not file or file.filename.strip() == '':
+            logger.warning("No file or empty filename provided to save_uploaded_file")
             return None
 
-        # Consider setting permissions on the saved file: os.chmod(file_path, 0o644) # Permissions might vary
+        secure_ext = secure_extension(file.filename)
+        if not secure_ext:
+            return None
 
-        logger.info(f"File saved successfully: Stored as '{final_filename}' (Original: '{original_filename}')")
-        return final_filename # Return the unique stored filename
+        stream = stream_to_upload_folder(file)
+        return store_stream(stream, secure_ext, file.filename)
 
+    except RequestEntityTooLarge:
+        raise
+    except DisallowedContent:
+        logger.warning(f"Rejected '{file.filename}' while streaming: its first bytes are not an allowed type for its extension")
+        return None
     except Exception as e:
         # Log any exceptions that occur during the save process
         logger.error(f"File save failed for original file '{file.filename if file else 'N/A'}': {str(e)}", exc_info=True)
-        # Attempt to clean up the partially written file if file_path was defined before the error
-        if 'file_path' in locals() and file_path and os.path.exists(file_path):
-             try:
-                 os.remove(file_path)
-                 logger.info(f"Cleaned up partially saved file: {file_path}")
-             except Exception as cleanup_e:
-                 logger.error(f"Error during cleanup of failed upload file {file_path}: {cleanup_e}")
-        return None # Indicate failure by returning None
\ No newline at end of file
+        return None # Indicate failure by returning None
+    finally:
+        # Removes the temp file unless it was committed above
+        if stream is not None:
+            stream.discard()
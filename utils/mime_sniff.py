@@ -0,0 +1,154 @@
+import struct
+import threading
+import zipfile
+import logging
+
+logger = logging.getLogger(__name__)
+
+# How much of the start of an upload is kept for sniffing (see HashingFileStream.head)
+SNIFF_BYTES = 8192
+
+# OLE2 compound file (legacy .doc, but also .xls/.ppt/.msi)
+OLE2_MAGIC = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+# Name of the main stream of a Word 97-2003 file, as stored (UTF-16LE) in the OLE directory
+WORD_STREAM_NAME = 'WordDocument'.encode('utf-16-le')
+
+DOCX_MIME = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+
+# Content types each allowed extension may hold, so a PNG renamed to .pdf is not stored as one
+MIME_TYPES_BY_EXTENSION = {
+    '.pdf': {'application/pdf'},
+    '.doc': {'application/msword'},
+    '.docx': {DOCX_MIME},
+    '.png': {'image/png'},
+    '.jpg': {'image/jpeg'},
+    '.jpeg': {'image/jpeg'},
+    '.gif': {'image/gif'},
+}
+
+_libmagic = threading.local()
+_libmagic_missing = False
+
+
+def sniff_mime(head, fileobj=None):
+    """
+    Pure-Python magic-number check for the upload types we accept.
+
+    Args:
+        head (bytes): The first bytes of the file (up to SNIFF_BYTES).
+        fileobj: Optional seekable binary file with the whole content. Lets ZIP and
+                 OLE2 files be identified from their directories when the head alone
+                 is not conclusive; only those few KB are read, and the position is restored.
+
+    Returns:
+        str: The MIME type, or None when the signature is not conclusive
+             (callers then fall back to libmagic, see detect_mime).
+    """
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if head.startswith((b'GIF87a', b'GIF89a')):
+        return 'image/gif'
+    # Readers accept the PDF header anywhere in the first 1KB (some generators prepend junk)
+    if head.startswith(b'%PDF-') or b'%PDF-' in head[:1024]:
+        return 'application/pdf'
+    if head.startswith(b'PK\x03\x04'):
+        # A .docx is a ZIP with word/... entries. They are often not among the first
+        # entries ([Content_Types].xml and _rels/ usually are), so check the central directory
+        if b'word/' in head or (fileobj is not None and _zip_is_docx(fileobj)):
+            return DOCX_MIME
+        return None
+    if head.startswith(OLE2_MAGIC):
+        # The directory holding the stream names may sit beyond the head
+        if WORD_STREAM_NAME in head or (fileobj is not None and _ole2_has_word_stream(head, fileobj)):
+            return 'application/msword'
+        return None
+    return None
+
+
+def _zip_is_docx(fileobj):
+    """True if the ZIP's central directory lists [Content_Types].xml and word/ entries."""
+    position = fileobj.tell()
+    try:
+        # ZipFile seeks to the end-of-archive record and reads only the central directory
+        names = zipfile.ZipFile(fileobj).namelist()
+    except (zipfile.BadZipFile, OSError, ValueError):
+        return False
+    finally:
+        fileobj.seek(position)
+    return '[Content_Types].xml' in names and any(name.startswith('word/') for name in names)
+
+
+def _ole2_has_word_stream(head, fileobj):
+    """True if the first sector of the OLE2 directory holds a WordDocument stream entry."""
+    if len(head) < 52:
+        return False
+    sector_size = 1 << struct.unpack_from('<H', head, 30)[0]
+    first_directory_sector = struct.unpack_from('<I', head, 48)[0]
+    if sector_size not in (512, 4096) or first_directory_sector >= 0xFFFFFFFA:
+        return False
+    position = fileobj.tell()
+    try:
+        # Sector n starts after the one-sector header
+        fileobj.seek((first_directory_sector + 1) * sector_size)
+        directory = fileobj.read(sector_size)
+    except (OSError, ValueError):
+        return False
+    finally:
+        fileobj.seek(position)
+    return WORD_STREAM_NAME in directory
+
+
+def libmagic_mime(head):
+    """
+    MIME type from libmagic (python-magic), or None if it is not installed.
+    One magic handle is kept per thread: loading the database is the expensive part
+    and a handle must not be shared between threads.
+    """
+    global _libmagic_missing
+    if _libmagic_missing:
+        return None
+
+    handle = getattr(_libmagic, 'handle', None)
+    if handle is None:
+        try:
+            import magic # Optional dependency, only needed for inconclusive files
+        except ImportError:
+            _libmagic_missing = True
+            logger.warning("python-magic is not installed; files the fast MIME check cannot identify will be rejected")
+            return None
+        handle = _libmagic.handle = magic.Magic(mime=True)
+    return handle.from_buffer(head)
+
+
+def detect_mime(head, fileobj=None):
+    """MIME type of a file from its first bytes: fast signature check first, libmagic only if needed."""
+    return sniff_mime(head, fileobj) or libmagic_mime(head)
+
+
+def is_allowed_content(head, allowed_mime_types, fileobj=None, extension=None):
+    """
+    Returns (allowed, detected_mime) for the first bytes of an upload checked
+    against an allowed set such as Config.ALLOWED_MIME_TYPES.
+    With extension (e.g. '.pdf'), the content must also be a type that extension may hold.
+    """
+    detected = detect_mime(head, fileobj)
+    allowed = detected in allowed_mime_types
+    if allowed and extension is not None:
+        allowed = detected in MIME_TYPES_BY_EXTENSION.get(extension.lower(), set())
+    return allowed, detected
+
+
+def head_is_disallowed(head, allowed_mime_types, extension=None):
+    """
+    Early check of the first SNIFF_BYTES of an upload that is still arriving.
+    True only when the head alone proves is_allowed_content will reject the file;
+    ZIP and OLE2 files the head cannot identify are left for the full check, which
+    reads their directories. An extension we do not map is left to the extension check.
+    """
+    if head.startswith((b'PK\x03\x04', OLE2_MAGIC)) and sniff_mime(head) is None:
+        return False
+    if extension is not None and extension.lower() not in MIME_TYPES_BY_EXTENSION:
+        extension = None
+    return not is_allowed_content(head, allowed_mime_types, extension=extension)[0]
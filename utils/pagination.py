@@ -0,0 +1,80 @@
+import base64
+import binascii
+import logging
+from datetime import datetime
+from bson import ObjectId
+
+logger = logging.getLogger(__name__)
+
+# Newest first; _id breaks ties between documents uploaded in the same millisecond
+KEYSET_SORT = [('upload_date', -1), ('_id', -1)]
+
+
+def encode_cursor(document):
+    """
+    Builds an opaque page cursor from the last document of a page.
+    The cursor is the document's (upload_date, _id) pair, URL-safe base64 encoded.
+    """
+    upload_date = document.get('upload_date')
+    if not isinstance(upload_date, datetime):
+        return None
+    raw = f"{upload_date.isoformat()}|{document['_id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """
+    Reverses encode_cursor. Returns (upload_date, ObjectId) or None if the
+    token is missing or malformed (callers then start from the first page).
+    """
+    if not token:
+        return None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+        date_part, id_part = raw.split('|', 1)
+        if not ObjectId.is_valid(id_part):
+            return None
+        return datetime.fromisoformat(date_part), ObjectId(id_part)
+    except (ValueError, binascii.Error, UnicodeDecodeError) as e:
+        logger.warning(f"Ignoring malformed page cursor '{token}': {e}")
+        return None
+
+
+def keyset_filter(cursor):
+    """Mongo filter selecting documents that sort strictly after the cursor position."""
+    upload_date, last_id = cursor
+    return {'$or': [
+        {'upload_date': {'$lt': upload_date}},
+        {'upload_date': upload_date, '_id': {'$lt': last_id}},
+    ]}
+
+
+def fetch_page(collection, query, projection, cursor_token, page_size):
+    """
+    Fetches one page of documents ordered newest first using keyset pagination.
+
+    Args:
+        collection: pymongo collection to read from.
+        query (dict): Filter for the listing (status, user_id, ...).
+        projection (dict): Fields to return.
+        cursor_token (str): Cursor from a previous page, or None for the first page.
+        page_size (int): Number of documents per page.
+
+    Returns:
+        (documents, next_cursor): next_cursor is None on the last page.
+
+    Each page is a single indexed range scan of page_size + 1 documents, no matter
+    how deep into the listing the page is (unlike skip/limit).
+    """
+    cursor = decode_cursor(cursor_token)
+    if cursor:
+        query = {'$and': [query, keyset_filter(cursor)]} if query else keyset_filter(cursor)
+
+    # Ask for one extra document to learn whether another page exists
+    documents = list(collection.find(query, projection).sort(KEYSET_SORT).limit(page_size + 1))
+    next_cursor = None
+    if len(documents) > page_size:
+        documents = documents[:page_size]
+        next_cursor = encode_cursor(documents[-1])
+    return documents, next_cursor
@@ -0,0 +1,98 @@
+import hashlib
+import mimetypes
+import os
+import threading
+import logging
+from typing import NamedTuple
+
+logger = logging.getLogger(__name__)
+
+
+class TemplateEntry(NamedTuple):
+    """One downloadable form template as recorded in the manifest."""
+    name: str
+    size: int
+    mtime_ns: int
+    sha256: str
+    mimetype: str
+
+    @property
+    def etag(self):
+        # Content hash, so the ETag only changes when the file's bytes do
+        return self.sha256
+
+
+class TemplateManifest:
+    """
+    In-memory listing of TEMPLATE_DOWNLOAD_FOLDER shared by the dashboard and
+    download_template.
+
+    The folder is scanned again only when its own mtime changes (a file was
+    added, removed or renamed); otherwise every lookup is a single stat of the
+    directory. On a rescan, files whose size and mtime are unchanged keep their
+    previous hash instead of being read again. Replacing a template's content in
+    place does not touch the directory mtime, so publish new versions by writing
+    a new file and renaming it over the old one.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._directory = None
+        self._dir_mtime_ns = None
+        self._entries = {}
+
+    def entries(self, directory):
+        """Return {name: TemplateEntry} for directory, rescanning only if it changed."""
+        dir_mtime_ns = os.stat(directory).st_mtime_ns
+        if directory == self._directory and dir_mtime_ns == self._dir_mtime_ns:
+            return self._entries
+
+        with self._lock:
+            if directory != self._directory or dir_mtime_ns != self._dir_mtime_ns:
+                previous = self._entries if directory == self._directory else {}
+                self._entries = self._scan(directory, previous)
+                self._directory = directory
+                self._dir_mtime_ns = dir_mtime_ns
+                logger.info(f"Template manifest rebuilt for {directory}: {len(self._entries)} files")
+            return self._entries
+
+    def names(self, directory):
+        """Sorted template file names, for listing on the dashboard."""
+        return sorted(self.entries(directory))
+
+    def get(self, directory, name):
+        """The TemplateEntry for name, or None if no such template file exists."""
+        return self.entries(directory).get(name)
+
+    @staticmethod
+    def _scan(directory, previous):
+        entries = {}
+        with os.scandir(directory) as it:
+            for item in it:
+                if not item.is_file():
+                    continue
+                stat = item.stat()
+                known = previous.get(item.name)
+                if known and known.size == stat.st_size and known.mtime_ns == stat.st_mtime_ns:
+                    entries[item.name] = known
+                    continue
+                entries[item.name] = TemplateEntry(
+                    name=item.name,
+                    size=stat.st_size,
+                    mtime_ns=stat.st_mtime_ns,
+                    sha256=_hash_file(item.path),
+                    mimetype=mimetypes.guess_type(item.name)[0] or 'application/octet-stream',
+                )
+        return entries
+
+
+def _hash_file(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Shared by the dashboard and the template download route
+template_manifest = TemplateManifest()
@@ -0,0 +1,176 @@
+import errno
+import hashlib
+import os
+import tempfile
+import logging
+from flask import Request, current_app
+from werkzeug.exceptions import RequestEntityTooLarge, UnsupportedMediaType
+from utils.mime_sniff import SNIFF_BYTES, head_is_disallowed
+
+logger = logging.getLogger(__name__)
+
+# Chunk size used when copying a non-streamed file object (see stream_to_upload_folder)
+COPY_CHUNK_SIZE = 64 * 1024
+
+
+class DisallowedContent(UnsupportedMediaType):
+    """Raised while streaming as soon as the first bytes show the upload is not an allowed type."""
+    description = 'The file content is not an allowed document type.'
+
+
+class HashingFileStream:
+    """
+    Writable/readable temporary file inside the upload folder that hashes as it goes.
+
+    Werkzeug's multipart parser writes each chunk of an uploaded file straight into
+    this object, so by the time the request's form is parsed the bytes are already
+    on disk next to their final location, with their SHA-256 and size computed in
+    the same pass; the first few KB are kept in .head for content-type checks.
+    With allowed_mime_types, the head is sniffed as soon as it is complete and a
+    disallowed file is refused there (DisallowedContent) instead of being received in full.
+    commit() then publishes the file with a single rename.
+    """
+
+    def __init__(self, directory, max_size=None, allowed_mime_types=None, extension=None):
+        os.makedirs(directory, exist_ok=True)
+        # mkstemp creates the file with O_EXCL, so concurrent workers never share a temp file
+        fd, self.path = tempfile.mkstemp(dir=directory, prefix='.upload-', suffix='.part')
+        self._file = os.fdopen(fd, 'w+b')
+        self._hash = hashlib.sha256()
+        self.max_size = max_size
+        self.size = 0
+        self.head = b'' # First SNIFF_BYTES of the content, for MIME sniffing without re-reading
+        self.allowed_mime_types = allowed_mime_types
+        self.extension = extension
+        self.committed = False
+        self._finished = False
+
+    @property
+    def sha256(self):
+        return self._hash.hexdigest()
+
+    def write(self, data):
+        self.size += len(data)
+        if self.max_size is not None and self.size > self.max_size:
+            raise RequestEntityTooLarge()
+        if len(self.head) < SNIFF_BYTES:
+            self.head += bytes(data[:SNIFF_BYTES - len(self.head)])
+            # Checked once, on the write that completes the head; shorter files get the full check in store_stream
+            if (len(self.head) == SNIFF_BYTES and self.allowed_mime_types is not None
+                    and head_is_disallowed(self.head, self.allowed_mime_types, self.extension)):
+                raise DisallowedContent()
+        self._hash.update(data)
+        return self._file.write(data)
+
+    def commit(self, destination, exclusive=False):
+        """
+        Flush and atomically move the temp file to destination (same filesystem).
+        With exclusive=True an existing destination is never replaced: FileExistsError
+        is raised instead and the temp file is left for discard().
+        """
+        self._file.flush()
+        self._file.close()
+        if exclusive:
+            publish_exclusive(self.path, destination)
+        else:
+            os.replace(self.path, destination)
+        self.committed = self._finished = True
+        return destination
+
+    def discard(self):
+        """Remove the temp file unless it was committed. Safe to call repeatedly."""
+        if not self._file.closed:
+            self._file.close()
+        if self._finished:
+            return
+        self._finished = True
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error(f"Could not remove temporary upload file {self.path}: {e}")
+
+    # Werkzeug/FileStorage read the stream back through the usual file API
+    def __getattr__(self, name):
+        if name == '_file':
+            raise AttributeError(name)
+        return getattr(self._file, name)
+
+    def __iter__(self):
+        return iter(self._file)
+
+
+def publish_exclusive(source, destination):
+    """
+    Moves source to destination only if destination does not exist yet, in O(1).
+
+    A hard link is created with exclusive-create semantics (the kernel refuses if
+    the name is taken), so two processes racing for the same name cannot both
+    win and no exists() probe is needed. source must be on the same filesystem,
+    which is why temp files are created inside the destination folder.
+    Raises FileExistsError if destination already exists.
+
+    There is deliberately no fallback for filesystems without hard links: any
+    other way to get exclusive creation briefly exposes an empty placeholder
+    under the final name, which downloads and exports would serve.
+    """
+    try:
+        os.link(source, destination)
+    except FileExistsError:
+        raise
+    except OSError as e:
+        if e.errno in (errno.EPERM, errno.ENOTSUP, errno.EOPNOTSUPP, errno.ENOSYS):
+            raise OSError(e.errno, f"Cannot publish {destination}: the upload folder's filesystem "
+                                   f"does not support hard links ({e.strerror})") from e
+        raise
+    os.remove(source)
+
+
+class StreamingUploadRequest(Request):
+    """
+    Request class that streams multipart file parts into HashingFileStream objects
+    in the upload folder instead of Werkzeug's spooled temporary files.
+    Any stream that was not committed is deleted when the request is closed.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        stream = HashingFileStream(current_app.config['UPLOAD_FOLDER'], max_size=self.max_content_length,
+                                   allowed_mime_types=current_app.config.get('ALLOWED_MIME_TYPES', set()),
+                                   extension=os.path.splitext(filename or '')[1])
+        self.__dict__.setdefault('_upload_streams', []).append(stream)
+        return stream
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            for stream in self.__dict__.pop('_upload_streams', []):
+                stream.discard()
+
+
+def stream_to_upload_folder(file):
+    """
+    Returns a HashingFileStream holding the contents of a werkzeug FileStorage.
+
+    Files parsed by StreamingUploadRequest already are one; anything else (a file
+    built by hand, or parsed by a plain Request) is copied over in fixed chunks,
+    with the same incremental size limit and early content check.
+    """
+    if isinstance(file.stream, HashingFileStream):
+        return file.stream
+
+    stream = HashingFileStream(current_app.config['UPLOAD_FOLDER'],
+                               max_size=current_app.config.get('MAX_CONTENT_LENGTH'),
+                               allowed_mime_types=current_app.config.get('ALLOWED_MIME_TYPES', set()),
+                               extension=os.path.splitext(file.filename or '')[1])
+    try:
+        while True:
+            chunk = file.stream.read(COPY_CHUNK_SIZE)
+            if not chunk:
+                break
+            stream.write(chunk)
+    except Exception:
+        stream.discard()
+        raise
+    return stream